@@ -10,6 +10,51 @@ class Settings(BaseSettings):
     JWT_ALGORITHM: str = "HS256"
     ACCESS_TOKEN_EXPIRE_MINUTES: int = 30
 
+    # Background jobs
+    # False: this API process starts no background job; they run in `python -m app.worker`
+    RUN_BACKGROUND_JOBS: bool = True
+    SUMMARY_JOB_CONCURRENCY: int = 16
+    SUMMARY_JOB_BATCH_SIZE: int = 500
+    DCA_SCHEDULER_MAX_SLEEP_SECONDS: int = 600
+    DCA_SCHEDULER_POLL_SECONDS: int = 30
+    DCA_JOB_CONCURRENCY: int = 16
+    DCA_JOB_BATCH_SIZE: int = 500
+    PRICE_BAND_INDEX_REFRESH_SECONDS: int = 300
+    JOB_LEASE_TTL_SECONDS: int = 30
+
+    # Upstream HTTP client
+    HTTP_TIMEOUT_SECONDS: float = 15.0
+    HTTP_CONNECT_TIMEOUT_SECONDS: float = 5.0
+    HTTP_KEEPALIVE_EXPIRY_SECONDS: float = 30.0
+    HTTP_COINGECKO_MAX_CONNECTIONS: int = 10
+    HTTP_BLOCKSTREAM_MAX_CONNECTIONS: int = 10
+    # Requests per second per upstream host (0 = unlimited)
+    HTTP_COINGECKO_REQUESTS_PER_SECOND: float = 0.5
+    HTTP_BLOCKSTREAM_REQUESTS_PER_SECOND: float = 10.0
+    BLOCKCHAIN_SYNC_CHUNK_SIZE: int = 500
+    # Oldest day (in days before today) CoinGecko serves history for; 365 on the demo API, 0 = no limit
+    COINGECKO_HISTORY_MAX_DAYS: int = 365
+    # A price day CoinGecko could not fill is not requested again for this long
+    PRICE_HISTORY_RETRY_SECONDS: int = 3600
+    BLOCKCHAIN_RELOAD_CONCURRENCY: int = 4
+
+    # Caches
+    PORTFOLIO_CACHE_SIZE: int = 1024
+    LATEST_PRICE_MAX_AGE_SECONDS: int = 90
+    PRICE_FOLLOWER_POLL_SECONDS: int = 10
+
+    # Live price stream
+    PRICE_STREAM_QUEUE_SIZE: int = 4
+    PRICE_STREAM_KEEPALIVE_SECONDS: int = 15
+
+    # Imports
+    CSV_IMPORT_CHUNK_SIZE: int = 1000
+    # Import jobs running at once in each process that runs background jobs
+    IMPORT_JOB_CONCURRENCY: int = 2
+    IMPORT_JOB_POLL_SECONDS: int = 5
+    # A running job without progress for this long is considered crashed and resumed
+    IMPORT_JOB_STALE_SECONDS: int = 300
+
 @lru_cache
 def get_settings():
     return Settings()
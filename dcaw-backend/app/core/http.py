@@ -0,0 +1,81 @@
+import asyncio
+import time
+import httpx
+from app.core.config import settings
+
+class HTTPClient:
+    client: httpx.AsyncClient = None
+
+http = HTTPClient()
+
+class RateLimiter:
+    """
+    Spaces calls to at most `rate_per_second`, shared by every task of the process:
+    each caller reserves the next free slot and sleeps until it.
+    """
+
+    def __init__(self, rate_per_second: float):
+        self.interval = 1 / rate_per_second
+        self._next_slot = 0.0
+
+    async def acquire(self):
+        now = time.monotonic()
+        slot = max(now, self._next_slot)
+        self._next_slot = slot + self.interval
+        if slot > now:
+            await asyncio.sleep(slot - now)
+
+_rate_limiters = {
+    host: RateLimiter(rate)
+    for host, rate in (
+        ("api.coingecko.com", settings.HTTP_COINGECKO_REQUESTS_PER_SECOND),
+        ("blockstream.info", settings.HTTP_BLOCKSTREAM_REQUESTS_PER_SECOND),
+    )
+    if rate > 0
+}
+
+async def _rate_limit(request: httpx.Request):
+    """Request hook: waits for the rate limit of the request's host."""
+    limiter = _rate_limiters.get(request.url.host)
+    if limiter is not None:
+        await limiter.acquire()
+
+def _host_transport(max_connections: int) -> httpx.AsyncHTTPTransport:
+    """Connection pool for a single upstream host."""
+    return httpx.AsyncHTTPTransport(
+        limits=httpx.Limits(
+            max_connections=max_connections,
+            max_keepalive_connections=max_connections,
+            keepalive_expiry=settings.HTTP_KEEPALIVE_EXPIRY_SECONDS,
+        ),
+        retries=1,
+    )
+
+def _create_client() -> httpx.AsyncClient:
+    return httpx.AsyncClient(
+        timeout=httpx.Timeout(settings.HTTP_TIMEOUT_SECONDS, connect=settings.HTTP_CONNECT_TIMEOUT_SECONDS),
+        headers={"accept": "application/json"},
+        event_hooks={"request": [_rate_limit]},
+        mounts={
+            "https://api.coingecko.com": _host_transport(settings.HTTP_COINGECKO_MAX_CONNECTIONS),
+            "https://blockstream.info": _host_transport(settings.HTTP_BLOCKSTREAM_MAX_CONNECTIONS),
+        },
+    )
+
+async def init_http_client():
+    """Creates the shared pooled HTTP client used for every upstream call."""
+    if http.client is None:
+        http.client = _create_client()
+        print("Cliente HTTP compartilhado inicializado.")
+
+async def close_http_client():
+    if http.client:
+        await http.client.aclose()
+        http.client = None
+        print("Cliente HTTP compartilhado fechado.")
+
+def get_http_client() -> httpx.AsyncClient:
+    """Returns the shared HTTP client, creating it if the app startup hook has not run (e.g. in scripts)."""
+    if http.client is None:
+        http.client = _create_client()
+    return http.client
@@ -3,17 +3,23 @@ from fastapi.middleware.cors import CORSMiddleware
 from dotenv import load_dotenv
 import os
 import asyncio
-from app.db.connection import connect_db, close_db, get_database_client
-from app.services.dca_service import run_dca_scheduler
+from app.core.config import settings
+from app.db.connection import connect_db, close_db
+from app.core.http import init_http_client, close_http_client
 from app.routes.auth import auth_router
 from app.routes.wallet import router as wallet_router
 from app.routes.transaction import router as transaction_router
-from app.price_fetcher import price_fetching_scheduler
+from app.price_fetcher import price_follower
 from app.routes.user import user_router
 from app.routes.imports import import_router # Import the new import router
 from app.routes.price import router as price_router # Import the new price router
-
-from app.scheduler import init_scheduler
+from app.services.blockchain_sync import ensure_transaction_indexes, migrate_embedded_synced_transactions
+from app.services.csv_importer import backfill_import_fingerprints, ensure_import_indexes
+from app.services.import_jobs import ensure_import_job_indexes
+from app.services.leases import ensure_lease_indexes
+from app.services.ledger import ensure_ledger_indexes
+from app.services.summary_storage import ensure_summary_indexes
+from app.worker import start_background_jobs
 
 print("Running DCA Wallet Backend Swagger on: http://localhost:8000/docs")
 load_dotenv() # Carrega as variáveis de ambiente do .env
@@ -23,24 +29,27 @@ app = FastAPI(
     title="DCA Wallet Backend",
     description="API for managing DCA Wallets, transactions, and user authentication.",
     version="0.1.0",
-    on_startup=[connect_db],
-    on_shutdown=[close_db],
+    on_startup=[connect_db, init_http_client],
+    on_shutdown=[close_db, close_http_client],
 )
 
-async def start_dca_scheduler():
-    """Starts the DCA background scheduler."""
-    db_client = await get_database_client()
-    while True:
-        await run_dca_scheduler(db_client)
-        await asyncio.sleep(600)  #10 minutes interval
-
 @app.on_event("startup")
 async def startup_event():
     # The connect_db function is already in the on_startup list of FastAPI
     # We create the task here to ensure the DB is connected first
-    init_scheduler()  # Initialize the new summary scheduler
-    asyncio.create_task(start_dca_scheduler())
-    asyncio.create_task(price_fetching_scheduler())
+    await ensure_ledger_indexes()
+    await ensure_transaction_indexes()
+    await migrate_embedded_synced_transactions()
+    await ensure_import_indexes()
+    await backfill_import_fingerprints()
+    await ensure_import_job_indexes()
+    await ensure_summary_indexes()
+    await ensure_lease_indexes()
+    if settings.RUN_BACKGROUND_JOBS:
+        start_background_jobs(follow_prices=True)
+    else:
+        # API-only mode: jobs run in `python -m app.worker`; prices come from the ticks it stores
+        asyncio.create_task(price_follower())
 
 
 app.include_router(auth_router, prefix="/api/auth", tags=["Authentication"])
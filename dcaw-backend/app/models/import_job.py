@@ -0,0 +1,21 @@
+from pydantic import BaseModel
+from typing import Literal, Optional
+from datetime import datetime
+
+class ImportJobOut(BaseModel):
+    id: str
+    kind: Literal["csv", "blockchain"]
+    status: Literal["queued", "running", "completed", "cancelled", "failed"]
+    wallet_id: str
+    rows_processed: int = 0 # Rows of every committed chunk
+    inserted: int = 0
+    skipped: int = 0 # Rows the wallet already had
+    committed_chunks: int = 0 # A resumed job continues after the last one
+    throughput_rows_per_second: Optional[float] = None # Over the current (or last) run
+    cancel_requested: bool = False
+    resumable: bool = False # Cancelled or failed jobs whose progress was kept
+    error: Optional[str] = None
+    attempts: int = 0 # Runs started, including resumes
+    created_at: datetime
+    updated_at: Optional[datetime] = None
+    finished_at: Optional[datetime] = None
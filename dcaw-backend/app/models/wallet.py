@@ -9,9 +9,16 @@ class DCAConfiguration(BaseModel):
     dca_currency: str # e.g., "USD", "BRL"
     dca_frequency: str # e.g., "daily", "weekly", "monthly"
     dca_last_executed: Optional[datetime] = None # New: Timestamp of last DCA execution
+    next_execution_at: Optional[datetime] = None # Computed by the DCA scheduler; indexed for due-time queries
+    waiting_for_price: bool = False # Due, but the price is outside the range; bought when a tick enters it
     dca_price_range_min: Optional[float] = None
     dca_price_range_max: Optional[float] = None
 
+class DCABacktestRequest(BaseModel):
+    start_date: datetime
+    end_date: Optional[datetime] = None # Defaults to now
+    configurations: List[DCAConfiguration] = Field(..., min_length=1, max_length=1000) # Amounts are simulated in USD
+
 class WalletBase(BaseModel):
     label: str
     addresses: List[str] = Field(default_factory=list) # Initialize as empty list
@@ -23,10 +30,10 @@ class WalletBase(BaseModel):
     dca_enabled: bool = False
     dca_settings: List[DCAConfiguration] = Field(default_factory=list)
 
-    # Blockchain-Synced Wallet fields (unchanged)
+    # Blockchain-Synced Wallet fields (the transactions themselves are stored in the synced_transactions collection)
     is_blockchain_synced: bool = False
     wallet_address: Optional[str] = None
-    synced_transactions: List[dict] = Field(default_factory=list)
+    sync_cursor: Optional[dict] = None # {"block_height", "txid"} of the newest synced transaction
     current_btc_balance: float = 0.0
 
 class Wallet(WalletBase, Document):
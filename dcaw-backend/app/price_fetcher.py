@@ -1,85 +1,23 @@
 import asyncio
 from datetime import datetime, timezone, timedelta
-import requests
-from dotenv import load_dotenv
-import os
 
-from app.db.connection import db
-
-load_dotenv()
-
-COINGECKO_API_KEY = os.getenv("COINGECKO_API_KEY")
-MAX_RECORDS = 144
-
-# --- CoinGecko API Functions ---
-
-def get_coingecko_headers() -> dict:
-    """Returns headers for CoinGecko API, including the API key if available."""
-    headers = {"accept": "application/json"}
-    if COINGECKO_API_KEY:
-        headers["x-cg-demo-api-key"] = COINGECKO_API_KEY
-    return headers
-
-async def fetch_btc_prices() -> dict:
-    """Fetches the current BTC price in USD and BRL from CoinGecko."""
-    url = "https://api.coingecko.com/api/v3/simple/price"
-    params = {"ids": "bitcoin", "vs_currencies": "usd,brl"}
-    headers = get_coingecko_headers()
-    
-    try:
-        loop = asyncio.get_running_loop()
-        resp = await loop.run_in_executor(None, lambda: requests.get(url, params=params, headers=headers))
-        resp.raise_for_status()
-        data = resp.json()
-        
-        btc_usd = data["bitcoin"]["usd"]
-        btc_brl = data["bitcoin"]["brl"]
-        usd_brl_calculated = btc_brl / btc_usd if btc_usd else 0
-        
-        return {
-            "btc_usd_price": btc_usd,
-            "btc_brl_price": btc_brl,
-            "usd_brl_calculated": round(usd_brl_calculated, 4),
-            "last_updated": datetime.now(timezone.utc).isoformat()
-        }
-    except requests.exceptions.RequestException as e:
-        print(f"Error fetching current Bitcoin prices: {e}")
-        return None
-
-# --- Database Functions ---
-
-async def initialize_price_collection():
-    """
-    Ensures the capped collection for prices exists.
-    Population is no longer done here; it happens organically via the scheduler.
-    """
-    database = db.db
-    collection_name = "last_24h_price"
-    
-    if collection_name not in await database.list_collection_names():
-        await database.create_collection(collection_name, capped=True, size=1000000, max=MAX_RECORDS)
-        print(f"Created capped collection '{collection_name}'.")
-
-async def save_price_to_db(price_data: dict):
-    price_collection = db.db["last_24h_price"]
-    document = {
-        "timestamp": datetime.fromisoformat(price_data["last_updated"]),
-        "btc_usd_price": price_data["btc_usd_price"],
-        "btc_brl_price": price_data["btc_brl_price"]
-    }
-    await price_collection.insert_one(document)
-    print(f"Saved new price record to DB at {price_data['last_updated']}.")
+from app.core.config import settings
+from app.services.coingecko import fetch_btc_prices
+from app.services.dca_triggers import on_price_tick
+from app.services.price_broadcast import price_hub
+from app.services.price_cache import latest_price_cache
+from app.services.price_history import sync_price_history
+from app.services.price_tiers import get_latest_price_tick, initialize_price_tiers, record_price_tick
 
 # --- Main Scheduler ---
 async def price_fetching_scheduler():
     print("Initializing price fetching scheduler...")
     await asyncio.sleep(5) 
-    await initialize_price_collection()
+    await initialize_price_tiers()
+    await sync_price_history()
     
     fetch_interval = 60
-    save_interval = 600
     last_fetch_time = datetime.now(timezone.utc) - timedelta(seconds=fetch_interval)
-    last_save_time = datetime.now(timezone.utc) - timedelta(seconds=save_interval)
 
     while True:
         now = datetime.now(timezone.utc)
@@ -87,33 +25,32 @@ async def price_fetching_scheduler():
             print("Fetching Bitcoin prices...")
             last_fetch_time = now
             btc_prices = await fetch_btc_prices()
-
-            if btc_prices and (now - last_save_time).total_seconds() >= save_interval:
-                print("10-minute interval reached. Saving price to database...")
-                await save_price_to_db(btc_prices)
-                last_save_time = now
+            if btc_prices:
+                latest_price_cache.update(btc_prices)
+                price_hub.publish(btc_prices)
+                # Every tick is kept; the tiers downsample it to 10m, 1h and 1d
+                await record_price_tick(btc_prices)
+                try:
+                    await on_price_tick(btc_prices["btc_usd_price"])
+                except Exception as e:
+                    print(f"Error evaluating DCA price triggers: {e}")
         await asyncio.sleep(5)
 
 
-async def fetch_btc_historical_price(date: datetime) -> float:
-    """Fetches the historical BTC price in USD for a given date from CoinGecko."""
-    # CoinGecko API requires date in dd-mm-yyyy format
-    date_str = date.strftime("%d-%m-%Y")
-    url = f"https://api.coingecko.com/api/v3/coins/bitcoin/history?date={date_str}"
-    headers = get_coingecko_headers()
-    
-    try:
-        loop = asyncio.get_running_loop()
-        resp = await loop.run_in_executor(None, lambda: requests.get(url, headers=headers))
-        resp.raise_for_status()
-        data = resp.json()
-        
-        if "market_data" in data and "current_price" in data["market_data"] and "usd" in data["market_data"]["current_price"]:
-            return data["market_data"]["current_price"]["usd"]
-        else:
-            print(f"Warning: Could not find historical price for {date_str}. Response: {data}")
-            return 0.0  # Return 0 if price not found, so it doesn't break calculations
-            
-    except requests.exceptions.RequestException as e:
-        print(f"Error fetching historical Bitcoin price for {date_str}: {e}")
-        return 0.0 # Return 0 on error
+async def price_follower():
+    """
+    Runs in the processes that do not hold the price fetcher lease: feeds the in-memory
+    cache and the live stream from the ticks stored by the fetching process, so only
+    that one calls CoinGecko.
+    """
+    last_updated = None
+    while True:
+        try:
+            tick = await get_latest_price_tick()
+            if tick and tick["last_updated"] != last_updated:
+                last_updated = tick["last_updated"]
+                latest_price_cache.update(tick)
+                price_hub.publish(tick)
+        except Exception as e:
+            print(f"Error reading the latest stored Bitcoin price: {e}")
+        await asyncio.sleep(settings.PRICE_FOLLOWER_POLL_SECONDS)
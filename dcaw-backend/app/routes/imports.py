@@ -1,19 +1,33 @@
-from fastapi import APIRouter, Depends, UploadFile, File, Form, HTTPException, status
-from typing import Optional, List
+from fastapi import APIRouter, Body, Depends, UploadFile, File, Form, HTTPException, status
+from starlette.concurrency import run_in_threadpool
+from typing import List, Optional
+from app.core.config import settings
 from app.core.security import get_current_user
 from app.models.models import User
-from app.models.wallet import WalletCreate, WalletOut
-from app.models.transaction import TransactionCreate, TransactionOut
+from app.models.wallet import WalletCreate
+from app.models.import_job import ImportJobOut
 from app.db.connection import db
+from app.services.blockchain import validate_btc_address
 from app.services.csv_importer import CoinMarketCapCSVImporter
+from app.services.import_jobs import (
+    cancel_import_job,
+    get_import_job,
+    import_job_out,
+    list_import_jobs,
+    resume_import_job,
+    submit_blockchain_import,
+    submit_csv_import,
+)
 from datetime import datetime
 from bson import ObjectId
+import io
 
 import_router = APIRouter()
 
 @import_router.post(
     "/coinmarketcap",
-    response_model=List[TransactionOut],
+    response_model=ImportJobOut,
+    status_code=status.HTTP_202_ACCEPTED,
     summary="Import CoinMarketCap CSV transactions",
     description="Upload a CoinMarketCap CSV file to create a new BTC wallet or add transactions to an existing one. Only BTC transactions are supported."
 )
@@ -26,8 +40,12 @@ async def import_coinmarketcap_csv(
     """
     Handles the upload of a CoinMarketCap CSV file.
     Transactions can be imported into a new BTC wallet or an existing one.
-    Validates CSV format and ensures only BTC transactions are processed.
-    Automatically updates wallet BTC holdings.
+    Validates the CSV headers and first rows, then queues the import as a background
+    job and returns it at once; its progress is polled at `/jobs/{job_id}`.
+    The job streams the file in batches of CSV_IMPORT_CHUNK_SIZE transactions, so memory
+    use does not depend on its size; an invalid row fails the job and discards the
+    transactions already written. Rows the wallet already has (same fingerprint, e.g.
+    from an earlier or overlapping export) are skipped.
     """
     if not new_wallet_label and not wallet_id:
         raise HTTPException(
@@ -41,21 +59,23 @@ async def import_coinmarketcap_csv(
             detail="Cannot create a new wallet and specify an existing wallet ID at the same time. Choose one."
         )
 
-    # Read CSV content
-    csv_content = (await file.read()).decode("utf-8")
-
+    # The first chunk is checked before any wallet is touched (headers, empty files)
+    csv_text = io.TextIOWrapper(file.file, encoding="utf-8", newline="")
+    chunks = CoinMarketCapCSVImporter.iter_csv_chunks(csv_text, settings.CSV_IMPORT_CHUNK_SIZE)
     try:
-        parsed_transactions_data = CoinMarketCapCSVImporter.parse_csv(csv_content)
-        if not parsed_transactions_data:
-            raise HTTPException(
-                status_code=status.HTTP_400_BAD_REQUEST,
-                detail="No valid BTC transactions found in the CSV file or CSV is empty after parsing."
-            )
+        chunk = await run_in_threadpool(next, chunks, None)
     except ValueError as e:
         raise HTTPException(
             status_code=status.HTTP_400_BAD_REQUEST,
             detail=f"CSV parsing error: {e}"
         )
+    finally:
+        csv_text.detach() # Keeps the upload open to store it
+    if not chunk:
+        raise HTTPException(
+            status_code=status.HTTP_400_BAD_REQUEST,
+            detail="No valid BTC transactions found in the CSV file or CSV is empty after parsing."
+        )
 
     target_wallet = None
     if wallet_id:
@@ -63,7 +83,10 @@ async def import_coinmarketcap_csv(
             raise HTTPException(status_code=400, detail="Invalid Wallet ID format.")
         
         # Add user_id to the query to ensure ownership
-        target_wallet = await db.db.wallets.find_one({"_id": ObjectId(wallet_id), "user_id": str(current_user.id)})
+        target_wallet = await db.db.wallets.find_one(
+            {"_id": ObjectId(wallet_id), "user_id": str(current_user.id)},
+            {"currency": 1}
+        )
         if not target_wallet:
             raise HTTPException(status_code=status.HTTP_404_NOT_FOUND, detail="Wallet not found or does not belong to the current user.")
         
@@ -82,49 +105,110 @@ async def import_coinmarketcap_csv(
             dca_settings=[], # Initialize empty DCA settings
             is_blockchain_synced=False,
             wallet_address=None,
-            synced_transactions=[],
             current_btc_balance=0.0,
-            user_id=str(current_user.id) # Assign wallet to the current user
         )
-        insert_result = await db.db.wallets.insert_one(new_wallet_data.dict(exclude_unset=True))
-        target_wallet = await db.db.wallets.find_one({"_id": insert_result.inserted_id})
+        new_wallet_doc = new_wallet_data.dict(exclude_unset=True)
+        new_wallet_doc["created_at"] = datetime.utcnow()
+        new_wallet_doc["user_id"] = str(current_user.id) # Assign wallet to the current user (WalletCreate has no user_id)
+        insert_result = await db.db.wallets.insert_one(new_wallet_doc)
+        target_wallet = await db.db.wallets.find_one({"_id": insert_result.inserted_id}, {"currency": 1})
         if not target_wallet:
             raise HTTPException(status_code=status.HTTP_500_INTERNAL_SERVER_ERROR, detail="Failed to create new wallet.")
         target_wallet["id"] = str(target_wallet["_id"])
         print(f"New wallet created with ID: {target_wallet['id']}")
 
 
-    wallet_obj_id = target_wallet["_id"]
-    wallet_pydantic_id = str(wallet_obj_id)
-    
-    imported_transactions_out = []
-    current_btc_holdings_for_wallet = target_wallet.get("btc_holdings", 0.0)
+    # The upload is stored as is and imported in the background; the job id is returned at once
+    await run_in_threadpool(file.file.seek, 0)
+    job = await submit_csv_import(
+        str(current_user.id), str(target_wallet["_id"]), bool(new_wallet_label), file.filename, file.file
+    )
+    return ImportJobOut(**import_job_out(job))
 
-    for trans_data in parsed_transactions_data:
-        # Assign wallet_id to each transaction
-        trans_data["wallet_id"] = wallet_pydantic_id
-        transaction = TransactionCreate(**trans_data)
-        
-        # Insert transaction into database
-        insert_result = await db.db.transactions.insert_one(transaction.dict())
-        inserted_transaction = await db.db.transactions.find_one({"_id": insert_result.inserted_id})
-        
-        # Convert _id to id for response
-        inserted_transaction["id"] = str(inserted_transaction["_id"])
-        del inserted_transaction["_id"]
-        
-        imported_transactions_out.append(TransactionOut(**inserted_transaction))
+@import_router.post(
+    "/blockchain",
+    response_model=ImportJobOut,
+    status_code=status.HTTP_202_ACCEPTED,
+    summary="Import a Bitcoin address into a new blockchain-synced wallet"
+)
+async def import_blockchain_address(
+    label: str = Body(...),
+    wallet_address: str = Body(...),
+    currency: str = Body("USD"),
+    notes: Optional[str] = Body(None),
+    current_user: User = Depends(get_current_user)
+):
+    """
+    Creates a blockchain-synced wallet for the address and queues the import of its
+    on-chain history as a background job. Returns the job, whose progress is polled
+    at `/jobs/{job_id}`.
+    """
+    if not validate_btc_address(wallet_address):
+        raise HTTPException(status_code=status.HTTP_400_BAD_REQUEST, detail=f"Invalid Bitcoin address: {wallet_address}")
 
-        # Update BTC holdings in memory for the current import
-        if transaction.transaction_type == "cmc_buy":
-            current_btc_holdings_for_wallet += transaction.amount_btc
-        elif transaction.transaction_type == "cmc_sell":
-            current_btc_holdings_for_wallet -= transaction.amount_btc
-    
-    # Update the wallet's total BTC holdings in the database
-    await db.db.wallets.update_one(
-        {"_id": wallet_obj_id},
-        {"$set": {"btc_holdings": current_btc_holdings_for_wallet}}
+    existing_wallet = await db.db.wallets.find_one(
+        {"wallet_address": wallet_address, "user_id": str(current_user.id)}, {"_id": 1}
     )
+    if existing_wallet:
+        raise HTTPException(
+            status_code=status.HTTP_409_CONFLICT,
+            detail="A wallet with this address already exists. Use the reload endpoint to update."
+        )
+
+    doc = WalletCreate(
+        label=label,
+        addresses=[wallet_address],
+        currency=currency,
+        notes=notes,
+        btc_holdings=0.0,
+        is_blockchain_synced=True,
+        wallet_address=wallet_address,
+        current_btc_balance=0.0,
+        dca_enabled=False,
+        dca_settings=[],
+    ).dict(exclude_unset=True)
+    doc["created_at"] = datetime.utcnow()
+    doc["user_id"] = str(current_user.id)
+    result = await db.db.wallets.insert_one(doc)
+
+    job = await submit_blockchain_import(str(current_user.id), str(result.inserted_id), wallet_address)
+    return ImportJobOut(**import_job_out(job))
+
+@import_router.get("/jobs", response_model=List[ImportJobOut], summary="List import jobs")
+async def list_jobs(current_user: User = Depends(get_current_user)):
+    """Lists the current user's import jobs, newest first."""
+    return [ImportJobOut(**import_job_out(job)) for job in await list_import_jobs(str(current_user.id))]
 
-    return imported_transactions_out
+async def _get_owned_job(job_id: str, current_user: User) -> dict:
+    if not ObjectId.is_valid(job_id):
+        raise HTTPException(status_code=400, detail="Invalid Job ID")
+    job = await get_import_job(job_id, str(current_user.id))
+    if not job:
+        raise HTTPException(status_code=status.HTTP_404_NOT_FOUND, detail="Import job not found or does not belong to the current user.")
+    return job
+
+@import_router.get("/jobs/{job_id}", response_model=ImportJobOut, summary="Get the progress of an import job")
+async def get_job(job_id: str, current_user: User = Depends(get_current_user)):
+    """Returns the job status, rows processed, inserted and skipped rows, throughput and error."""
+    return ImportJobOut(**import_job_out(await _get_owned_job(job_id, current_user)))
+
+@import_router.post("/jobs/{job_id}/cancel", response_model=ImportJobOut, summary="Cancel an import job")
+async def cancel_job(job_id: str, current_user: User = Depends(get_current_user)):
+    """
+    Cancels a queued job, or stops a running one after its current chunk. The rows
+    already imported are kept and the job can be resumed.
+    """
+    await _get_owned_job(job_id, current_user)
+    return ImportJobOut(**import_job_out(await cancel_import_job(job_id, str(current_user.id))))
+
+@import_router.post("/jobs/{job_id}/resume", response_model=ImportJobOut, summary="Resume an import job")
+async def resume_job(job_id: str, current_user: User = Depends(get_current_user)):
+    """Queues a cancelled or failed job again; it continues after its last committed chunk."""
+    await _get_owned_job(job_id, current_user)
+    job = await resume_import_job(job_id, str(current_user.id))
+    if not job:
+        raise HTTPException(
+            status_code=status.HTTP_409_CONFLICT,
+            detail="Only cancelled jobs, or failed jobs whose rows were kept, can be resumed."
+        )
+    return ImportJobOut(**import_job_out(job))
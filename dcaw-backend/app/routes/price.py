@@ -1,6 +1,15 @@
-from fastapi import APIRouter, HTTPException, Query, BackgroundTasks
-from app.price_fetcher import fetch_btc_prices
+from datetime import datetime
+from typing import Optional
+from fastapi import APIRouter, HTTPException, Query, BackgroundTasks, WebSocket, WebSocketDisconnect
+from fastapi.responses import StreamingResponse
+from app.core.config import settings
+from app.services.price_cache import latest_price_cache
+from app.services.price_broadcast import next_message, price_hub
+from app.services.portfolio_cache import portfolio_cache
 from app.services.portfolio_calculator import calculate_portfolio_performance
+from app.services.ledger import get_ledger_version
+from app.services.price_history import get_price_series_version
+from app.services.price_tiers import get_price_range
 from app.services.summary_storage import save_daily_summary
 
 router = APIRouter()
@@ -8,13 +17,85 @@ router = APIRouter()
 @router.get("/now", summary="Get the current Bitcoin price")
 async def get_current_btc_price():
     """
-    Fetches the current real-time price of Bitcoin in USD and BRL.
+    Returns the current real-time price of Bitcoin in USD and BRL.
+    Served from the in-memory tick kept by the price fetcher; CoinGecko is only
+    called (once, shared by concurrent requests) when that tick is stale.
     """
-    prices = await fetch_btc_prices()
+    prices = await latest_price_cache.get()
     if not prices:
         raise HTTPException(status_code=503, detail="Could not fetch current prices from the external API.")
     return prices
 
+@router.get("/stream", summary="Stream live Bitcoin prices (Server-Sent Events)")
+async def stream_btc_price():
+    """
+    Pushes every price tick fetched by the scheduler as a Server-Sent Event, starting
+    with the latest known tick. Clients that cannot keep up are disconnected and
+    should reconnect (EventSource does this automatically).
+    """
+    queue = price_hub.subscribe()
+
+    async def events():
+        try:
+            while True:
+                message = await next_message(queue, settings.PRICE_STREAM_KEEPALIVE_SECONDS)
+                if message is None:
+                    break
+                yield f"data: {message}\n\n" if message else ": keep-alive\n\n"
+        finally:
+            price_hub.unsubscribe(queue)
+
+    return StreamingResponse(
+        events(),
+        media_type="text/event-stream",
+        headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"},
+    )
+
+@router.websocket("/ws")
+async def websocket_btc_price(websocket: WebSocket):
+    """Same feed as /stream over a WebSocket: one JSON text message per price tick."""
+    await websocket.accept()
+    queue = price_hub.subscribe()
+    try:
+        while True:
+            message = await next_message(queue, settings.PRICE_STREAM_KEEPALIVE_SECONDS)
+            if message is None:
+                await websocket.close(code=1013, reason="Client too slow")
+                break
+            if message:
+                await websocket.send_text(message)
+    except WebSocketDisconnect:
+        pass
+    finally:
+        price_hub.unsubscribe(queue)
+
+@router.get("/stream/stats", summary="Get live price stream statistics")
+async def get_price_stream_stats():
+    """Returns the number of connected stream clients and the ticks published and clients dropped so far."""
+    return price_hub.stats()
+
+@router.get("/history", summary="Get BTC price history at an automatic resolution")
+async def get_price_history(
+    start: datetime = Query(..., description="Start of the range (UTC)"),
+    end: Optional[datetime] = Query(None, description="End of the range (UTC). Defaults to now."),
+    resolution: Optional[int] = Query(None, ge=60, description="Maximum number of seconds between points. Defaults to a resolution that returns a few hundred points.")
+):
+    """
+    Returns BTC price points for a range, read from the coarsest storage tier
+    (1m, 10m, 1h or 1d) that meets the requested resolution.
+    """
+    try:
+        return await get_price_range(start, end, resolution)
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+
+@router.get("/cache/stats", summary="Get portfolio cache statistics")
+async def get_portfolio_cache_stats():
+    """
+    Returns hit/miss counters and the current size of the portfolio result cache.
+    """
+    return portfolio_cache.stats()
+
 @router.get("/{timespan}", summary="Get historical portfolio performance for a given timespan")
 async def get_historical_prices(
     timespan: str,
@@ -25,11 +106,24 @@ async def get_historical_prices(
     Returns the portfolio history and performance summary for a specific wallet
     over a given timespan and triggers background saving of the daily summary.
     Supported timespans: `7d`, `30d`, `90d`, `365d`, `ALL`.
+    Results are cached per wallet, timespan and price-series version until new
+    transactions are written for the wallet (the ledger version covers writes made
+    by other processes, e.g. DCA purchases in the worker).
     """
     days_map = {"7d": 7, "30d": 30, "90d": 90, "365d": 365}
     if timespan not in days_map and timespan != "ALL":
         raise HTTPException(status_code=400, detail="Invalid timespan. Supported values are: 7d, 30d, 90d, 365d, all.")
 
+    cache_key = (wallet_id, timespan, await get_price_series_version(), await get_ledger_version(wallet_id))
+    cached_result = portfolio_cache.get(cache_key)
+    if cached_result is not None:
+        return {
+            "wallet_id": wallet_id,
+            "timespan": timespan,
+            **cached_result
+        }
+
+    generation = portfolio_cache.generation(wallet_id)
     try:
         result = await calculate_portfolio_performance(wallet_id, timespan)
     except ValueError as e:
@@ -39,6 +133,8 @@ async def get_historical_prices(
     except Exception as e:
         raise HTTPException(status_code=500, detail=f"An unexpected error occurred: {e}")
 
+    portfolio_cache.set(cache_key, result, generation)
+
     # Se o summary foi calculado com sucesso, adiciona a tarefa de salvamento
     if result and result["summary"]:
         background_tasks.add_task(save_daily_summary, wallet_id, timespan, result["summary"])
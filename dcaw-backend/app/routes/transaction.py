@@ -2,6 +2,7 @@ from fastapi import APIRouter, HTTPException
 from app.models.transaction import TransactionCreate, TransactionOut
 from app.models.wallet import WalletOut # Import WalletOut to update wallet holdings
 from app.db.client import transactions_collection, wallets_collection
+from app.services.ledger import apply_transactions_to_ledger
 from bson.objectid import ObjectId
 from datetime import datetime
 from typing import List
@@ -42,6 +43,7 @@ async def create_transaction(transaction: TransactionCreate):
     doc = transaction.dict()
     doc["created_at"] = datetime.utcnow()
     result = transactions_collection.insert_one(doc)
+    await apply_transactions_to_ledger(transaction.wallet_id, [doc])
     doc["id"] = str(result.inserted_id)
     return doc
 
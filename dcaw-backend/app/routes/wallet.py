@@ -1,16 +1,31 @@
-from fastapi import APIRouter, HTTPException, Body, status, Depends
-from app.models.wallet import WalletCreate, WalletOut, DCAConfiguration
+from fastapi import APIRouter, HTTPException, Body, Query, status, Depends
+from app.models.wallet import WalletCreate, WalletOut, DCAConfiguration, DCABacktestRequest
+from app.core.config import settings
 from app.models.models import User # Import User model to use with get_current_user
 from app.core.security import get_current_user # Import security dependency
-from app.price_fetcher import fetch_btc_historical_price
-from app.services.blockchain import fetch_transactions_from_blockchain
+from app.services.blockchain_sync import (
+    delete_synced_transactions,
+    get_synced_transactions,
+    get_synced_txids,
+    insert_blockchain_transactions,
+    iter_synced_transaction_chunks,
+    store_synced_transactions,
+)
+from app.services.dca_backtest import backtest_dca_configurations
+from app.services.dca_service import notify_dca_schedule_changed, schedule_dca_settings
+from app.services.dca_triggers import price_band_index
+from app.services.ledger import delete_wallet_ledger
 from app.db.connection import db
 from bson.objectid import ObjectId
+import asyncio
 from datetime import datetime
 from typing import List, Optional
 
 router = APIRouter()
 
+# Wallet reads load only the fields of WalletOut, never unbounded or internal ones
+WALLET_OUT_PROJECTION = {field: 1 for field in WalletOut.model_fields if field != "id"}
+
 @router.post("/", response_model=WalletOut, summary="Create a new wallet")
 async def create_wallet(
     wallet: WalletCreate,
@@ -31,9 +46,14 @@ async def create_wallet(
     # If DCA is enabled but no settings provided, initialize empty list
     if doc.get("dca_enabled") and not doc.get("dca_settings"):
         doc["dca_settings"] = []
+    if doc.get("dca_settings"):
+        schedule_dca_settings(doc["dca_settings"])
 
     result = await db.db.wallets.insert_one(doc)
-    created_wallet = await db.db.wallets.find_one({"_id": result.inserted_id})
+    if doc.get("dca_enabled"):
+        price_band_index.update_wallet(str(result.inserted_id), doc.get("dca_settings", []))
+        notify_dca_schedule_changed()
+    created_wallet = await db.db.wallets.find_one({"_id": result.inserted_id}, WALLET_OUT_PROJECTION)
     if not created_wallet:
         raise HTTPException(status_code=status.HTTP_500_INTERNAL_SERVER_ERROR, detail="Failed to create wallet.")
     
@@ -48,7 +68,7 @@ async def list_wallets(current_user: User = Depends(get_current_user)): # Protec
     """
     wallets = []
     # Filter wallets by user_id
-    for w in await db.db.wallets.find({"user_id": str(current_user.id)}).to_list(length=1000): # to_list for async
+    for w in await db.db.wallets.find({"user_id": str(current_user.id)}, WALLET_OUT_PROJECTION).to_list(length=1000): # to_list for async
         w["id"] = str(w["_id"])
         del w["_id"]
         wallets.append(WalletOut(**w))
@@ -63,7 +83,7 @@ async def get_wallet(wallet_id: str, current_user: User = Depends(get_current_us
         raise HTTPException(status_code=400, detail="Invalid Wallet ID")
     
     # Add user_id to the query to ensure ownership
-    wallet = await db.db.wallets.find_one({"_id": ObjectId(wallet_id), "user_id": str(current_user.id)})
+    wallet = await db.db.wallets.find_one({"_id": ObjectId(wallet_id), "user_id": str(current_user.id)}, WALLET_OUT_PROJECTION)
     if not wallet:
         raise HTTPException(status_code=status.HTTP_404_NOT_FOUND, detail="Wallet not found or does not belong to the current user.")
     
@@ -71,6 +91,43 @@ async def get_wallet(wallet_id: str, current_user: User = Depends(get_current_us
     del wallet["_id"]
     return WalletOut(**wallet)
 
+@router.get("/{wallet_id}/synced-transactions", summary="List the on-chain transactions of a synced wallet")
+async def list_synced_transactions(
+    wallet_id: str,
+    skip: int = Query(0, ge=0),
+    limit: int = Query(100, ge=1, le=1000),
+    current_user: User = Depends(get_current_user) # Protect endpoint
+):
+    """
+    Retrieve a page of the transactions synced from the blockchain for a wallet, newest first.
+    """
+    if not ObjectId.is_valid(wallet_id):
+        raise HTTPException(status_code=400, detail="Invalid Wallet ID")
+
+    wallet = await db.db.wallets.find_one({"_id": ObjectId(wallet_id), "user_id": str(current_user.id)}, {"_id": 1})
+    if not wallet:
+        raise HTTPException(status_code=status.HTTP_404_NOT_FOUND, detail="Wallet not found or does not belong to the current user.")
+
+    return await get_synced_transactions(wallet_id, skip, limit)
+
+@router.post("/dca/backtest", summary="Backtest DCA configurations over the BTC price history")
+async def backtest_dca(
+    request: DCABacktestRequest,
+    current_user: User = Depends(get_current_user) # Protect endpoint
+):
+    """
+    Simulates how each DCA configuration would have performed between `start_date`
+    and `end_date` on the daily BTC/USD history: accumulated BTC, invested USD,
+    average cost, profit/loss and maximum drawdown. All configurations are
+    evaluated together in one vectorized pass, so large grids can be compared at once.
+    """
+    try:
+        return await backtest_dca_configurations(
+            request.start_date, request.end_date, [c.dict() for c in request.configurations]
+        )
+    except ValueError as e:
+        raise HTTPException(status_code=status.HTTP_400_BAD_REQUEST, detail=str(e))
+
 @router.put("/{wallet_id}/dca", response_model=WalletOut, summary="Configure DCA mode for a wallet")
 async def configure_dca(
     wallet_id: str,
@@ -87,7 +144,7 @@ async def configure_dca(
         raise HTTPException(status_code=400, detail="Invalid Wallet ID")
 
     # Check wallet ownership
-    existing_wallet = await db.db.wallets.find_one({"_id": ObjectId(wallet_id), "user_id": str(current_user.id)})
+    existing_wallet = await db.db.wallets.find_one({"_id": ObjectId(wallet_id), "user_id": str(current_user.id)}, {"_id": 1})
     if not existing_wallet:
         raise HTTPException(status_code=status.HTTP_404_NOT_FOUND, detail="Wallet not found or does not belong to the current user.")
 
@@ -99,18 +156,21 @@ async def configure_dca(
                 status_code=status.HTTP_400_BAD_REQUEST,
                 detail="dca_settings must be provided when dca_enabled is true."
             )
-        update_fields["dca_settings"] = [s.dict() for s in dca_settings]
+        update_fields["dca_settings"] = schedule_dca_settings([s.dict() for s in dca_settings])
     else:
         update_fields["dca_settings"] = [] # Clear settings when DCA is disabled
 
     updated_wallet = await db.db.wallets.find_one_and_update(
         {"_id": ObjectId(wallet_id)},
         {"$set": update_fields},
+        projection=WALLET_OUT_PROJECTION,
         return_document=True
     )
 
     if not updated_wallet:
         raise HTTPException(status_code=status.HTTP_404_NOT_FOUND, detail="Wallet not found.") # Should not happen due to prior check
+    price_band_index.update_wallet(wallet_id, update_fields["dca_settings"])
+    notify_dca_schedule_changed()
     
     updated_wallet["id"] = str(updated_wallet["_id"])
     del updated_wallet["_id"]
@@ -131,7 +191,7 @@ async def create_blockchain_synced_wallet(
     existing_wallet = await db.db.wallets.find_one({
         "wallet_address": wallet_address,
         "user_id": str(current_user.id)
-    })
+    }, {"_id": 1})
     
     if existing_wallet:
         raise HTTPException(
@@ -139,45 +199,16 @@ async def create_blockchain_synced_wallet(
             detail="A wallet with this address already exists. Use the reload endpoint to update."
         )
 
-    # Fetch transactions from the blockchain
-    transactions_data = await fetch_transactions_from_blockchain(wallet_address)
-    
-    # Process transactions to calculate balance and format for storage
-    synced_transactions_for_wallet = []
-    current_btc_balance = 0
-    
-    for tx in transactions_data:
-        is_incoming = any(vout["scriptpubkey_address"] == wallet_address for vout in tx["vout"])
-        
-        amount = 0
-        if is_incoming:
-            amount = sum(vout["value"] for vout in tx["vout"] if vout["scriptpubkey_address"] == wallet_address)
-        else:
-            amount = -sum(vin["prevout"]["value"] for vin in tx["vin"] if vin["prevout"]["scriptpubkey_address"] == wallet_address)
-
-        current_btc_balance += amount
-        
-        synced_transactions_for_wallet.append({
-            "txid": tx["txid"],
-            "amount": amount / 10**8,
-            "timestamp": datetime.fromtimestamp(tx["status"].get("block_time")) if tx["status"].get("block_time") else None,
-            #"timestamp": datetime.fromtimestamp(tx["status"]["block_time"]),
-            "is_incoming": is_incoming,
-        })
-    
-    current_btc_balance_btc = current_btc_balance / 10**8
-    
-    # Create new wallet
+    # Create the wallet first; its history is streamed into it chunk by chunk below
     wallet_data = {
         "label": label,
         "addresses": [wallet_address],
         "currency": currency,
         "notes": notes,
-        "btc_holdings": current_btc_balance_btc,
+        "btc_holdings": 0.0,
         "is_blockchain_synced": True,
         "wallet_address": wallet_address,
-        "synced_transactions": synced_transactions_for_wallet,
-        "current_btc_balance": current_btc_balance_btc,
+        "current_btc_balance": 0.0,
         "dca_enabled": False,
         "dca_settings": [],
     }
@@ -186,47 +217,92 @@ async def create_blockchain_synced_wallet(
     doc["created_at"] = datetime.utcnow()
     doc["user_id"] = str(current_user.id)
     result = await db.db.wallets.insert_one(doc)
-    created_wallet_doc = await db.db.wallets.find_one({"_id": result.inserted_id})
-    
+    wallet_id = str(result.inserted_id)
+
+    sync_cursor = {}
+    try:
+        async for synced_chunk in iter_synced_transaction_chunks(wallet_address, cursor=sync_cursor):
+            # Create the transaction documents (txids already stored are skipped)
+            await insert_blockchain_transactions(wallet_id, synced_chunk)
+            await store_synced_transactions(wallet_id, synced_chunk)
+
+            chunk_balance = sum(tx["amount"] for tx in synced_chunk)
+            await db.db.wallets.update_one(
+                {"_id": result.inserted_id},
+                {"$inc": {"btc_holdings": chunk_balance, "current_btc_balance": chunk_balance}}
+            )
+    except Exception:
+        # Do not leave a half-synced wallet behind
+        await db.db.wallets.delete_one({"_id": result.inserted_id})
+        await db.db.transactions.delete_many({"wallet_id": wallet_id})
+        await delete_synced_transactions(wallet_id)
+        await delete_wallet_ledger(wallet_id)
+        raise
+    if sync_cursor:
+        await db.db.wallets.update_one({"_id": result.inserted_id}, {"$set": {"sync_cursor": sync_cursor}})
+
+    created_wallet_doc = await db.db.wallets.find_one({"_id": result.inserted_id}, WALLET_OUT_PROJECTION)
     if not created_wallet_doc:
         raise HTTPException(
             status_code=status.HTTP_500_INTERNAL_SERVER_ERROR,
             detail="Failed to create blockchain-synced wallet."
         )
-    
-    wallet_id = str(created_wallet_doc["_id"])
-
-    # Now, create the transaction documents
-    for tx_data in transactions_data:
-        # Check for duplicates in the transactions collection
-        if not await db.db.transactions.find_one({"txid": tx_data["txid"]}):
-            is_incoming = any(vout["scriptpubkey_address"] == wallet_address for vout in tx_data["vout"])
-            
-            amount = 0
-            if is_incoming:
-                amount = sum(vout["value"] for vout in tx_data["vout"] if vout["scriptpubkey_address"] == wallet_address)
-            else:
-                amount = -sum(vin["prevout"]["value"] for vin in tx_data["vin"] if vin["prevout"]["scriptpubkey_address"] == wallet_address)
-
-            transaction_date = datetime.fromtimestamp(tx_data["status"].get("block_time", 0))
-            price_at_transaction_date = await fetch_btc_historical_price(transaction_date)
-            
-            new_transaction_doc = {
-                "wallet_id": wallet_id,
-                "transaction_type": "blockchain_in" if is_incoming else "blockchain_out",
-                "amount_btc": amount / 10**8,
-                "price_per_btc_usd": price_at_transaction_date,
-                "total_value_usd": (amount / 10**8) * price_at_transaction_date,
-                "transaction_date": transaction_date,
-                "txid": tx_data["txid"],
-            }
-            await db.db.transactions.insert_one(new_transaction_doc)
-            
+
     created_wallet_doc["id"] = wallet_id
     del created_wallet_doc["_id"]
     return WalletOut(**created_wallet_doc)
 
 
+async def _reload_synced_wallet(address: str, user_id: str) -> dict:
+    """Reloads one blockchain-synced wallet and reports its status."""
+    wallet = await db.db.wallets.find_one(
+        {
+            "wallet_address": address,
+            "user_id": user_id,
+            "is_blockchain_synced": True
+        },
+        {"sync_cursor": 1}
+    )
+
+    if not wallet:
+        return {"address": address, "status": "not_found", "new_transactions": 0, "wallet": None}
+
+    # Only blocks after the sync cursor are fetched; wallets synced before the cursor
+    # existed are filtered by their known txids once, and get a cursor afterwards
+    sync_cursor = dict(wallet.get("sync_cursor") or {})
+    existing_tx_ids_in_wallet = set()
+    if not sync_cursor:
+        existing_tx_ids_in_wallet = await get_synced_txids(str(wallet["_id"]))
+
+    new_transactions = 0
+    async for synced_chunk in iter_synced_transaction_chunks(address, existing_tx_ids_in_wallet, sync_cursor):
+        # Insert into the transactions collection (txids already stored are skipped)
+        inserted_transactions = await insert_blockchain_transactions(str(wallet["_id"]), synced_chunk)
+        if not inserted_transactions:
+            continue
+
+        inserted_txids = {t["txid"] for t in inserted_transactions}
+        new_transactions_to_sync = [tx for tx in synced_chunk if tx["txid"] in inserted_txids]
+        await store_synced_transactions(str(wallet["_id"]), new_transactions_to_sync)
+        await db.db.wallets.update_one(
+            {"_id": wallet["_id"]},
+            {"$inc": {"btc_holdings": sum(tx["amount"] for tx in new_transactions_to_sync)}}
+        )
+        new_transactions += len(new_transactions_to_sync)
+
+    if sync_cursor and sync_cursor != wallet.get("sync_cursor"):
+        await db.db.wallets.update_one({"_id": wallet["_id"]}, {"$set": {"sync_cursor": sync_cursor}})
+
+    reloaded_wallet = await db.db.wallets.find_one({"_id": wallet["_id"]}, WALLET_OUT_PROJECTION)
+    reloaded_wallet["id"] = str(reloaded_wallet["_id"])
+    del reloaded_wallet["_id"]
+    return {
+        "address": address,
+        "status": "updated" if new_transactions else "up_to_date",
+        "new_transactions": new_transactions,
+        "wallet": WalletOut(**reloaded_wallet),
+    }
+
 @router.post("/reload-synced", summary="Reload and update synced wallets")
 async def reload_synced_wallets(
     addresses: List[str] = Body(..., embed=True),
@@ -234,81 +310,22 @@ async def reload_synced_wallets(
 ):
     """
     Reload and update one or more blockchain-synced wallets with new transactions.
+    Addresses are reloaded concurrently (at most BLOCKCHAIN_RELOAD_CONCURRENCY at a time,
+    with requests to the explorer rate limited per host). Returns one entry per address
+    with its `status` (`updated`, `up_to_date`, `not_found` or `failed`), the number of
+    new transactions and the reloaded wallet.
     """
-    reloaded_wallets = []
-    
-    for address in addresses:
-        wallet = await db.db.wallets.find_one({
-            "wallet_address": address,
-            "user_id": str(current_user.id),
-            "is_blockchain_synced": True
-        })
-        
-        if not wallet:
-            continue
-            
-        transactions_data = await fetch_transactions_from_blockchain(address)
-        
-        existing_tx_ids_in_wallet = {tx["txid"] for tx in wallet.get("synced_transactions", [])}
-        
-        new_transactions_to_sync = []
-        new_btc_balance = wallet.get("btc_holdings", 0.0) * 10**8
-        
-        for tx in transactions_data:
-            if tx["txid"] not in existing_tx_ids_in_wallet:
-                # Check for txid existence in the main transactions collection to prevent duplicates
-                existing_transaction = await db.db.transactions.find_one({"txid": tx["txid"]})
-                if existing_transaction:
-                    continue
-
-                is_incoming = any(vout["scriptpubkey_address"] == address for vout in tx["vout"])
-                
-                amount = 0
-                if is_incoming:
-                    amount = sum(vout["value"] for vout in tx["vout"] if vout["scriptpubkey_address"] == address)
-                else:
-                    amount = -sum(vin["prevout"]["value"] for vin in tx["vin"] if vin["prevout"]["scriptpubkey_address"] == address)
-
-                new_btc_balance += amount
-                
-                # Fetch historical price for the transaction date
-                transaction_date = datetime.fromtimestamp(tx["status"]["block_time"])
-                price_at_transaction_date = await fetch_btc_historical_price(transaction_date) if transaction_date else None
-                
-                # Create a new transaction document
-                new_transaction_doc = {
-                    "wallet_id": str(wallet["_id"]),
-                    "transaction_type": "blockchain_in" if is_incoming else "blockchain_out",
-                    "amount_btc": amount / 10**8,
-                    "price_per_btc_usd": price_at_transaction_date,
-                    "total_value_usd": (amount / 10**8) * price_at_transaction_date,
-                    "transaction_date": transaction_date,
-                    "txid": tx["txid"],
-                }
-                
-                # Insert into the transactions collection
-                await db.db.transactions.insert_one(new_transaction_doc)
-                
-                # Append to the list for wallet's synced_transactions
-                new_transactions_to_sync.append({
-                    "txid": tx["txid"],
-                    "amount": amount / 10**8,
-                    "timestamp": datetime.fromtimestamp(tx["status"].get("block_time")) if tx["status"].get("block_time") else None,
-                    "is_incoming": is_incoming,
-                })
-
-        if new_transactions_to_sync:
-            await db.db.wallets.update_one(
-                {"_id": wallet["_id"]},
-                {
-                    "$push": {"synced_transactions": {"$each": new_transactions_to_sync}},
-                    "$set": {"btc_holdings": new_btc_balance / 10**8}
-                }
-            )
-        
-        reloaded_wallet = await db.db.wallets.find_one({"_id": wallet["_id"]})
-        reloaded_wallet["id"] = str(reloaded_wallet["_id"])
-        del reloaded_wallet["_id"]
-        reloaded_wallets.append(WalletOut(**reloaded_wallet))
-        
-    return reloaded_wallets
+    semaphore = asyncio.Semaphore(settings.BLOCKCHAIN_RELOAD_CONCURRENCY)
+
+    async def reload(address: str) -> dict:
+        async with semaphore:
+            try:
+                return await _reload_synced_wallet(address, str(current_user.id))
+            except HTTPException as e:
+                detail = e.detail
+            except Exception as e:
+                detail = f"Unexpected error: {e}"
+            return {"address": address, "status": "failed", "new_transactions": 0, "wallet": None, "detail": detail}
+
+    # The same address twice would race on its own wallet
+    return await asyncio.gather(*(reload(address) for address in dict.fromkeys(addresses)))
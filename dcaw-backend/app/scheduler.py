@@ -1,37 +1,97 @@
+import asyncio
 import logging
+import time
+from datetime import datetime, timedelta, timezone
 from apscheduler.schedulers.asyncio import AsyncIOScheduler
 from apscheduler.triggers.cron import CronTrigger
+from app.core.config import settings
 from app.db.connection import db
-from app.services.portfolio_calculator import calculate_portfolio_performance
-from app.services.summary_storage import save_daily_summary
+from app.services.leases import acquire_lease
+from app.services.portfolio_calculator import TIMESPAN_DAYS, calculate_portfolio_performance_multi
+from app.services.price_history import get_price_series
+from app.services.summary_storage import save_daily_summaries
 
 logging.basicConfig(level=logging.INFO)
 logger = logging.getLogger(__name__)
 
+# A reserva do dia dura mais que o próprio dia, para o job não rodar duas vezes na mesma data
+SUMMARY_LEASE_TTL_SECONDS = 2 * 24 * 3600
+
 async def scheduled_summary_job():
     """
     Job agendado para calcular e salvar os summaries diários para todas as carteiras.
+    A série de preços é buscada uma única vez e compartilhada por todas as carteiras,
+    que são processadas em paralelo (com limite de concorrência) e gravadas em lote.
     """
     logger.info("Starting scheduled daily summary job...")
+    started_at = time.monotonic()
+    # A data do summary é fixada no início, para não mudar se o job passar da meia-noite
+    run_date = datetime.now(timezone.utc).strftime('%Y-%m-%d')
+    end_date = datetime.utcnow()
     wallets_collection = db.db["wallets"]
     timespans = ["7d", "30d", "90d", "365d"]
-    
+    concurrency = settings.SUMMARY_JOB_CONCURRENCY
+    stats = {"wallets": 0, "failed": 0, "summaries": 0}
+    pending = []
+
+    async def flush():
+        batch = pending[:]
+        pending.clear()
+        try:
+            stats["summaries"] += await save_daily_summaries(batch)
+        except Exception as e:
+            logger.error(f"Failed to save {len(batch)} daily summaries: {e}")
+
+    async def worker(queue: asyncio.Queue, prices_usd: list):
+        while True:
+            wallet_id = await queue.get()
+            if wallet_id is None:
+                return
+            try:
+                results = await calculate_portfolio_performance_multi(
+                    wallet_id, timespans, prices_usd=prices_usd, end_date=end_date
+                )
+            except Exception as e:
+                stats["failed"] += 1
+                logger.error(f"Failed to process wallet {wallet_id}: {e}")
+                continue
+
+            stats["wallets"] += 1
+            pending.extend(
+                {"wallet_id": wallet_id, "timespan": timespan, "date": run_date, "summary": result["summary"]}
+                for timespan, result in results.items() if result and result["summary"]
+            )
+            if len(pending) >= settings.SUMMARY_JOB_BATCH_SIZE:
+                await flush()
+
     try:
-        # Itera sobre todas as carteiras existentes
-        async for wallet in wallets_collection.find({}, {"_id": 1}):
-            wallet_id = str(wallet["_id"])
-            logger.info(f"Processing wallet: {wallet_id}")
-            
-            # Para cada carteira, calcula e salva o summary para cada timespan
-            for timespan in timespans:
-                try:
-                    result = await calculate_portfolio_performance(wallet_id, timespan)
-                    if result and result["summary"]:
-                        await save_daily_summary(wallet_id, timespan, result["summary"])
-                except Exception as e:
-                    logger.error(f"Failed to process {timespan} for wallet {wallet_id}: {e}")
-        
-        logger.info("Scheduled daily summary job finished successfully.")
+        # Com vários processos, apenas o que reservar a data do summary executa o job
+        if not await acquire_lease(f"daily-summary:{run_date}", SUMMARY_LEASE_TTL_SECONDS):
+            logger.info(f"Daily summary job for {run_date} is handled by another process.")
+            return
+
+        earliest_start = end_date - timedelta(days=max(TIMESPAN_DAYS[t] for t in timespans))
+        prices_usd = await get_price_series(earliest_start, end_date)
+
+        queue = asyncio.Queue(maxsize=concurrency * 2)
+        workers = [asyncio.create_task(worker(queue, prices_usd)) for _ in range(concurrency)]
+        try:
+            # Itera sobre todas as carteiras existentes
+            async for wallet in wallets_collection.find({}, {"_id": 1}):
+                await queue.put(str(wallet["_id"]))
+        finally:
+            for _ in workers:
+                await queue.put(None)
+            await asyncio.gather(*workers)
+        await flush()
+
+        duration = time.monotonic() - started_at
+        throughput = stats["wallets"] / duration if duration > 0 else 0
+        logger.info(
+            f"Scheduled daily summary job finished successfully: {stats['wallets']} wallets "
+            f"({stats['failed']} failed), {stats['summaries']} summaries saved for {run_date} "
+            f"in {duration:.1f}s ({throughput:.1f} wallets/s)."
+        )
 
     except Exception as e:
         logger.error(f"An error occurred during the scheduled summary job: {e}")
@@ -1,9 +1,13 @@
-import requests
+import httpx
 from fastapi import HTTPException, status
 import re
+from typing import AsyncIterator, Optional
+from app.core.http import get_http_client
 
 # Blockstream Esplora API endpoint
 BLOCKSTREAM_API_URL = "https://blockstream.info/api"
+# Esplora returns confirmed transactions in pages of this size; a shorter page is the last one
+ESPLORA_PAGE_SIZE = 25
 
 def validate_btc_address(address: str) -> bool:
     """
@@ -13,29 +17,76 @@ def validate_btc_address(address: str) -> bool:
     # Regex for P2PKH, P2SH, and Bech32 addresses
     return re.match(r"^(bc1|[13])[a-zA-HJ-NP-Z0-9]{25,39}$", address) is not None
 
-async def fetch_transactions_from_blockchain(address: str) -> list:
-    """
-    Fetch confirmed transaction history for a Bitcoin address from Blockstream Esplora.
-    """
-    if not validate_btc_address(address):
-        raise HTTPException(
-            status_code=status.HTTP_400_BAD_REQUEST,
-            detail=f"Invalid Bitcoin address: {address}",
-        )
-    
+async def _get_address_page(url: str) -> list:
     try:
-        response = requests.get(f"{BLOCKSTREAM_API_URL}/address/{address}/txs")
+        response = await get_http_client().get(url)
         response.raise_for_status()
         return response.json()
-    except requests.exceptions.HTTPError as e:
+    except httpx.HTTPStatusError as e:
         if e.response.status_code == 404:
             return [] # No transactions found, not an error
         raise HTTPException(
             status_code=status.HTTP_503_SERVICE_UNAVAILABLE,
             detail=f"Failed to fetch data from blockchain explorer: {e}",
         )
-    except requests.exceptions.RequestException as e:
+    except httpx.HTTPError as e:
         raise HTTPException(
             status_code=status.HTTP_503_SERVICE_UNAVAILABLE,
             detail=f"Error connecting to blockchain explorer: {e}",
         )
+
+async def iter_address_transactions(
+    address: str,
+    last_seen_txid: Optional[str] = None,
+    after_block_height: Optional[int] = None
+) -> AsyncIterator[list]:
+    """
+    Yields the confirmed transaction history of a Bitcoin address from Blockstream Esplora
+    one page at a time, newest first, following `/txs/chain/{last_seen_txid}` until the
+    last page. Pass `last_seen_txid` to continue after a given transaction, and
+    `after_block_height` to stop at the first transaction mined at or below that height.
+    """
+    if not validate_btc_address(address):
+        raise HTTPException(
+            status_code=status.HTTP_400_BAD_REQUEST,
+            detail=f"Invalid Bitcoin address: {address}",
+        )
+
+    while True:
+        url = f"{BLOCKSTREAM_API_URL}/address/{address}/txs/chain"
+        if last_seen_txid:
+            url += f"/{last_seen_txid}"
+        page = await _get_address_page(url)
+        if not page:
+            return
+        if after_block_height is not None:
+            newer = [tx for tx in page if tx["status"].get("block_height", 0) > after_block_height]
+            if len(newer) < len(page):
+                # Reached already synced blocks: nothing older needs to be fetched
+                if newer:
+                    yield newer
+                return
+        yield page
+        if len(page) < ESPLORA_PAGE_SIZE:
+            return
+        last_seen_txid = page[-1]["txid"]
+
+async def iter_address_transaction_chunks(
+    address: str,
+    chunk_size: int,
+    after_block_height: Optional[int] = None,
+    last_seen_txid: Optional[str] = None
+) -> AsyncIterator[list]:
+    """
+    Groups the pages of `iter_address_transactions` into chunks of about `chunk_size`
+    transactions. Chunks end on page boundaries, so the last txid of a chunk is where
+    a later call can continue (`last_seen_txid`).
+    """
+    chunk = []
+    async for page in iter_address_transactions(address, last_seen_txid, after_block_height):
+        chunk.extend(page)
+        if len(chunk) >= chunk_size:
+            yield chunk
+            chunk = []
+    if chunk:
+        yield chunk
@@ -0,0 +1,172 @@
+import logging
+from datetime import datetime
+from typing import AsyncIterator, List, Optional
+from pymongo import ASCENDING, DESCENDING
+from pymongo.errors import BulkWriteError, OperationFailure
+from app.core.config import settings
+from app.db.connection import db
+from app.services.blockchain import iter_address_transaction_chunks
+from app.services.ledger import apply_transactions_to_ledger
+from app.services.price_history import resolve_historical_prices
+
+logging.basicConfig(level=logging.INFO)
+logger = logging.getLogger(__name__)
+
+DUPLICATE_KEY_ERROR = 11000
+SYNCED_TRANSACTIONS_COLLECTION = "synced_transactions"
+
+async def ensure_transaction_indexes():
+    """
+    Makes a txid unique within a wallet, so concurrent syncs of the same wallet cannot
+    store a transaction twice. Transactions without txid (manual, DCA, imports) are
+    left out of the index. Also indexes the synced transactions collection by wallet.
+    """
+    try:
+        await db.db.transactions.create_index(
+            [("wallet_id", ASCENDING), ("txid", ASCENDING)],
+            unique=True,
+            partialFilterExpression={"txid": {"$type": "string"}}
+        )
+    except OperationFailure as e:
+        logger.error(f"Could not create the unique (wallet_id, txid) index; remove duplicated transactions first: {e}")
+    await db.db[SYNCED_TRANSACTIONS_COLLECTION].create_index(
+        [("wallet_id", ASCENDING), ("txid", ASCENDING)], unique=True
+    )
+    await db.db[SYNCED_TRANSACTIONS_COLLECTION].create_index(
+        [("wallet_id", ASCENDING), ("timestamp", DESCENDING)]
+    )
+
+async def insert_unique_transactions(documents: List[dict], collection: str = "transactions") -> List[dict]:
+    """
+    Inserts transaction documents with one unordered `insert_many`, skipping the ones
+    whose (wallet_id, txid) is already stored. Returns the documents actually inserted.
+    """
+    if not documents:
+        return []
+    try:
+        await db.db[collection].insert_many(documents, ordered=False)
+    except BulkWriteError as e:
+        errors = e.details.get("writeErrors", [])
+        if any(error["code"] != DUPLICATE_KEY_ERROR for error in errors):
+            raise
+        duplicates = {error["index"] for error in errors}
+        return [doc for index, doc in enumerate(documents) if index not in duplicates]
+    return documents
+
+def parse_address_transaction(tx: dict, address: str) -> dict:
+    """Reduces an Esplora transaction to what a synced wallet stores for `address`."""
+    is_incoming = any(vout["scriptpubkey_address"] == address for vout in tx["vout"])
+
+    amount = 0
+    if is_incoming:
+        amount = sum(vout["value"] for vout in tx["vout"] if vout["scriptpubkey_address"] == address)
+    else:
+        amount = -sum(vin["prevout"]["value"] for vin in tx["vin"] if vin["prevout"]["scriptpubkey_address"] == address)
+
+    return {
+        "txid": tx["txid"],
+        "amount": amount / 10**8,
+        "timestamp": datetime.fromtimestamp(tx["status"].get("block_time")) if tx["status"].get("block_time") else None,
+        "is_incoming": is_incoming,
+    }
+
+async def iter_synced_transaction_chunks(
+    address: str,
+    known_txids: set = frozenset(),
+    cursor: Optional[dict] = None,
+    last_seen_txid: Optional[str] = None
+) -> AsyncIterator[List[dict]]:
+    """
+    Streams an address's confirmed history in chunks of BLOCKCHAIN_SYNC_CHUNK_SIZE parsed
+    transactions, leaving out `known_txids`, so memory stays flat for busy addresses.
+    A sync `cursor` ({"block_height", "txid"} of the newest synced transaction) limits the
+    stream to newer blocks, so pagination stops where the previous sync ended; it is
+    advanced in place to the newest transaction seen. `last_seen_txid` continues an
+    interrupted stream after that transaction.
+    """
+    after_block_height = cursor.get("block_height") if cursor else None
+    async for chunk in iter_address_transaction_chunks(
+        address, settings.BLOCKCHAIN_SYNC_CHUNK_SIZE, after_block_height, last_seen_txid
+    ):
+        if cursor is not None:
+            newest = max(chunk, key=lambda tx: tx["status"].get("block_height", 0))
+            if newest["status"].get("block_height", 0) > cursor.get("block_height", -1):
+                cursor.update(block_height=newest["status"]["block_height"], txid=newest["txid"])
+        parsed = [parse_address_transaction(tx, address) for tx in chunk if tx["txid"] not in known_txids]
+        if parsed:
+            yield parsed
+
+async def insert_blockchain_transactions(
+    wallet_id: str,
+    synced_transactions: List[dict],
+    import_id: Optional[str] = None
+) -> List[dict]:
+    """
+    Inserts a chunk of synced transactions into the wallet's transactions with one
+    unordered `insert_many`, priced with one batched historical price lookup. Txids the
+    wallet already has are rejected by the unique index and skipped. `import_id` tags
+    the documents with the import job that wrote them. Returns the inserted documents.
+    """
+    if not synced_transactions:
+        return []
+
+    # Unconfirmed transactions have no block time; they are dated at the epoch as before
+    transaction_dates = [tx["timestamp"] or datetime.fromtimestamp(0) for tx in synced_transactions]
+    prices_at_transaction_dates = await resolve_historical_prices(transaction_dates)
+
+    documents = [{
+        "wallet_id": wallet_id,
+        "transaction_type": "blockchain_in" if tx["is_incoming"] else "blockchain_out",
+        "amount_btc": tx["amount"],
+        "price_per_btc_usd": price_at_transaction_date,
+        "total_value_usd": tx["amount"] * price_at_transaction_date,
+        "transaction_date": transaction_date,
+        "txid": tx["txid"],
+        **({"import_id": import_id} if import_id else {}),
+    } for tx, transaction_date, price_at_transaction_date in zip(synced_transactions, transaction_dates, prices_at_transaction_dates)]
+
+    inserted = await insert_unique_transactions(documents)
+    await apply_transactions_to_ledger(wallet_id, inserted)
+    return inserted
+
+async def store_synced_transactions(wallet_id: str, synced_transactions: List[dict]) -> List[dict]:
+    """
+    Stores parsed on-chain transactions of a synced wallet in their own collection, one
+    document per txid, so the wallet document does not grow with the address history.
+    Returns the ones that were not stored yet.
+    """
+    return await insert_unique_transactions(
+        [{"wallet_id": wallet_id, **tx} for tx in synced_transactions],
+        SYNCED_TRANSACTIONS_COLLECTION
+    )
+
+async def get_synced_txids(wallet_id: str) -> set:
+    """Returns the txids already synced into a wallet."""
+    cursor = db.db[SYNCED_TRANSACTIONS_COLLECTION].find({"wallet_id": wallet_id}, {"_id": 0, "txid": 1})
+    return {doc["txid"] async for doc in cursor}
+
+async def get_synced_transactions(wallet_id: str, skip: int = 0, limit: int = 100) -> List[dict]:
+    """Returns a page of a wallet's synced transactions, newest first."""
+    cursor = db.db[SYNCED_TRANSACTIONS_COLLECTION].find(
+        {"wallet_id": wallet_id}, {"_id": 0, "wallet_id": 0}
+    ).sort("timestamp", DESCENDING).skip(skip).limit(limit)
+    return await cursor.to_list(length=limit)
+
+async def delete_synced_transactions(wallet_id: str):
+    """Removes every synced transaction of a wallet."""
+    await db.db[SYNCED_TRANSACTIONS_COLLECTION].delete_many({"wallet_id": wallet_id})
+
+async def migrate_embedded_synced_transactions():
+    """
+    Moves the `synced_transactions` lists that older versions embedded in wallet
+    documents into the synced transactions collection, one wallet at a time.
+    """
+    moved = 0
+    cursor = db.db.wallets.find({"synced_transactions": {"$exists": True}}, {"synced_transactions": 1})
+    async for wallet in cursor:
+        embedded = wallet.get("synced_transactions") or []
+        await store_synced_transactions(str(wallet["_id"]), embedded)
+        await db.db.wallets.update_one({"_id": wallet["_id"]}, {"$unset": {"synced_transactions": ""}})
+        moved += len(embedded)
+    if moved:
+        logger.info(f"Moved {moved} embedded synced transactions out of wallet documents.")
@@ -0,0 +1,72 @@
+import os
+from datetime import datetime, timezone
+from typing import Optional
+import httpx
+from dotenv import load_dotenv
+from fastapi import HTTPException
+from app.core.http import get_http_client
+
+load_dotenv()
+
+COINGECKO_API_URL = "https://api.coingecko.com/api/v3"
+COINGECKO_API_KEY = os.getenv("COINGECKO_API_KEY")
+
+def get_coingecko_headers() -> dict:
+    """Returns headers for CoinGecko API, including the API key if available."""
+    headers = {"accept": "application/json"}
+    if COINGECKO_API_KEY:
+        headers["x-cg-demo-api-key"] = COINGECKO_API_KEY
+    return headers
+
+async def fetch_coingecko_market_chart(days, currency: str) -> list:
+    """Fetches historical market data from CoinGecko for a given number of days (or "max")."""
+    url = f"{COINGECKO_API_URL}/coins/bitcoin/market_chart"
+    params = {"vs_currency": currency, "days": str(days)}
+    headers = get_coingecko_headers()
+    try:
+        response = await get_http_client().get(url, params=params, headers=headers)
+        response.raise_for_status()
+        return response.json().get("prices", [])
+    except httpx.HTTPError as e:
+        raise HTTPException(status_code=503, detail=f"Error fetching data from CoinGecko: {e}")
+
+async def fetch_coingecko_market_chart_range(start: datetime, end: datetime, currency: str) -> list:
+    """Fetches historical market data from CoinGecko between two UTC datetimes."""
+    url = f"{COINGECKO_API_URL}/coins/bitcoin/market_chart/range"
+    params = {
+        "vs_currency": currency,
+        "from": str(int(start.replace(tzinfo=timezone.utc).timestamp())),
+        "to": str(int(end.replace(tzinfo=timezone.utc).timestamp())),
+    }
+    headers = get_coingecko_headers()
+    try:
+        response = await get_http_client().get(url, params=params, headers=headers)
+        response.raise_for_status()
+        return response.json().get("prices", [])
+    except httpx.HTTPError as e:
+        raise HTTPException(status_code=503, detail=f"Error fetching data from CoinGecko: {e}")
+
+async def fetch_btc_prices() -> Optional[dict]:
+    """Fetches the current BTC price in USD and BRL from CoinGecko."""
+    url = f"{COINGECKO_API_URL}/simple/price"
+    params = {"ids": "bitcoin", "vs_currencies": "usd,brl"}
+    headers = get_coingecko_headers()
+
+    try:
+        resp = await get_http_client().get(url, params=params, headers=headers)
+        resp.raise_for_status()
+        data = resp.json()
+
+        btc_usd = data["bitcoin"]["usd"]
+        btc_brl = data["bitcoin"]["brl"]
+        usd_brl_calculated = btc_brl / btc_usd if btc_usd else 0
+
+        return {
+            "btc_usd_price": btc_usd,
+            "btc_brl_price": btc_brl,
+            "usd_brl_calculated": round(usd_brl_calculated, 4),
+            "last_updated": datetime.now(timezone.utc).isoformat()
+        }
+    except httpx.HTTPError as e:
+        print(f"Error fetching current Bitcoin prices: {e}")
+        return None
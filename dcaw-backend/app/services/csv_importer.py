@@ -1,7 +1,67 @@
 import csv
+import hashlib
+import logging
 from datetime import datetime
 from io import StringIO
-from typing import List, Dict, Union, Optional
+from itertools import islice
+from typing import Dict, Iterable, Iterator, List, Optional, Union
+from pymongo import ASCENDING, UpdateOne
+from pymongo.errors import BulkWriteError
+from app.db.connection import db
+from app.services.blockchain_sync import DUPLICATE_KEY_ERROR
+from app.services.leases import hold_lease
+
+logger = logging.getLogger(__name__)
+
+async def ensure_import_indexes():
+    """Makes a CSV row fingerprint unique within a wallet, so re-imported rows are rejected."""
+    await db.db.transactions.create_index(
+        [("wallet_id", ASCENDING), ("fingerprint", ASCENDING)],
+        unique=True,
+        partialFilterExpression={"fingerprint": {"$type": "string"}}
+    )
+
+async def backfill_import_fingerprints():
+    """
+    Gives the CSV rows imported before fingerprints existed the fingerprint a new upload
+    of their export computes, so re-uploading it skips them instead of duplicating every
+    row. Identical rows of a wallet are numbered like in a file, after any occurrence the
+    wallet already uses. Runs once under a lease; later runs find nothing to do.
+    """
+    async with hold_lease("csv-fingerprint-backfill"):
+        query = {"transaction_type": {"$in": ["cmc_buy", "cmc_sell"]}, "fingerprint": {"$exists": False}}
+        wallet_ids = await db.db.transactions.distinct("wallet_id", query)
+        filled = 0
+        for wallet_id in wallet_ids:
+            used = set(await db.db.transactions.distinct(
+                "fingerprint", {"wallet_id": wallet_id, "fingerprint": {"$type": "string"}}
+            ))
+            occurrences, operations = {}, []
+            cursor = db.db.transactions.find({**query, "wallet_id": wallet_id}).sort(
+                [("transaction_date", ASCENDING), ("_id", ASCENDING)]
+            )
+            async for transaction in cursor:
+                key = CoinMarketCapCSVImporter.fingerprint(transaction)
+                occurrence = occurrences.get(key, 0)
+                while CoinMarketCapCSVImporter.fingerprint(transaction, occurrence) in used:
+                    occurrence += 1
+                fingerprint = CoinMarketCapCSVImporter.fingerprint(transaction, occurrence)
+                occurrences[key] = occurrence + 1
+                used.add(fingerprint)
+                operations.append(UpdateOne({"_id": transaction["_id"]}, {"$set": {"fingerprint": fingerprint}}))
+            if not operations:
+                continue
+            try:
+                result = await db.db.transactions.bulk_write(operations, ordered=False)
+                filled += result.modified_count
+            except BulkWriteError as e:
+                # An import running meanwhile already stored the row; it stays without a fingerprint
+                errors = e.details.get("writeErrors", [])
+                if any(error["code"] != DUPLICATE_KEY_ERROR for error in errors):
+                    raise
+                filled += e.details.get("nModified", 0)
+        if filled:
+            logger.info(f"Backfilled fingerprints of {filled} imported CSV transactions.")
 
 class CoinMarketCapCSVImporter:
     REQUIRED_HEADERS = [
@@ -9,6 +69,10 @@ class CoinMarketCapCSVImporter:
         "Total value (USD)", "Fee", "Fee Currency", "Notes"
     ]
     DATE_FORMAT = "%Y-%m-%d %H:%M:%S"
+    FINGERPRINT_FIELDS = [
+        "transaction_date", "transaction_type", "amount_btc", "price_per_btc_usd",
+        "total_value_usd", "fee", "fee_currency", "notes"
+    ]
 
     @staticmethod
     def _clean_numeric_value(value: str) -> Optional[float]:
@@ -22,6 +86,16 @@ class CoinMarketCapCSVImporter:
         except ValueError:
             return None # Or raise a more specific error
 
+    @staticmethod
+    def fingerprint(transaction: Dict[str, Union[str, float, datetime, None]], occurrence: int = 0) -> str:
+        """
+        Returns a stable hash of a parsed row's content. `occurrence` numbers identical
+        rows (same content, same second) within a file, so genuinely repeated trades stay
+        distinct while the same rows of an overlapping export hash the same.
+        """
+        key = "|".join(str(transaction[field]) for field in CoinMarketCapCSVImporter.FINGERPRINT_FIELDS)
+        return hashlib.sha256(f"{key}|{occurrence}".encode("utf-8")).hexdigest()
+
     @staticmethod
     def parse_csv(csv_content: str) -> List[Dict[str, Union[str, float, datetime, None]]]:
         """
@@ -29,76 +103,109 @@ class CoinMarketCapCSVImporter:
         each representing a transaction.
         Raises ValueError for invalid CSV format or non-BTC transactions.
         """
-        f = StringIO(csv_content)
-        reader = csv.reader(f)
+        return list(CoinMarketCapCSVImporter.iter_csv(StringIO(csv_content)))
+
+    @staticmethod
+    def iter_csv_chunks(lines: Iterable[str], chunk_size: int) -> Iterator[List[Dict[str, Union[str, float, datetime, None]]]]:
+        """Groups the transactions of `iter_csv` into lists of at most `chunk_size`."""
+        transactions = CoinMarketCapCSVImporter.iter_csv(lines)
+        while True:
+            chunk = list(islice(transactions, chunk_size))
+            if not chunk:
+                return
+            yield chunk
+
+    @staticmethod
+    def iter_csv(lines: Iterable[str]) -> Iterator[Dict[str, Union[str, float, datetime, None]]]:
+        """
+        Parses CoinMarketCap CSV lines (e.g. a text file object) one row at a time and
+        yields a dictionary per BTC transaction, with its `fingerprint`, so a file of any
+        size is never held in memory. Raises ValueError, when the offending row is reached,
+        for invalid CSV format or data.
+        """
+        reader = csv.reader(lines)
 
-        headers = next(reader)
+        headers = next(reader, None)
+        if headers is None:
+            raise ValueError("CSV file is empty.")
         # Clean headers by stripping whitespace and removing byte order mark if present
         cleaned_headers = [h.strip().replace('\ufeff', '') for h in headers]
         
         if cleaned_headers != CoinMarketCapCSVImporter.REQUIRED_HEADERS:
             raise ValueError(f"CSV headers mismatch. Expected: {CoinMarketCapCSVImporter.REQUIRED_HEADERS}, Got: {cleaned_headers}")
 
-        transactions_data = []
+        # Identical rows are counted over the whole file, wherever they appear in it
+        occurrences = {}
         for i, row in enumerate(reader):
             if not row: # Skip empty rows
                 continue
+            transaction = CoinMarketCapCSVImporter.parse_row(row, i + 2)
+            if transaction is None:
+                continue
+            key = CoinMarketCapCSVImporter.fingerprint(transaction)
+            transaction["fingerprint"] = CoinMarketCapCSVImporter.fingerprint(transaction, occurrences.get(key, 0))
+            occurrences[key] = occurrences.get(key, 0) + 1
+            yield transaction
 
-            # Ensure row has enough columns
-            if len(row) != len(CoinMarketCapCSVImporter.REQUIRED_HEADERS):
-                raise ValueError(f"Row {i+2} has incorrect number of columns. Expected {len(CoinMarketCapCSVImporter.REQUIRED_HEADERS)}, got {len(row)}")
+    @staticmethod
+    def parse_row(row: List[str], line_number: int) -> Optional[Dict[str, Union[str, float, datetime, None]]]:
+        """
+        Converts one CSV row into a transaction dictionary. Returns None for rows of
+        other tokens, which are skipped. Raises ValueError for invalid rows.
+        """
+        # Ensure row has enough columns
+        if len(row) != len(CoinMarketCapCSVImporter.REQUIRED_HEADERS):
+            raise ValueError(f"Row {line_number} has incorrect number of columns. Expected {len(CoinMarketCapCSVImporter.REQUIRED_HEADERS)}, got {len(row)}")
 
-            try:
-                date_str = row[0].strip()
-                token = row[1].strip()
-                transaction_type_str = row[2].strip().lower() # 'buy' or 'sell'
-                price_usd_str = row[3].strip()
-                amount_str = row[4].strip()
-                total_value_usd_str = row[5].strip()
-                fee_str = row[6].strip()
-                fee_currency = row[7].strip() if row[7].strip() != "--" else None
-                notes = row[8].strip() if row[8].strip() else None
-
-                # Validate Token
-                if token != "BTC":
-                    # For a CSV with mixed tokens, we can skip non-BTC ones
-                    # For strict validation, raise ValueError
-                    print(f"Skipping row {i+2}: Only BTC transactions are supported. Found token: {token}")
-                    continue
-
-                # Convert types
-                transaction_date = datetime.strptime(date_str, CoinMarketCapCSVImporter.DATE_FORMAT)
-                price_usd = CoinMarketCapCSVImporter._clean_numeric_value(price_usd_str)
-                amount = CoinMarketCapCSVImporter._clean_numeric_value(amount_str)
-                total_value_usd = CoinMarketCapCSVImporter._clean_numeric_value(total_value_usd_str)
-                fee = CoinMarketCapCSVImporter._clean_numeric_value(fee_str)
-
-                if any(val is None for val in [price_usd, amount, total_value_usd]):
-                    raise ValueError(f"Row {i+2}: Missing or invalid numeric data.")
-                
-                # Determine transaction type for the model
-                if transaction_type_str == "buy":
-                    final_transaction_type = "cmc_buy"
-                elif transaction_type_str == "sell":
-                    final_transaction_type = "cmc_sell"
-                else:
-                    raise ValueError(f"Row {i+2}: Invalid transaction type '{transaction_type_str}'. Expected 'buy' or 'sell'.")
-
-                transactions_data.append({
-                    "transaction_date": transaction_date,
-                    "transaction_type": final_transaction_type,
-                    "amount_btc": amount,
-                    "price_per_btc_usd": price_usd,
-                    "total_value_usd": total_value_usd,
-                    "currency": "USD", # CMC exports are in USD
-                    "fee": fee,
-                    "fee_currency": fee_currency,
-                    "notes": notes,
-                    "txid": None # No txid from CMC CSV
-                })
-            except ValueError as e:
-                raise ValueError(f"Error parsing row {i+2}: {e}")
-            except Exception as e:
-                raise ValueError(f"Unexpected error parsing row {i+2}: {e}")
-
-        return transactions_data
+        try:
+            date_str = row[0].strip()
+            token = row[1].strip()
+            transaction_type_str = row[2].strip().lower() # 'buy' or 'sell'
+            price_usd_str = row[3].strip()
+            amount_str = row[4].strip()
+            total_value_usd_str = row[5].strip()
+            fee_str = row[6].strip()
+            fee_currency = row[7].strip() if row[7].strip() != "--" else None
+            notes = row[8].strip() if row[8].strip() else None
+
+            # Validate Token
+            if token != "BTC":
+                # For a CSV with mixed tokens, we can skip non-BTC ones
+                # For strict validation, raise ValueError
+                print(f"Skipping row {line_number}: Only BTC transactions are supported. Found token: {token}")
+                return None
+
+            # Convert types
+            transaction_date = datetime.strptime(date_str, CoinMarketCapCSVImporter.DATE_FORMAT)
+            price_usd = CoinMarketCapCSVImporter._clean_numeric_value(price_usd_str)
+            amount = CoinMarketCapCSVImporter._clean_numeric_value(amount_str)
+            total_value_usd = CoinMarketCapCSVImporter._clean_numeric_value(total_value_usd_str)
+            fee = CoinMarketCapCSVImporter._clean_numeric_value(fee_str)
+
+            if any(val is None for val in [price_usd, amount, total_value_usd]):
+                raise ValueError(f"Row {line_number}: Missing or invalid numeric data.")
+            
+            # Determine transaction type for the model
+            if transaction_type_str == "buy":
+                final_transaction_type = "cmc_buy"
+            elif transaction_type_str == "sell":
+                final_transaction_type = "cmc_sell"
+            else:
+                raise ValueError(f"Row {line_number}: Invalid transaction type '{transaction_type_str}'. Expected 'buy' or 'sell'.")
+
+            return {
+                "transaction_date": transaction_date,
+                "transaction_type": final_transaction_type,
+                "amount_btc": amount,
+                "price_per_btc_usd": price_usd,
+                "total_value_usd": total_value_usd,
+                "currency": "USD", # CMC exports are in USD
+                "fee": fee,
+                "fee_currency": fee_currency,
+                "notes": notes,
+                "txid": None # No txid from CMC CSV
+            }
+        except ValueError as e:
+            raise ValueError(f"Error parsing row {line_number}: {e}")
+        except Exception as e:
+            raise ValueError(f"Unexpected error parsing row {line_number}: {e}")
@@ -0,0 +1,122 @@
+from datetime import date, datetime, timezone
+from typing import List, Optional
+import numpy as np
+from fastapi import HTTPException
+from app.services.dca_service import DCA_FREQUENCIES
+from app.services.price_history import get_price_series
+
+UNIX_EPOCH_ORDINAL = date(1970, 1, 1).toordinal()
+
+def _schedule_periods(days: np.ndarray) -> dict:
+    """
+    Numbers the purchase periods of every supported frequency over a series of day
+    ordinals, following the live scheduler: "daily" buys once per day and "monthly"
+    once per calendar month. Each frequency maps to a non-decreasing period id per day.
+    """
+    months = (days - UNIX_EPOCH_ORDINAL).astype("datetime64[D]").astype("datetime64[M]")
+    new_month = np.ones(len(days), dtype=bool)
+    new_month[1:] = months[1:] != months[:-1]
+    return {
+        "daily": np.arange(len(days)),
+        "monthly": np.cumsum(new_month) - 1,
+    }
+
+def _first_in_period(eligible: np.ndarray, periods: np.ndarray) -> np.ndarray:
+    """
+    Keeps only the first eligible day of each period in every row of `eligible`.
+    A purchase whose scheduled day is out of band stays pending, like `waiting_for_price`
+    in the live scheduler, and happens on the first in-band day of the same period.
+    """
+    new_period = np.ones(len(periods), dtype=bool)
+    new_period[1:] = periods[1:] != periods[:-1]
+    seen = np.cumsum(eligible, axis=1)
+    # Eligible days counted before each period started, repeated over the period's days
+    before_period = (seen - eligible)[:, new_period][:, np.cumsum(new_period) - 1]
+    return eligible & (seen - before_period == 1)
+
+def run_backtest(prices_usd: list, configurations: List[dict]) -> List[dict]:
+    """
+    Simulates every DCA configuration over a daily [timestamp_ms, price] series at once.
+    Configurations are rows of (configurations x days) matrices, so the whole sweep is a
+    handful of vectorized operations: each frequency period buys on its first in-band day,
+    and BTC, invested USD and portfolio value are cumulative sums along the days.
+    Amounts are taken as USD. The drawdown is the largest peak-to-trough drop of the
+    portfolio value per invested dollar, which keeps new contributions from hiding losses.
+    """
+    if not prices_usd:
+        return []
+    days = np.fromiter(
+        (datetime.fromtimestamp(p[0] / 1000, tz=timezone.utc).toordinal() for p in prices_usd),
+        dtype=np.int64, count=len(prices_usd)
+    )
+    prices = np.fromiter((p[1] for p in prices_usd), dtype=float, count=len(prices_usd))
+    order = np.argsort(days, kind="stable")
+    days, prices = days[order], prices[order]
+
+    periods = _schedule_periods(days)
+    amounts = np.array([c["dca_amount"] for c in configurations], dtype=float)[:, None]
+    price_min = np.array([c.get("dca_price_range_min") if c.get("dca_price_range_min") is not None else -np.inf for c in configurations])[:, None]
+    price_max = np.array([c.get("dca_price_range_max") if c.get("dca_price_range_max") is not None else np.inf for c in configurations])[:, None]
+
+    eligible = np.broadcast_to((prices > 0) & (prices >= price_min) & (prices <= price_max), (len(configurations), len(days)))
+    buys = np.zeros(eligible.shape, dtype=bool)
+    for frequency, frequency_periods in periods.items():
+        rows = np.array([c["dca_frequency"] == frequency for c in configurations])
+        if rows.any():
+            buys[rows] = _first_in_period(eligible[rows], frequency_periods)
+
+    safe_prices = np.where(prices > 0, prices, 1.0)
+    btc = np.cumsum(np.where(buys, amounts / safe_prices, 0.0), axis=1)
+    invested = np.cumsum(np.where(buys, amounts, 0.0), axis=1)
+    values = btc * prices
+
+    with np.errstate(divide="ignore", invalid="ignore"):
+        multiple = np.where(invested > 0, values / invested, 1.0)
+        peak = np.maximum.accumulate(multiple, axis=1)
+        drawdown = np.where(peak > 0, 1 - multiple / peak, 0.0).max(axis=1)
+
+    results = []
+    for index, config in enumerate(configurations):
+        btc_accumulated = float(btc[index, -1])
+        invested_usd = float(invested[index, -1])
+        final_value_usd = float(values[index, -1])
+        profit_loss_usd = final_value_usd - invested_usd
+        results.append({
+            "configuration": config,
+            "purchases": int(buys[index].sum()),
+            "btc_accumulated": btc_accumulated,
+            "invested_usd": invested_usd,
+            "average_cost_usd": invested_usd / btc_accumulated if btc_accumulated > 0 else 0,
+            "final_value_usd": final_value_usd,
+            "profit_loss_usd": profit_loss_usd,
+            "profit_loss_percent": (profit_loss_usd / invested_usd * 100) if invested_usd != 0 else 0,
+            "max_drawdown_percent": float(drawdown[index]) * 100,
+        })
+    return results
+
+async def backtest_dca_configurations(start_date: datetime, end_date: Optional[datetime], configurations: List[dict]) -> dict:
+    """
+    Backtests DCA configurations over the stored daily BTC/USD history between two dates.
+    Raises ValueError for an invalid range or unsupported frequencies.
+    """
+    if start_date.tzinfo is not None:
+        start_date = start_date.astimezone(timezone.utc).replace(tzinfo=None)
+    if end_date is not None and end_date.tzinfo is not None:
+        end_date = end_date.astimezone(timezone.utc).replace(tzinfo=None)
+    end_date = end_date or datetime.utcnow()
+    if start_date >= end_date:
+        raise ValueError("'start_date' must be before 'end_date'.")
+    unsupported = {c["dca_frequency"] for c in configurations} - set(DCA_FREQUENCIES)
+    if unsupported:
+        raise ValueError(f"Unsupported DCA frequencies: {', '.join(sorted(unsupported))}. Supported values are: {', '.join(DCA_FREQUENCIES)}.")
+
+    prices_usd = await get_price_series(start_date, end_date)
+    if not prices_usd:
+        raise HTTPException(status_code=503, detail="No price data available for the requested period.")
+
+    return {
+        "start_date": datetime.fromtimestamp(prices_usd[0][0] / 1000, tz=timezone.utc).date().isoformat(),
+        "end_date": datetime.fromtimestamp(prices_usd[-1][0] / 1000, tz=timezone.utc).date().isoformat(),
+        "days": len(prices_usd),
+        "results": run_backtest(prices_usd, configurations),
+    }
@@ -1,100 +1,304 @@
-import json
+import asyncio
+import time
+import uuid
 from datetime import datetime, timedelta
 from typing import List, Optional
 
 from motor.motor_asyncio import AsyncIOMotorClient
 from beanie import PydanticObjectId
+from bson.objectid import ObjectId
+from pymongo import ASCENDING, UpdateOne
 
-from app.models.wallet import Wallet, DCAConfiguration
-from app.models.transaction import TransactionCreate, Transaction
+from app.models.transaction import TransactionCreate
 from app.core.config import settings
+from app.db.connection import db
+from app.services.ledger import apply_transactions_to_ledger
+from app.services.price_cache import latest_price_cache
 
-# This would ideally come from a real-time price API or a robust data source
-BITCOIN_PRICE_FILE = "./bitcoin_price.json"
+DCA_FREQUENCIES = ["daily", "monthly"] # Extend with other frequencies (weekly, etc.) if supported
+# Lower bound for the scheduler sleep, so configurations that keep failing are not retried in a busy loop
+MIN_SLEEP_SECONDS = 5
+
+dca_schedule_changed = asyncio.Event()
+dca_execution_lock = asyncio.Lock()
  
 
-async def get_current_bitcoin_price() -> Optional[float]:
-    """Reads the latest Bitcoin price from the bitcoin_price file."""
-    try:
-        with open(BITCOIN_PRICE_FILE, 'r') as f:
-            data = json.load(f)
-            price = float(data.get("price"))
-            print(f"Current Bitcoin price read from file: {price}")
-            return price
-    except FileNotFoundError:
-        print(f"Error: {BITCOIN_PRICE_FILE} not found. Cannot fetch Bitcoin price.")
-        return None
-    except json.JSONDecodeError:
-        print(f"Error: Could not decode JSON from {BITCOIN_PRICE_FILE}.")
-        return None
-    except Exception as e:
-        print(f"An unexpected error occurred while reading Bitcoin price: {e}")
+def compute_next_execution(dca_config: dict) -> Optional[datetime]:
+    """
+    Returns when a DCA configuration is next due: a day after the last execution for
+    "daily", the start of the following month for "monthly" and right away when it
+    never ran. Unsupported frequencies are never due (None).
+    """
+    last_executed = dca_config.get("dca_last_executed")
+    frequency = dca_config.get("dca_frequency")
+    if frequency not in DCA_FREQUENCIES:
         return None
+    if not last_executed:
+        return datetime.utcnow()
+    if frequency == "daily":
+        return last_executed + timedelta(days=1)
+    # Monthly: due once a new calendar month has started since the last execution
+    if last_executed.month == 12:
+        return datetime(last_executed.year + 1, 1, 1)
+    return datetime(last_executed.year, last_executed.month + 1, 1)
+
+def schedule_dca_settings(dca_settings: List[dict]) -> List[dict]:
+    """Fills `next_execution_at` of every DCA configuration before it is stored."""
+    for dca_config in dca_settings:
+        dca_config["next_execution_at"] = compute_next_execution(dca_config)
+        dca_config["waiting_for_price"] = False
+    return dca_settings
+
+def in_price_band(dca_config: dict, btc_price: float) -> bool:
+    """Whether `btc_price` is inside the configuration's (optional) price range."""
+    price_min = dca_config.get("dca_price_range_min")
+    price_max = dca_config.get("dca_price_range_max")
+    return (price_min is None or btc_price >= price_min) and (price_max is None or btc_price <= price_max)
+
+def notify_dca_schedule_changed():
+    """Wakes the DCA scheduler so that new or edited configurations are picked up right away."""
+    dca_schedule_changed.set()
+
+async def ensure_dca_schedule():
+    """Creates the due-time index and schedules configurations stored without `next_execution_at`."""
+    wallets = db.db["wallets"]
+    await wallets.create_index([("dca_enabled", ASCENDING), ("dca_settings.next_execution_at", ASCENDING)])
+
+    unscheduled = wallets.find(
+        {"dca_enabled": True, "dca_settings": {"$elemMatch": {"next_execution_at": None, "dca_frequency": {"$in": DCA_FREQUENCIES}}}},
+        {"dca_settings": 1}
+    )
+    async for wallet in unscheduled:
+        await wallets.update_one(
+            {"_id": wallet["_id"]},
+            {"$set": {"dca_settings": schedule_dca_settings(wallet["dca_settings"])}}
+        )
 
-async def process_dca_for_wallet(wallet: Wallet, db_client: AsyncIOMotorClient):
-    """Processes DCA configurations for a single wallet."""
-    current_btc_price = await get_current_bitcoin_price()
-    if not current_btc_price:
-        print(f"Skipping DCA for wallet {wallet.id}: Could not get current Bitcoin price.")
-        return
+def _due_wallets_query(now: datetime) -> dict:
+    """Enabled wallets with a configuration that is due and not waiting for its price range."""
+    return {
+        "dca_enabled": True,
+        "dca_settings": {"$elemMatch": {"next_execution_at": {"$lte": now}, "waiting_for_price": {"$ne": True}}},
+    }
 
-    for dca_config in wallet.dca_settings:
-        if not wallet.dca_enabled:
+async def get_next_dca_execution() -> Optional[datetime]:
+    """
+    Returns the earliest upcoming `next_execution_at` over all enabled DCA configurations.
+    Configurations already due but waiting for their price band are left to the price triggers.
+    """
+    now = datetime.utcnow()
+    # The range filter makes the multikey sort use only upcoming configurations of each wallet
+    wallet = await db.db["wallets"].find_one(
+        {"dca_enabled": True, "dca_settings.next_execution_at": {"$gt": now}},
+        {"dca_settings.next_execution_at": 1},
+        sort=[("dca_settings.next_execution_at", ASCENDING)]
+    )
+    if not wallet:
+        return None
+    return min((c["next_execution_at"] for c in wallet["dca_settings"] if c.get("next_execution_at") and c["next_execution_at"] > now), default=None)
+
+def build_dca_purchases(wallet: dict, current_btc_price: float, now: datetime, execution_id: str, indexes: Optional[set] = None) -> tuple:
+    """
+    Builds the purchases of every due DCA configuration of a wallet (or only of
+    `indexes`) at one price. A due configuration whose price range excludes the price
+    is marked `waiting_for_price` instead, and bought when a tick enters its range.
+    Returns the purchases as (index, transaction document) pairs and the wallet updates.
+    Every update only matches while the configuration still has the `next_execution_at`
+    that was read, so a configuration another executor already advanced is left alone.
+    """
+    purchases = []
+    updates = []
+    for index, dca_config in enumerate(wallet["dca_settings"]):
+        if indexes is not None and index not in indexes:
+            continue
+        next_execution_at = dca_config.get("next_execution_at")
+        if not next_execution_at or next_execution_at > now:
+            continue
+        claim = {"_id": wallet["_id"], f"dca_settings.{index}.next_execution_at": next_execution_at}
+        if not in_price_band(dca_config, current_btc_price):
+            if not dca_config.get("waiting_for_price"):
+                updates.append(UpdateOne(claim, {"$set": {f"dca_settings.{index}.waiting_for_price": True}}))
             continue
 
-        should_execute = False
-        now = datetime.utcnow()
+        purchases.append((index, TransactionCreate(
+            wallet_id=str(wallet["_id"]),
+            transaction_type="dca_buy",
+            amount_btc=dca_config["dca_amount"] / current_btc_price,
+            price_per_btc_usd=current_btc_price,
+            total_value_usd=dca_config["dca_amount"],
+            currency=dca_config["dca_currency"],
+            transaction_date=now,
+            origin="dca"
+        ).dict()))
 
-        # Determine if DCA purchase is due
-        if dca_config.dca_frequency == "daily":
-            if not dca_config.dca_last_executed or (now - dca_config.dca_last_executed) >= timedelta(days=1):
-                should_execute = True
-        elif dca_config.dca_frequency == "monthly":
-            if not dca_config.dca_last_executed:
-                should_execute = True
-            else:
-                # Check if it's a new month since last execution
-                if (now.year > dca_config.dca_last_executed.year) or \
-                   (now.year == dca_config.dca_last_executed.year and now.month > dca_config.dca_last_executed.month):
-                    should_execute = True
-        # Extend with other frequencies (weekly, etc.) if supported
-
-        if should_execute:
-            print(f"Executing DCA for wallet {wallet.id} with amount {dca_config.dca_amount} {dca_config.dca_currency}")
-            
-            btc_amount = dca_config.dca_amount / current_btc_price
-            
-            # Create transaction
-            transaction = TransactionCreate(
-                wallet_id=str(wallet.id),
-                transaction_type="dca_buy",
-                amount_btc=btc_amount,
-                price_per_btc_usd=current_btc_price,
-                total_value_usd=dca_config.dca_amount,
-                currency=dca_config.dca_currency,
-                origin="dca"
-            )
-            
-            # Save transaction to DB
-            new_transaction = Transaction(**transaction.dict())
-            await new_transaction.insert()
-
-            # Update wallet's btc_holdings
-            wallet.btc_holdings += btc_amount
-            
-            # Update dca_last_executed for this specific DCA configuration
-            dca_config.dca_last_executed = now
-            
-            # Save updated wallet
-            await wallet.save()
-            print(f"DCA transaction created and wallet {wallet.id} updated.")
-
-async def run_dca_scheduler(db_client: AsyncIOMotorClient):
-    """Main function to be called by the scheduler to process all active DCAs."""
-    print("Running DCA scheduler...")
-    wallets: List[Wallet] = await Wallet.find({"dca_enabled": True}).to_list()
-    
+        dca_config["dca_last_executed"] = now
+        updates.append(UpdateOne(claim, {"$set": {
+            f"dca_settings.{index}.dca_last_executed": now,
+            f"dca_settings.{index}.next_execution_at": compute_next_execution(dca_config),
+            f"dca_settings.{index}.waiting_for_price": False,
+            f"dca_settings.{index}.last_execution_id": execution_id,
+        }}))
+    return purchases, updates
+
+async def _claimed_purchases(purchases_by_wallet: dict, wallet_ids: dict, execution_id: str) -> dict:
+    """Keeps the purchases whose configuration was advanced by the run `execution_id`."""
+    wallets = await db.db["wallets"].find(
+        {"_id": {"$in": [wallet_ids[w] for w in purchases_by_wallet]}},
+        {"dca_settings.last_execution_id": 1}
+    ).to_list(length=None)
+    settings_by_wallet = {str(w["_id"]): w.get("dca_settings", []) for w in wallets}
+    claimed = {}
+    for wallet_id, purchases in purchases_by_wallet.items():
+        dca_settings = settings_by_wallet.get(wallet_id, [])
+        kept = [
+            (index, transaction) for index, transaction in purchases
+            if index < len(dca_settings) and dca_settings[index].get("last_execution_id") == execution_id
+        ]
+        if kept:
+            claimed[wallet_id] = kept
+    return claimed
+
+async def execute_dca_batch(wallets: List[dict], current_btc_price: float, now: datetime, indexes_by_wallet: Optional[dict] = None) -> int:
+    """
+    Executes the due DCA configurations of a batch of wallets. The scheduler and the
+    price triggers may run in different processes, so each configuration is first
+    claimed by advancing its schedule with a conditional update; only the purchases
+    whose claim matched are inserted, with one `insert_many`, and added to
+    `btc_holdings` with one bulk write. A crash after the claim skips that purchase
+    rather than buying twice. Ledger updates then run with at most DCA_JOB_CONCURRENCY
+    wallets at a time. Returns the number of purchases.
+    `indexes_by_wallet` restricts each wallet to some configurations (price triggers).
+    """
+    execution_id = uuid.uuid4().hex
+    wallet_ids = {str(wallet["_id"]): wallet["_id"] for wallet in wallets}
+    purchases_by_wallet = {}
+    wallet_updates = []
     for wallet in wallets:
-        await process_dca_for_wallet(wallet, db_client)
-    print("DCA scheduler finished.")
+        indexes = indexes_by_wallet.get(str(wallet["_id"])) if indexes_by_wallet is not None else None
+        purchases, updates = build_dca_purchases(wallet, current_btc_price, now, execution_id, indexes)
+        wallet_updates.extend(updates)
+        if purchases:
+            purchases_by_wallet[str(wallet["_id"])] = purchases
+
+    if not wallet_updates:
+        return 0
+    result = await db.db["wallets"].bulk_write(wallet_updates, ordered=False)
+    if purchases_by_wallet and result.matched_count < len(wallet_updates):
+        # Another executor got to some configurations first
+        purchases_by_wallet = await _claimed_purchases(purchases_by_wallet, wallet_ids, execution_id)
+    if not purchases_by_wallet:
+        return 0
+
+    transactions_by_wallet = {
+        wallet_id: [transaction for _, transaction in purchases]
+        for wallet_id, purchases in purchases_by_wallet.items()
+    }
+    documents = [t for transactions in transactions_by_wallet.values() for t in transactions]
+    await db.db["transactions"].insert_many(documents)
+    await db.db["wallets"].bulk_write([
+        UpdateOne({"_id": wallet_ids[wallet_id]}, {"$inc": {"btc_holdings": sum(t["amount_btc"] for t in transactions)}})
+        for wallet_id, transactions in transactions_by_wallet.items()
+    ], ordered=False)
+
+    semaphore = asyncio.Semaphore(settings.DCA_JOB_CONCURRENCY)
+
+    async def update_ledger(wallet_id: str, transactions: List[dict]):
+        async with semaphore:
+            try:
+                await apply_transactions_to_ledger(wallet_id, transactions)
+            except Exception as e:
+                print(f"Failed to update the ledger of wallet {wallet_id} after DCA: {e}")
+
+    await asyncio.gather(*(update_ledger(w, t) for w, t in transactions_by_wallet.items()))
+    return len(documents)
+
+async def run_dca_scheduler(db_client: AsyncIOMotorClient) -> Optional[datetime]:
+    """
+    Main function to be called by the scheduler to process the due DCAs.
+    Only wallets with a configuration whose `next_execution_at` has passed are read;
+    the price is read once per run from the live price cache the triggers are fed
+    from, and purchases are written in batches.
+    Returns the earliest upcoming execution time.
+    """
+    print("Running DCA scheduler...")
+    started_at = time.monotonic()
+    dca_schedule_changed.clear()
+    now = datetime.utcnow()
+    due_wallets = db.db["wallets"].find(_due_wallets_query(now), {"dca_settings": 1}).batch_size(settings.DCA_JOB_BATCH_SIZE)
+
+    current_btc_price = None
+    stats = {"wallets": 0, "purchases": 0, "failed_batches": 0}
+    batch = []
+
+    async def flush():
+        try:
+            stats["purchases"] += await execute_dca_batch(batch, current_btc_price, now)
+        except Exception as e:
+            stats["failed_batches"] += 1
+            print(f"DCA failed for a batch of {len(batch)} wallets: {e}")
+        batch.clear()
+
+    # Price triggers execute configurations too; claims keep executors in other processes
+    # from buying twice, the lock just avoids racing the triggers of this one
+    async with dca_execution_lock:
+        async for wallet in due_wallets:
+            if current_btc_price is None:
+                price_data = await latest_price_cache.get()
+                current_btc_price = price_data.get("btc_usd_price") if price_data else None
+                if not current_btc_price:
+                    print("Skipping DCA run: Could not get current Bitcoin price.")
+                    return None
+            stats["wallets"] += 1
+            batch.append(wallet)
+            if len(batch) >= settings.DCA_JOB_BATCH_SIZE:
+                await flush()
+        if batch:
+            await flush()
+
+    duration = time.monotonic() - started_at
+    print(
+        f"DCA scheduler finished: {stats['purchases']} purchases for {stats['wallets']} wallets "
+        f"({stats['failed_batches']} failed batches) in {duration:.2f}s."
+    )
+    return await get_next_dca_execution()
+
+async def execute_triggered_dca(configurations: List[tuple], current_btc_price: float) -> int:
+    """
+    Executes the due configurations among `configurations` ((wallet_id, index) pairs
+    whose price range a tick has just entered) at `current_btc_price`.
+    Returns the number of purchases.
+    """
+    indexes_by_wallet = {}
+    for wallet_id, index in configurations:
+        indexes_by_wallet.setdefault(wallet_id, set()).add(index)
+
+    async with dca_execution_lock:
+        now = datetime.utcnow()
+        wallets = await db.db["wallets"].find(
+            {"_id": {"$in": [ObjectId(w) for w in indexes_by_wallet]}, "dca_enabled": True},
+            {"dca_settings": 1}
+        ).to_list(length=None)
+        return await execute_dca_batch(wallets, current_btc_price, now, indexes_by_wallet)
 
+async def wait_for_next_dca_execution(next_execution_at: Optional[datetime]):
+    """
+    Sleeps until `next_execution_at` (at most DCA_SCHEDULER_MAX_SLEEP_SECONDS) or until
+    DCA settings change. Changes made in this process wake it at once; changes made by
+    other processes (e.g. the API, when the scheduler runs in the worker) are found by
+    checking for due configurations every DCA_SCHEDULER_POLL_SECONDS.
+    """
+    timeout = settings.DCA_SCHEDULER_MAX_SLEEP_SECONDS
+    if next_execution_at:
+        timeout = min(timeout, max((next_execution_at - datetime.utcnow()).total_seconds(), MIN_SLEEP_SECONDS))
+    deadline = time.monotonic() + timeout
+    while True:
+        remaining = deadline - time.monotonic()
+        if remaining <= 0:
+            return
+        try:
+            await asyncio.wait_for(dca_schedule_changed.wait(), min(remaining, settings.DCA_SCHEDULER_POLL_SECONDS))
+            return
+        except asyncio.TimeoutError:
+            pass
+        if await db.db["wallets"].find_one(_due_wallets_query(datetime.utcnow()), {"_id": 1}):
+            return
@@ -0,0 +1,114 @@
+import logging
+import time
+from bisect import bisect_left, bisect_right, insort
+from typing import List, Optional
+from app.core.config import settings
+from app.db.connection import db
+from app.services.dca_service import execute_triggered_dca
+
+logging.basicConfig(level=logging.INFO)
+logger = logging.getLogger(__name__)
+
+class PriceBandIndex:
+    """
+    In-memory index of the price ranges of enabled DCA configurations, keyed by
+    (wallet_id, index). Lower and upper bounds are kept in two sorted lists, so
+    the ranges a price move entered are found with binary searches over
+    the bounds crossed between the old and the new price: O(log n + k).
+    """
+
+    def __init__(self):
+        self._bands = {}
+        self._lows = []
+        self._highs = []
+        self.loaded_at = None
+
+    def __len__(self) -> int:
+        return len(self._bands)
+
+    def _add(self, key: tuple, low: float, high: float):
+        self._bands[key] = (low, high)
+        insort(self._lows, (low, key))
+        insort(self._highs, (high, key))
+
+    def _remove(self, key: tuple):
+        low, high = self._bands.pop(key)
+        del self._lows[bisect_left(self._lows, (low, key))]
+        del self._highs[bisect_left(self._highs, (high, key))]
+
+    def update_wallet(self, wallet_id: str, dca_settings: List[dict]):
+        """Replaces the ranges of a wallet (pass [] when DCA is disabled)."""
+        for key in [k for k in self._bands if k[0] == wallet_id]:
+            self._remove(key)
+        for index, dca_config in enumerate(dca_settings):
+            low = dca_config.get("dca_price_range_min")
+            high = dca_config.get("dca_price_range_max")
+            if low is None and high is None:
+                continue
+            self._add((wallet_id, index), float("-inf") if low is None else low, float("inf") if high is None else high)
+
+    async def load(self):
+        """Rebuilds the index from every enabled wallet with a price range."""
+        self._bands, self._lows, self._highs = {}, [], []
+        cursor = db.db["wallets"].find(
+            {"dca_enabled": True, "dca_settings": {"$elemMatch": {"$or": [
+                {"dca_price_range_min": {"$ne": None}},
+                {"dca_price_range_max": {"$ne": None}},
+            ]}}},
+            {"dca_settings": 1}
+        )
+        async for wallet in cursor:
+            self.update_wallet(str(wallet["_id"]), wallet["dca_settings"])
+        self.loaded_at = time.monotonic()
+
+    def crossings(self, old_price: Optional[float], new_price: float) -> list:
+        """
+        Returns the keys of the ranges the price entered when it moved from `old_price`
+        to `new_price`. Without an old price every range containing the new one counts
+        as entered.
+        """
+        if old_price is None:
+            end = bisect_right(self._lows, new_price, key=lambda e: e[0])
+            return [key for low, key in self._lows[:end] if self._bands[key][1] >= new_price]
+        if old_price == new_price:
+            return []
+
+        low_price, high_price = min(old_price, new_price), max(old_price, new_price)
+        # Membership only changes for ranges with a bound between the two prices
+        candidates = {key for _, key in self._lows[
+            bisect_left(self._lows, low_price, key=lambda e: e[0]):bisect_right(self._lows, high_price, key=lambda e: e[0])
+        ]}
+        candidates.update(key for _, key in self._highs[
+            bisect_left(self._highs, low_price, key=lambda e: e[0]):bisect_right(self._highs, high_price, key=lambda e: e[0])
+        ])
+
+        entered = []
+        for key in candidates:
+            low, high = self._bands[key]
+            if low <= new_price <= high and not low <= old_price <= high:
+                entered.append(key)
+        return entered
+
+price_band_index = PriceBandIndex()
+_last_price = None
+
+async def on_price_tick(btc_usd_price: float):
+    """
+    Feeds a price tick to the trigger engine: configurations whose range the price
+    entered are handed to the DCA executor, which buys the ones that are due.
+    """
+    global _last_price
+    if price_band_index.loaded_at is None or time.monotonic() - price_band_index.loaded_at >= settings.PRICE_BAND_INDEX_REFRESH_SECONDS:
+        # Periodic reload picks up settings changed by other processes
+        await price_band_index.load()
+
+    entered = price_band_index.crossings(_last_price, btc_usd_price)
+    _last_price = btc_usd_price
+    if not entered:
+        return
+
+    purchases = await execute_triggered_dca(entered, btc_usd_price)
+    logger.info(
+        f"Price {btc_usd_price} entered {len(entered)} DCA price ranges: "
+        f"{purchases} purchases executed."
+    )
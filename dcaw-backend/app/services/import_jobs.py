@@ -0,0 +1,372 @@
+import asyncio
+import io
+import logging
+import tempfile
+from contextlib import suppress
+from datetime import datetime, timedelta
+from typing import BinaryIO, List, Optional
+from bson import ObjectId
+from motor.motor_asyncio import AsyncIOMotorGridFSBucket
+from pymongo import ASCENDING, DESCENDING, ReturnDocument
+from app.core.config import settings
+from app.db.connection import db
+from app.models.transaction import TransactionCreate
+from app.services.blockchain_sync import (
+    delete_synced_transactions,
+    insert_blockchain_transactions,
+    insert_unique_transactions,
+    iter_synced_transaction_chunks,
+    store_synced_transactions,
+)
+from app.services.csv_importer import CoinMarketCapCSVImporter
+from app.services.leases import PROCESS_ID
+from app.services.ledger import apply_transactions_to_ledger, delete_wallet_ledger, rebuild_wallet_ledger
+
+logging.basicConfig(level=logging.INFO)
+logger = logging.getLogger(__name__)
+
+IMPORT_JOBS_COLLECTION = "import_jobs"
+IMPORT_FILES_BUCKET = "import_files"
+
+# Set when a job is submitted or resumed in this process, so idle workers start it at once
+import_job_submitted = asyncio.Event()
+
+def _files_bucket() -> AsyncIOMotorGridFSBucket:
+    return AsyncIOMotorGridFSBucket(db.db, bucket_name=IMPORT_FILES_BUCKET)
+
+async def ensure_import_job_indexes():
+    """Creates the indexes used to claim queued/stale jobs and to list a user's jobs."""
+    jobs = db.db[IMPORT_JOBS_COLLECTION]
+    await jobs.create_index([("status", ASCENDING), ("heartbeat_at", ASCENDING)])
+    await jobs.create_index([("user_id", ASCENDING), ("created_at", DESCENDING)])
+
+def import_job_out(job: dict) -> dict:
+    """Shapes a job document as an ImportJobOut, with the throughput of its current (or last) run."""
+    throughput = None
+    if job.get("run_started_at") and job.get("heartbeat_at"):
+        elapsed = (job["heartbeat_at"] - job["run_started_at"]).total_seconds()
+        if elapsed > 0:
+            throughput = round(job.get("run_rows", 0) / elapsed, 2)
+    return {
+        "id": str(job["_id"]),
+        "kind": job["kind"],
+        "status": job["status"],
+        "wallet_id": job["wallet_id"],
+        "rows_processed": job.get("rows_processed", 0),
+        "inserted": job.get("inserted", 0),
+        "skipped": job.get("skipped", 0),
+        "committed_chunks": job.get("committed_chunks", 0),
+        "throughput_rows_per_second": throughput,
+        "cancel_requested": job.get("cancel_requested", False),
+        "resumable": job["status"] in ("cancelled", "failed") and not job.get("discarded", False),
+        "error": job.get("error"),
+        "attempts": job.get("attempts", 0),
+        "created_at": job["created_at"],
+        "updated_at": job.get("updated_at"),
+        "finished_at": job.get("finished_at"),
+    }
+
+async def _create_job(kind: str, user_id: str, wallet_id: str, created_wallet: bool, **fields) -> dict:
+    now = datetime.utcnow()
+    job = {
+        "kind": kind,
+        "status": "queued",
+        "user_id": user_id,
+        "wallet_id": wallet_id,
+        "created_wallet": created_wallet,
+        "rows_processed": 0,
+        "inserted": 0,
+        "skipped": 0,
+        "committed_chunks": 0,
+        "btc_holdings_applied": 0.0,
+        "attempts": 0,
+        "created_at": now,
+        "updated_at": now,
+        **fields,
+    }
+    result = await db.db[IMPORT_JOBS_COLLECTION].insert_one(job)
+    job["_id"] = result.inserted_id
+    import_job_submitted.set()
+    return job
+
+async def submit_csv_import(user_id: str, wallet_id: str, created_wallet: bool, filename: str, source: BinaryIO) -> dict:
+    """Stores the uploaded CSV in GridFS (streamed, never fully in memory) and queues its import."""
+    file_id = await _files_bucket().upload_from_stream(filename or "import.csv", source)
+    return await _create_job("csv", user_id, wallet_id, created_wallet, file_id=file_id)
+
+async def submit_blockchain_import(user_id: str, wallet_id: str, wallet_address: str) -> dict:
+    """Queues the import of an address's on-chain history into a synced wallet."""
+    return await _create_job("blockchain", user_id, wallet_id, True, wallet_address=wallet_address)
+
+async def get_import_job(job_id: str, user_id: str) -> Optional[dict]:
+    return await db.db[IMPORT_JOBS_COLLECTION].find_one({"_id": ObjectId(job_id), "user_id": user_id})
+
+async def list_import_jobs(user_id: str, limit: int = 50) -> List[dict]:
+    cursor = db.db[IMPORT_JOBS_COLLECTION].find({"user_id": user_id}).sort("created_at", DESCENDING).limit(limit)
+    return await cursor.to_list(length=limit)
+
+async def cancel_import_job(job_id: str, user_id: str) -> Optional[dict]:
+    """
+    Cancels a queued job at once; a running job is asked to stop and does so after
+    its current chunk. Committed chunks are kept, so the job can be resumed.
+    """
+    jobs = db.db[IMPORT_JOBS_COLLECTION]
+    now = datetime.utcnow()
+    job = await jobs.find_one_and_update(
+        {"_id": ObjectId(job_id), "user_id": user_id, "status": "queued"},
+        {"$set": {"status": "cancelled", "updated_at": now, "finished_at": now}},
+        return_document=ReturnDocument.AFTER
+    )
+    if job:
+        await _settle_holdings(job)
+        return job
+    await jobs.update_one(
+        {"_id": ObjectId(job_id), "user_id": user_id, "status": "running"},
+        {"$set": {"cancel_requested": True, "updated_at": now}}
+    )
+    return await get_import_job(job_id, user_id)
+
+async def resume_import_job(job_id: str, user_id: str) -> Optional[dict]:
+    """Queues a cancelled (or failed, unless its rows were discarded) job again. Returns None otherwise."""
+    job = await db.db[IMPORT_JOBS_COLLECTION].find_one_and_update(
+        {
+            "_id": ObjectId(job_id),
+            "user_id": user_id,
+            "status": {"$in": ["cancelled", "failed"]},
+            "discarded": {"$ne": True},
+        },
+        {"$set": {"status": "queued", "cancel_requested": False, "error": None, "updated_at": datetime.utcnow()}},
+        return_document=ReturnDocument.AFTER
+    )
+    if job:
+        import_job_submitted.set()
+    return job
+
+async def import_csv_chunk(wallet_id: str, import_id: str, chunk: List[dict]) -> tuple:
+    """
+    Writes one chunk of parsed CSV rows with a single unordered `insert_many`. Rows the
+    wallet already has (same fingerprint) are rejected by the unique index and skipped.
+    Returns the inserted documents and the number of skipped rows.
+    """
+    documents = []
+    for trans_data in chunk:
+        transaction_doc = TransactionCreate(**trans_data, wallet_id=wallet_id).dict()
+        transaction_doc["import_id"] = import_id
+        transaction_doc["fingerprint"] = trans_data["fingerprint"]
+        documents.append(transaction_doc)
+
+    inserted_documents = await insert_unique_transactions(documents)
+    await apply_transactions_to_ledger(wallet_id, inserted_documents)
+    return inserted_documents, len(documents) - len(inserted_documents)
+
+async def _imported_btc(job: dict) -> float:
+    """Sums the BTC the job's transactions add to the wallet; re-runs of a chunk cannot count twice."""
+    groups = await db.db.transactions.aggregate([
+        {"$match": {"wallet_id": job["wallet_id"], "import_id": str(job["_id"])}},
+        {"$group": {"_id": None, "btc": {"$sum": {
+            "$cond": [{"$eq": ["$transaction_type", "cmc_sell"]}, {"$multiply": ["$amount_btc", -1]}, "$amount_btc"]
+        }}}},
+    ]).to_list(length=1)
+    return groups[0]["btc"] if groups else 0.0
+
+async def _settle_holdings(job: dict):
+    """Brings the wallet holdings up to date with the transactions the job has committed so far."""
+    total = await _imported_btc(job)
+    delta = total - job.get("btc_holdings_applied", 0.0)
+    if delta:
+        fields = ["btc_holdings", "current_btc_balance"] if job["kind"] == "blockchain" else ["btc_holdings"]
+        await db.db.wallets.update_one({"_id": ObjectId(job["wallet_id"])}, {"$inc": {f: delta for f in fields}})
+    await db.db[IMPORT_JOBS_COLLECTION].update_one({"_id": job["_id"]}, {"$set": {"btc_holdings_applied": total}})
+    job["btc_holdings_applied"] = total
+
+async def _discard_import(job: dict):
+    """Removes every transaction written by the job (and the wallet it created)."""
+    wallet_id = job["wallet_id"]
+    await db.db.transactions.delete_many({"wallet_id": wallet_id, "import_id": str(job["_id"])})
+    if job.get("created_wallet"):
+        await db.db.wallets.delete_one({"_id": ObjectId(wallet_id)})
+        await delete_synced_transactions(wallet_id)
+        await delete_wallet_ledger(wallet_id)
+    else:
+        await rebuild_wallet_ledger(wallet_id)
+        # Takes back the holdings an earlier (cancelled or failed) run already applied
+        await _settle_holdings(job)
+
+async def _delete_import_file(job: dict):
+    if job.get("file_id"):
+        with suppress(Exception):
+            await _files_bucket().delete(job["file_id"])
+
+async def claim_import_job() -> Optional[dict]:
+    """
+    Atomically takes the oldest queued job, or a running one whose worker stopped
+    reporting progress (crashed), for this process.
+    """
+    now = datetime.utcnow()
+    stale_before = now - timedelta(seconds=settings.IMPORT_JOB_STALE_SECONDS)
+    return await db.db[IMPORT_JOBS_COLLECTION].find_one_and_update(
+        {"$or": [{"status": "queued"}, {"status": "running", "heartbeat_at": {"$lt": stale_before}}]},
+        {
+            "$set": {
+                "status": "running",
+                "worker": PROCESS_ID,
+                "run_started_at": now,
+                "run_rows": 0,
+                "heartbeat_at": now,
+                "updated_at": now,
+            },
+            "$inc": {"attempts": 1},
+        },
+        sort=[("created_at", ASCENDING)],
+        return_document=ReturnDocument.AFTER
+    )
+
+async def _commit_chunk(job: dict, rows: int, inserted: int, skipped: int, **fields) -> Optional[dict]:
+    """
+    Records a written chunk as committed and returns the updated job, or None when
+    another worker has taken the job over.
+    """
+    now = datetime.utcnow()
+    return await db.db[IMPORT_JOBS_COLLECTION].find_one_and_update(
+        {"_id": job["_id"], "worker": PROCESS_ID, "status": "running"},
+        {
+            "$inc": {"committed_chunks": 1, "rows_processed": rows, "run_rows": rows, "inserted": inserted, "skipped": skipped},
+            "$set": {"heartbeat_at": now, "updated_at": now, **fields},
+        },
+        return_document=ReturnDocument.AFTER
+    )
+
+async def _keep_alive(job: dict):
+    """
+    Refreshes the job's heartbeat while it runs, independently of chunk commits,
+    so a slow chunk is not mistaken for a crashed worker and claimed again.
+    """
+    while True:
+        await asyncio.sleep(settings.IMPORT_JOB_STALE_SECONDS / 3)
+        try:
+            await db.db[IMPORT_JOBS_COLLECTION].update_one(
+                {"_id": job["_id"], "worker": PROCESS_ID, "status": "running"},
+                {"$set": {"heartbeat_at": datetime.utcnow()}}
+            )
+        except Exception as e:
+            logger.error(f"Could not refresh the heartbeat of import job {job['_id']}: {e}")
+
+async def _finish(job: dict, status: str, **fields):
+    now = datetime.utcnow()
+    job = await db.db[IMPORT_JOBS_COLLECTION].find_one_and_update(
+        {"_id": job["_id"], "worker": PROCESS_ID},
+        {"$set": {"status": status, "updated_at": now, "finished_at": now, **fields}},
+        return_document=ReturnDocument.AFTER
+    )
+    if job:
+        logger.info(f"Import job {job['_id']} {status}: {job['rows_processed']} rows processed, {job['inserted']} inserted.")
+
+async def _run_csv_import(job: dict) -> Optional[dict]:
+    """Imports the job's CSV chunk by chunk after its last committed chunk. Returns the job, or None if taken over."""
+    with tempfile.SpooledTemporaryFile(max_size=1024 * 1024) as spooled:
+        await _files_bucket().download_to_stream(job["file_id"], spooled)
+        spooled.seek(0)
+        chunks = CoinMarketCapCSVImporter.iter_csv_chunks(
+            io.TextIOWrapper(spooled, encoding="utf-8", newline=""), settings.CSV_IMPORT_CHUNK_SIZE
+        )
+        # Committed chunks are parsed again but not written
+        for _ in range(job["committed_chunks"]):
+            await asyncio.to_thread(next, chunks, None)
+
+        while not job.get("cancel_requested"):
+            chunk = await asyncio.to_thread(next, chunks, None)
+            if not chunk:
+                break
+            inserted_documents, skipped = await import_csv_chunk(job["wallet_id"], str(job["_id"]), chunk)
+            job = await _commit_chunk(job, len(chunk), len(inserted_documents), skipped)
+            if job is None:
+                return None
+    return job
+
+async def _run_blockchain_import(job: dict) -> Optional[dict]:
+    """Syncs the job's address chunk by chunk, continuing after the last committed chunk. Returns the job, or None if taken over."""
+    wallet_id = job["wallet_id"]
+    chunk_cursor = {}
+    # Without known txids every transaction of a chunk is parsed, so its last txid is where the chunk ended
+    async for synced_chunk in iter_synced_transaction_chunks(
+        job["wallet_address"], cursor=chunk_cursor, last_seen_txid=job.get("resume_txid")
+    ):
+        inserted_transactions = await insert_blockchain_transactions(wallet_id, synced_chunk, str(job["_id"]))
+        await store_synced_transactions(wallet_id, synced_chunk)
+        job = await _commit_chunk(
+            job, len(synced_chunk), len(inserted_transactions), len(synced_chunk) - len(inserted_transactions),
+            resume_txid=synced_chunk[-1]["txid"],
+            # The first chunk holds the newest transaction; it stays the wallet's sync cursor
+            sync_cursor=job.get("sync_cursor") or dict(chunk_cursor)
+        )
+        if job is None or job.get("cancel_requested"):
+            return job
+
+    if job.get("sync_cursor"):
+        await db.db.wallets.update_one({"_id": ObjectId(wallet_id)}, {"$set": {"sync_cursor": job["sync_cursor"]}})
+    return job
+
+async def run_import_job(job: dict):
+    """
+    Runs a claimed job to completion, cancellation or failure, keeping its heartbeat
+    fresh meanwhile. Invalid CSV rows fail the job and discard what it wrote; any other
+    error keeps the committed chunks so the job can be resumed.
+    """
+    heartbeat = asyncio.create_task(_keep_alive(job))
+    try:
+        await _run_import_job(job)
+    finally:
+        heartbeat.cancel()
+        with suppress(asyncio.CancelledError):
+            await heartbeat
+
+async def _run_import_job(job: dict):
+    run = _run_csv_import if job["kind"] == "csv" else _run_blockchain_import
+    try:
+        finished = job if job.get("cancel_requested") else await run(job)
+    except ValueError as e:
+        await _discard_import(job)
+        await _finish(job, "failed", error=str(e), discarded=True)
+        await _delete_import_file(job)
+        return
+    except Exception as e:
+        logger.error(f"Import job {job['_id']} failed: {e}")
+        job = await db.db[IMPORT_JOBS_COLLECTION].find_one({"_id": job["_id"]}) or job
+        await _settle_holdings(job)
+        await _finish(job, "failed", error=getattr(e, "detail", None) or str(e))
+        return
+    if finished is None:
+        logger.info(f"Import job {job['_id']} was taken over by another worker.")
+        return
+
+    job = finished
+    if job.get("attempts", 1) > 1:
+        # An earlier run may have written a chunk without committing it; its rows were skipped this time
+        await rebuild_wallet_ledger(job["wallet_id"])
+    await _settle_holdings(job)
+    if job.get("cancel_requested"):
+        await _finish(job, "cancelled", cancel_requested=False)
+        return
+    await _finish(job, "completed")
+    await _delete_import_file(job)
+
+async def _import_worker():
+    while True:
+        try:
+            job = await claim_import_job()
+        except Exception as e:
+            logger.error(f"Could not claim an import job: {e}")
+            job = None
+        if job is None:
+            with suppress(asyncio.TimeoutError):
+                await asyncio.wait_for(import_job_submitted.wait(), settings.IMPORT_JOB_POLL_SECONDS)
+            import_job_submitted.clear()
+            continue
+        await run_import_job(job)
+
+async def run_import_workers():
+    """
+    Runs IMPORT_JOB_CONCURRENCY import workers. Every process running background jobs
+    runs them; jobs are claimed atomically, so each runs in one worker at a time.
+    """
+    await asyncio.gather(*(_import_worker() for _ in range(settings.IMPORT_JOB_CONCURRENCY)))
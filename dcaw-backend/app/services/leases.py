@@ -0,0 +1,143 @@
+import asyncio
+import logging
+import os
+import socket
+import time
+import uuid
+from contextlib import asynccontextmanager, suppress
+from datetime import datetime, timedelta
+from typing import Awaitable, Callable, Optional
+from pymongo import ASCENDING, ReturnDocument
+from pymongo.errors import DuplicateKeyError
+from app.core.config import settings
+from app.db.connection import db
+
+logging.basicConfig(level=logging.INFO)
+logger = logging.getLogger(__name__)
+
+LEASE_COLLECTION = "job_leases"
+# Identifies this process as a lease owner (unique across hosts, workers and restarts)
+PROCESS_ID = f"{socket.gethostname()}:{os.getpid()}:{uuid.uuid4().hex[:8]}"
+
+async def ensure_lease_indexes():
+    """Expired leases are purged by Mongo; an expired lease can be taken over anyway."""
+    await db.db[LEASE_COLLECTION].create_index([("expires_at", ASCENDING)], expireAfterSeconds=0)
+
+async def acquire_lease(name: str, ttl_seconds: float, owner: str = PROCESS_ID) -> bool:
+    """
+    Takes (or renews) the lease `name` for `ttl_seconds`. Succeeds when the lease is free,
+    expired or already owned by `owner` (this process by default); the filter and the
+    write are one atomic upsert, so at most one owner can hold a lease at a time.
+    """
+    now = datetime.utcnow()
+    try:
+        lease = await db.db[LEASE_COLLECTION].find_one_and_update(
+            {"_id": name, "$or": [{"owner": owner}, {"expires_at": {"$lte": now}}]},
+            {"$set": {"owner": owner, "expires_at": now + timedelta(seconds=ttl_seconds), "renewed_at": now}},
+            upsert=True,
+            return_document=ReturnDocument.AFTER
+        )
+    except DuplicateKeyError:
+        # The lease exists and belongs to another process
+        return False
+    return lease is not None
+
+async def release_lease(name: str, owner: str = PROCESS_ID):
+    """Gives up the lease `name` if `owner` holds it, so another one can take over at once."""
+    await db.db[LEASE_COLLECTION].delete_one({"_id": name, "owner": owner})
+
+async def _cancel(task: Optional[asyncio.Task]):
+    if task is not None and not task.done():
+        task.cancel()
+        with suppress(asyncio.CancelledError):
+            await task
+
+async def _renew_lease(name: str, ttl_seconds: float, owner: str):
+    while True:
+        await asyncio.sleep(ttl_seconds / 3)
+        try:
+            await acquire_lease(name, ttl_seconds, owner)
+        except Exception as e:
+            logger.error(f"Could not renew lease '{name}': {e}")
+
+@asynccontextmanager
+async def hold_lease(name: str, ttl_seconds: Optional[float] = None, poll_seconds: float = 0.05):
+    """
+    Mutual exclusion across processes and coroutines: waits until the lease `name` can be
+    taken under an owner id of its own, keeps renewing it while the block runs and releases
+    it on exit. Meant for short critical sections; an owner that dies holds it for one TTL.
+    """
+    ttl = ttl_seconds or settings.JOB_LEASE_TTL_SECONDS
+    owner = f"{PROCESS_ID}:{uuid.uuid4().hex[:8]}"
+    while not await acquire_lease(name, ttl, owner):
+        await asyncio.sleep(poll_seconds)
+    renew_task = asyncio.create_task(_renew_lease(name, ttl, owner))
+    try:
+        yield
+    finally:
+        await _cancel(renew_task)
+        with suppress(Exception):
+            await release_lease(name, owner)
+
+async def run_with_lease(
+    name: str,
+    job: Callable[[], Awaitable],
+    standby: Optional[Callable[[], Awaitable]] = None,
+    ttl_seconds: Optional[float] = None
+):
+    """
+    Runs the long-running `job` only while this process holds the lease `name`.
+    The leader renews the lease every third of its TTL; every other process retries
+    at the same pace, running `standby` (if given) meanwhile. When the leader dies its
+    lease expires and another process takes over; a leader that cannot renew in time
+    stops its job, so the job never runs in two processes for longer than one TTL.
+    """
+    ttl = ttl_seconds or settings.JOB_LEASE_TTL_SECONDS
+    interval = ttl / 3
+    job_task = None
+    standby_task = None
+    try:
+        while True:
+            try:
+                acquired = await acquire_lease(name, ttl)
+            except Exception as e:
+                logger.error(f"Could not acquire lease '{name}': {e}")
+                acquired = False
+
+            if not acquired:
+                if standby is not None and (standby_task is None or standby_task.done()):
+                    standby_task = asyncio.create_task(standby())
+                await asyncio.sleep(interval)
+                continue
+
+            await _cancel(standby_task)
+            logger.info(f"Lease '{name}' acquired by {PROCESS_ID}; starting job.")
+            job_task = asyncio.create_task(job())
+            renewed_at = time.monotonic()
+            while not job_task.done():
+                await asyncio.wait({job_task}, timeout=interval)
+                if job_task.done():
+                    break
+                try:
+                    if not await acquire_lease(name, ttl):
+                        logger.warning(f"Lease '{name}' was taken over; stopping job.")
+                        break
+                    renewed_at = time.monotonic()
+                except Exception as e:
+                    logger.error(f"Could not renew lease '{name}': {e}")
+                    # Stop before the lease can expire and be taken by another process
+                    if time.monotonic() - renewed_at >= ttl - interval:
+                        logger.warning(f"Lease '{name}' could not be renewed in time; stopping job.")
+                        break
+
+            await _cancel(job_task)
+            if not job_task.cancelled() and job_task.exception():
+                logger.error(f"Job '{name}' failed: {job_task.exception()}")
+                with suppress(Exception):
+                    await release_lease(name)
+            await asyncio.sleep(interval)
+    finally:
+        await _cancel(job_task)
+        await _cancel(standby_task)
+        with suppress(Exception):
+            await release_lease(name)
@@ -0,0 +1,221 @@
+import argparse
+import asyncio
+import logging
+from datetime import datetime, timezone
+from pymongo import ASCENDING, DESCENDING, UpdateOne
+from app.db.connection import db, connect_db, close_db
+from app.services.leases import hold_lease
+from app.services.portfolio_cache import portfolio_cache
+
+logging.basicConfig(level=logging.INFO)
+logger = logging.getLogger(__name__)
+
+LEDGER_COLLECTION = "wallet_daily_ledger"
+REBUILD_BATCH_SIZE = 1000
+
+def is_inflow(transaction_type: str) -> bool:
+    """Returns True when a transaction type adds BTC to the wallet."""
+    return "buy" in transaction_type or "in" in transaction_type
+
+def balance_sign(transaction_type: str) -> float:
+    """Returns +1 for inflows, -1 for outflows and 0 for unknown transaction types."""
+    if is_inflow(transaction_type):
+        return 1.0
+    if "sell" in transaction_type or "out" in transaction_type:
+        return -1.0
+    return 0.0
+
+def _day_start(value: datetime) -> datetime:
+    """Returns the naive UTC midnight of the day containing `value`."""
+    if value.tzinfo is not None:
+        value = value.astimezone(timezone.utc).replace(tzinfo=None)
+    return value.replace(hour=0, minute=0, second=0, microsecond=0)
+
+def _signed_amounts(transaction: dict) -> tuple:
+    """Returns the (btc_delta, invested_delta) a transaction applies to the wallet."""
+    sign = balance_sign(transaction["transaction_type"])
+    return (
+        sign * transaction["amount_btc"],
+        sign * transaction["amount_btc"] * transaction["price_per_btc_usd"],
+    )
+
+def _daily_deltas(transactions: list) -> dict:
+    """Groups transactions by day into {day: [btc_delta, invested_delta]}."""
+    deltas = {}
+    for t in transactions:
+        btc_delta, invested_delta = _signed_amounts(t)
+        day = deltas.setdefault(_day_start(t["transaction_date"]), [0.0, 0.0])
+        day[0] += btc_delta
+        day[1] += invested_delta
+    return deltas
+
+async def ensure_ledger_indexes():
+    """Creates the indexes used to maintain and read the ledger."""
+    await db.db[LEDGER_COLLECTION].create_index([("wallet_id", ASCENDING), ("date", ASCENDING)], unique=True)
+    await db.db["transactions"].create_index([("wallet_id", ASCENDING), ("transaction_date", ASCENDING)])
+
+def _ledger_lease(wallet_id: str):
+    """Serializes every write to a wallet's ledger, across coroutines and processes."""
+    return hold_lease(f"wallet-ledger:{wallet_id}")
+
+async def _recompute_balances(wallet_id: str, first_day: datetime, now: datetime):
+    """Rewrites the running balances of every ledger day from `first_day` onwards."""
+    collection = db.db[LEDGER_COLLECTION]
+    previous = await collection.find_one(
+        {"wallet_id": wallet_id, "date": {"$lt": first_day}},
+        sort=[("date", DESCENDING)]
+    )
+    btc_balance = previous["btc_balance"] if previous else 0.0
+    invested_usd = previous["invested_usd"] if previous else 0.0
+
+    operations = []
+    async for row in collection.find({"wallet_id": wallet_id, "date": {"$gte": first_day}}).sort("date", ASCENDING):
+        btc_balance += row["btc_delta"]
+        invested_usd += row["invested_delta"]
+        operations.append(UpdateOne(
+            {"_id": row["_id"]},
+            {"$set": {"btc_balance": btc_balance, "invested_usd": invested_usd, "updated_at": now}}
+        ))
+    if operations:
+        await collection.bulk_write(operations, ordered=False)
+
+async def apply_transactions_to_ledger(wallet_id: str, transactions: list):
+    """
+    Adds newly inserted transactions to the wallet's daily ledger.
+    The day deltas are incremented and only the balances from the earliest new
+    transaction onwards are recomputed, so appending today's transactions touches
+    a single ledger row. Writers of the same wallet are serialized by a lease.
+    A wallet without ledger rows but with earlier transactions is rebuilt instead.
+    """
+    if not transactions:
+        return
+    # Every insert path goes through here, so this is where cached portfolio results expire.
+    portfolio_cache.invalidate_wallet(wallet_id)
+    collection = db.db[LEDGER_COLLECTION]
+    new_deltas = _daily_deltas(transactions)
+    first_day = min(new_deltas)
+
+    now = datetime.utcnow()
+    operations = [
+        UpdateOne(
+            {"wallet_id": wallet_id, "date": day},
+            {"$inc": {"btc_delta": btc_delta, "invested_delta": invested_delta}, "$set": {"updated_at": now}},
+            upsert=True
+        )
+        for day, (btc_delta, invested_delta) in new_deltas.items()
+    ]
+    async with _ledger_lease(wallet_id):
+        if not await collection.find_one({"wallet_id": wallet_id}, {"_id": 1}):
+            # A wallet whose history predates the ledger: deltas alone would start from zero
+            # and, once a row exists, the lazy backfill in get_opening_position never runs.
+            if await db.db["transactions"].count_documents({"wallet_id": wallet_id}) > len(transactions):
+                await _rebuild_wallet_ledger(wallet_id)
+                return
+        await collection.bulk_write(operations, ordered=False)
+        await _recompute_balances(wallet_id, first_day, now)
+
+async def _rebuild_wallet_ledger(wallet_id: str) -> int:
+    collection = db.db[LEDGER_COLLECTION]
+    portfolio_cache.invalidate_wallet(wallet_id)
+    await collection.delete_many({"wallet_id": wallet_id})
+
+    cursor = db.db["transactions"].find(
+        {"wallet_id": wallet_id},
+        {"_id": 0, "transaction_type": 1, "amount_btc": 1, "price_per_btc_usd": 1, "transaction_date": 1}
+    ).sort("transaction_date", 1)
+
+    now = datetime.utcnow()
+    btc_balance = invested_usd = 0.0
+    batch, written = [], 0
+    async for t in cursor:
+        day = _day_start(t["transaction_date"])
+        btc_delta, invested_delta = _signed_amounts(t)
+        btc_balance += btc_delta
+        invested_usd += invested_delta
+        if batch and batch[-1]["date"] == day:
+            row = batch[-1]
+            row["btc_delta"] += btc_delta
+            row["invested_delta"] += invested_delta
+        else:
+            if len(batch) >= REBUILD_BATCH_SIZE:
+                await collection.insert_many(batch)
+                written += len(batch)
+                batch = []
+            row = {"wallet_id": wallet_id, "date": day, "btc_delta": btc_delta, "invested_delta": invested_delta}
+            batch.append(row)
+        row["btc_balance"] = btc_balance
+        row["invested_usd"] = invested_usd
+        row["updated_at"] = now
+
+    if batch:
+        await collection.insert_many(batch)
+        written += len(batch)
+    return written
+
+async def rebuild_wallet_ledger(wallet_id: str) -> int:
+    """Rebuilds a wallet's ledger from its full transaction history. Returns the number of days written."""
+    async with _ledger_lease(wallet_id):
+        return await _rebuild_wallet_ledger(wallet_id)
+
+async def delete_wallet_ledger(wallet_id: str):
+    """Removes every ledger row of a wallet."""
+    portfolio_cache.invalidate_wallet(wallet_id)
+    async with _ledger_lease(wallet_id):
+        await db.db[LEDGER_COLLECTION].delete_many({"wallet_id": wallet_id})
+
+async def rebuild_all_ledgers():
+    """Rebuilds the ledger of every wallet that has transactions."""
+    wallet_ids = await db.db["transactions"].distinct("wallet_id")
+    for wallet_id in wallet_ids:
+        days = await rebuild_wallet_ledger(wallet_id)
+        logger.info(f"Rebuilt ledger for wallet {wallet_id}: {days} days.")
+
+async def get_ledger_version(wallet_id: str) -> str:
+    """
+    Returns a token that changes whenever transactions are applied to the wallet's
+    ledger, in any process: every update rewrites the last row's `updated_at`.
+    """
+    row = await db.db[LEDGER_COLLECTION].find_one(
+        {"wallet_id": wallet_id}, {"updated_at": 1}, sort=[("date", DESCENDING)]
+    )
+    return row["updated_at"].isoformat() if row else "empty"
+
+async def get_opening_position(wallet_id: str, day: datetime) -> tuple:
+    """
+    Returns the (btc_balance, invested_usd) at the end of the last ledger day before `day`.
+    Wallets with transactions but no ledger yet are backfilled on first read, once:
+    concurrent readers wait for the lease and find the ledger already built.
+    """
+    collection = db.db[LEDGER_COLLECTION]
+    if not await collection.find_one({"wallet_id": wallet_id}, {"_id": 1}):
+        if await db.db["transactions"].find_one({"wallet_id": wallet_id}, {"_id": 1}):
+            async with _ledger_lease(wallet_id):
+                if not await collection.find_one({"wallet_id": wallet_id}, {"_id": 1}):
+                    await _rebuild_wallet_ledger(wallet_id)
+
+    row = await collection.find_one(
+        {"wallet_id": wallet_id, "date": {"$lt": _day_start(day)}},
+        sort=[("date", DESCENDING)]
+    )
+    if not row:
+        return 0.0, 0.0
+    return row["btc_balance"], row["invested_usd"]
+
+async def _main():
+    parser = argparse.ArgumentParser(description="Rebuild the per-wallet daily balance ledger.")
+    parser.add_argument("--wallet-id", help="Rebuild only this wallet. Rebuilds every wallet when omitted.")
+    args = parser.parse_args()
+
+    await connect_db()
+    try:
+        await ensure_ledger_indexes()
+        if args.wallet_id:
+            days = await rebuild_wallet_ledger(args.wallet_id)
+            logger.info(f"Rebuilt ledger for wallet {args.wallet_id}: {days} days.")
+        else:
+            await rebuild_all_ledgers()
+    finally:
+        await close_db()
+
+if __name__ == "__main__":
+    asyncio.run(_main())
@@ -0,0 +1,63 @@
+from collections import OrderedDict
+from typing import Any, Optional
+from app.core.config import settings
+
+class PortfolioCache:
+    """
+    Size-bounded LRU cache for portfolio performance results.
+    Keys are (wallet_id, timespan, price_version) tuples. Every wallet has a
+    generation counter that is bumped on invalidation, so a result computed
+    while new transactions were being written is never stored.
+    """
+
+    def __init__(self, max_entries: int):
+        self.max_entries = max_entries
+        self._entries = OrderedDict()
+        self._generations = {}
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self.invalidations = 0
+
+    def generation(self, wallet_id: str) -> int:
+        return self._generations.get(wallet_id, 0)
+
+    def get(self, key: tuple) -> Optional[Any]:
+        value = self._entries.get(key)
+        if value is None:
+            self.misses += 1
+            return None
+        self._entries.move_to_end(key)
+        self.hits += 1
+        return value
+
+    def set(self, key: tuple, value: Any, generation: int):
+        """Stores `value` unless the wallet was invalidated after `generation` was read."""
+        if generation != self.generation(key[0]):
+            return
+        self._entries[key] = value
+        self._entries.move_to_end(key)
+        while len(self._entries) > self.max_entries:
+            self._entries.popitem(last=False)
+            self.evictions += 1
+
+    def invalidate_wallet(self, wallet_id: str):
+        """Drops every cached timespan of a wallet."""
+        self._generations[wallet_id] = self.generation(wallet_id) + 1
+        for key in [k for k in self._entries if k[0] == wallet_id]:
+            del self._entries[key]
+        self.invalidations += 1
+
+    def stats(self) -> dict:
+        lookups = self.hits + self.misses
+        return {
+            "entries": len(self._entries),
+            "max_entries": self.max_entries,
+            "hits": self.hits,
+            "misses": self.misses,
+            "hit_rate": self.hits / lookups if lookups else 0,
+            "evictions": self.evictions,
+            "invalidations": self.invalidations,
+        }
+
+portfolio_cache = PortfolioCache(settings.PORTFOLIO_CACHE_SIZE)
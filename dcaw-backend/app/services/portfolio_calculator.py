@@ -1,128 +1,112 @@
-from datetime import datetime, timedelta
-import requests
+from bisect import bisect_left
+from datetime import date, datetime, timedelta, timezone
+from typing import Optional
+import numpy as np
 from fastapi import HTTPException
 from app.db.connection import db
-from app.price_fetcher import get_coingecko_headers
-
-async def fetch_coingecko_market_chart(days: int, currency: str) -> list:
-    """Fetches historical market data from CoinGecko for a given number of days."""
-    url = f"https://api.coingecko.com/api/v3/coins/bitcoin/market_chart"
-    params = {"vs_currency": currency, "days": str(days)}
-    headers = get_coingecko_headers()
-    try:
-        response = requests.get(url, params=params, headers=headers)
-        response.raise_for_status()
-        return response.json().get("prices", [])
-    except requests.exceptions.RequestException as e:
-        raise HTTPException(status_code=503, detail=f"Error fetching data from CoinGecko: {e}")
-
-async def calculate_portfolio_performance(wallet_id: str, timespan: str):
+from app.services.ledger import balance_sign, get_opening_position, is_inflow
+from app.services.price_history import get_price_series
+
+TIMESPAN_DAYS = {"7d": 7, "30d": 30, "90d": 90, "365d": 365}
+
+def _prepare_prices(prices_usd: list) -> tuple:
+    """Converts a [timestamp_ms, price] series into (UTC day ordinals, prices) sorted by day."""
+    price_days = np.fromiter(
+        (datetime.fromtimestamp(p[0] / 1000, tz=timezone.utc).toordinal() for p in prices_usd),
+        dtype=np.int64, count=len(prices_usd)
+    )
+    price_values = np.fromiter((p[1] for p in prices_usd), dtype=float, count=len(prices_usd))
+    order = np.argsort(price_days, kind="stable")
+    return price_days[order], price_values[order]
+
+def _price_lookup(price_days: np.ndarray, price_values: np.ndarray, days: np.ndarray) -> list:
     """
-    Calculates portfolio history and performance summary for a specific wallet and timespan.
+    Joins a prepared price series against calendar day ordinals.
+    The last price point of each day wins; days without a price get 0.
     """
-    days_map = {"7d": 7, "30d": 30, "90d": 90, "365d": 365}
-    if timespan == "ALL":
-        transaction_collection = db.db["transactions"]
-        first_transaction = await transaction_collection.find({"wallet_id": wallet_id}).sort("transaction_date", 1).limit(1).to_list(length=1)
-        if not first_transaction:
-            raise ValueError("No transactions found for this wallet.")
-        first_transaction_date = first_transaction[0]["transaction_date"]
-        
-        days = (datetime.utcnow() - first_transaction_date).days
-        days = days + 1 if days > 0 else 1
-        
-        start_date = first_transaction_date.replace(hour=0, minute=0, second=0, microsecond=0)
-        end_date = datetime.utcnow()
-    elif timespan not in days_map:
-        raise ValueError("Invalid timespan.")
-    else:
-        days = days_map[timespan]
-        end_date = datetime.utcnow()
-        start_date = end_date - timedelta(days=days)
+    if not len(price_days):
+        return [0] * len(days)
 
-    prices_usd = await fetch_coingecko_market_chart(days, "usd")
-    if not prices_usd:
-        raise HTTPException(status_code=503, detail="Failed to fetch complete price data.")
-
-    transaction_collection = db.db["transactions"]
-    all_transactions = await transaction_collection.find({
-        "wallet_id": wallet_id,
-        "transaction_date": {"$lte": end_date}
-    }).sort("transaction_date", 1).to_list(length=None)
-
-    portfolio_history = []
-    daily_btc_balance = 0
-    total_invested_usd = 0
+    idx = np.searchsorted(price_days, days, side="right") - 1
+    found = idx >= 0
+    found[found] = price_days[idx[found]] == days[found]
+    return [price if ok else 0 for price, ok in zip(price_values[idx].tolist(), found.tolist())]
 
-    initial_transactions = [t for t in all_transactions if t["transaction_date"] < start_date]
-    for trans in initial_transactions:
-        if "buy" in trans["transaction_type"] or "in" in trans["transaction_type"]:
-            daily_btc_balance += trans["amount_btc"]
-            total_invested_usd += trans["amount_btc"] * trans["price_per_btc_usd"]
-        elif "sell" in trans["transaction_type"] or "out" in trans["transaction_type"]:
-            daily_btc_balance -= trans["amount_btc"]
-            total_invested_usd -= trans["amount_btc"] * trans["price_per_btc_usd"]
-
-    price_map = {datetime.fromtimestamp(p[0] / 1000).strftime('%Y-%m-%d'): p[1] for p in prices_usd}
+def _prepare_transactions(transactions: list, opening_btc_balance: float = 0.0, opening_invested_usd: float = 0.0) -> dict:
+    """
+    Replays a sorted transaction list once into the arrays every timespan window reads:
+    cumulative balances and invested amounts, signed values and the history entries.
+    """
+    count = len(transactions)
+    types = [t["transaction_type"] for t in transactions]
+    amounts = np.fromiter((t["amount_btc"] for t in transactions), dtype=float, count=count)
+    values = np.fromiter((t["amount_btc"] * t["price_per_btc_usd"] for t in transactions), dtype=float, count=count)
+    balance_signs = np.fromiter((balance_sign(t) for t in types), dtype=float, count=count)
 
-    transactions_in_timespan = [t for t in all_transactions if t["transaction_date"] >= start_date]
-    transactions_by_day = {}
-    
-    contributions_during_period = 0
-    
-    for t in transactions_in_timespan:
-        day_str = t["transaction_date"].strftime('%Y-%m-%d')
-        if day_str not in transactions_by_day:
-            transactions_by_day[day_str] = []
-        
-        direction = "buy" if "buy" in t["transaction_type"] or "in" in t["transaction_type"] else "sell"
-        
-        transaction_value = t["amount_btc"] * t["price_per_btc_usd"]
-        if direction == "buy":
-            contributions_during_period += transaction_value
-            total_invested_usd += transaction_value
-        else:
-            contributions_during_period -= transaction_value
-            total_invested_usd -= transaction_value
-        
-        transactions_by_day[day_str].append({
+    return {
+        "dates": [t["transaction_date"] for t in transactions],
+        "days": np.fromiter((t["transaction_date"].toordinal() for t in transactions), dtype=np.int64, count=count),
+        "balances": np.cumsum(np.concatenate(([opening_btc_balance], amounts * balance_signs))),
+        "invested": np.cumsum(np.concatenate(([opening_invested_usd], values * balance_signs))),
+        # Inside a timespan everything that is not an inflow counts as a withdrawal.
+        "flows": values * np.fromiter((1.0 if is_inflow(t) else -1.0 for t in types), dtype=float, count=count),
+        "day_strs": [t["transaction_date"].strftime('%Y-%m-%d') for t in transactions],
+        "entries": [{
             "transaction_type": t["transaction_type"],
-            "direction": direction,
+            "direction": "buy" if is_inflow(t["transaction_type"]) else "sell",
             "amount_btc": t["amount_btc"],
             "price_per_btc_usd": t["price_per_btc_usd"],
             "currency": t["currency"],
             "transaction_date": t["transaction_date"].isoformat()
-        })
+        } for t in transactions],
+    }
 
-    current_day = start_date
-    while current_day <= end_date:
-        day_str = current_day.strftime('%Y-%m-%d')
-        
-        day_transactions_for_balance = [t for t in transactions_in_timespan if t["transaction_date"].strftime('%Y-%m-%d') == day_str]
-        for trans in day_transactions_for_balance:
-            if "buy" in trans["transaction_type"] or "in" in trans["transaction_type"]:
-                daily_btc_balance += trans["amount_btc"]
-            elif "sell" in trans["transaction_type"] or "out" in trans["transaction_type"]:
-                daily_btc_balance -= trans["amount_btc"]
-
-        btc_price_usd = price_map.get(day_str, 0)
-        portfolio_value_usd = daily_btc_balance * btc_price_usd
-        
+def _window_performance(timeline: dict, price_days: np.ndarray, price_values: np.ndarray, start_date: datetime, end_date: datetime) -> dict:
+    """
+    Builds the daily history and summary of one timespan from a prepared timeline.
+    Runs in O(days) plus vectorized work over the transactions inside the window.
+    """
+    split = bisect_left(timeline["dates"], start_date)
+
+    transactions_by_day = {}
+    for day_str, entry in zip(timeline["day_strs"][split:], timeline["entries"][split:]):
+        transactions_by_day.setdefault(day_str, []).append(entry)
+
+    day_count = max((end_date - start_date) // timedelta(days=1) + 1, 0)
+    if day_count == 0:
+        return {"portfolio_history": [], "summary": {}}
+
+    first_day = start_date.toordinal()
+    days = first_day + np.arange(day_count, dtype=np.int64)
+    daily_balances = timeline["balances"][split + np.searchsorted(timeline["days"][split:], days, side="right")]
+
+    lo = np.searchsorted(price_days, first_day, side="left")
+    hi = np.searchsorted(price_days, days[-1], side="right")
+    window_prices = price_values[lo:hi].tolist()
+    daily_prices = _price_lookup(price_days[lo:hi], price_values[lo:hi], days)
+    daily_values = (daily_balances * np.asarray(daily_prices, dtype=float)).tolist()
+    daily_balances = daily_balances.tolist()
+
+    portfolio_history = []
+    for day, btc_balance, btc_price_usd, portfolio_value_usd in zip(days.tolist(), daily_balances, daily_prices, daily_values):
+        day_str = date.fromordinal(day).isoformat()
         portfolio_history.append({
             "date": day_str,
             "btc_price_usd": btc_price_usd,
-            "btc_balance": daily_btc_balance,
+            "btc_balance": btc_balance,
             "portfolio_value_usd": portfolio_value_usd,
             "transactions": transactions_by_day.get(day_str, [])
         })
-        current_day += timedelta(days=1)
 
-    if not portfolio_history:
-        return {"portfolio_history": [], "summary": {}}
+    flows = timeline["flows"][split:]
+    invested = np.cumsum(np.concatenate(([timeline["invested"][split]], flows)))
+    contributions = np.cumsum(flows)
 
-    final_btc_balance = daily_btc_balance
+    final_btc_balance = daily_balances[-1]
+    btc_price_usd = daily_prices[-1]
     final_value_usd = final_btc_balance * btc_price_usd
-    total_invested = total_invested_usd
+    total_invested = float(invested[-1])
+    contributions_during_period = float(contributions[-1]) if len(contributions) else 0
 
     profit_loss_usd = final_value_usd - total_invested
     profit_loss_percent = (profit_loss_usd / total_invested * 100) if total_invested != 0 else 0
@@ -130,37 +114,114 @@ async def calculate_portfolio_performance(wallet_id: str, timespan: str):
     appreciation_usd = profit_loss_usd
     appreciation_percent = profit_loss_percent
 
-    btc_price_start = prices_usd[0][1] if prices_usd else 0
-    btc_price_end = prices_usd[-1][1] if prices_usd else 0
+    btc_price_start = window_prices[0] if window_prices else 0
+    btc_price_end = window_prices[-1] if window_prices else 0
     btc_price_change_percent = ((btc_price_end - btc_price_start) / btc_price_start * 100) if btc_price_start != 0 else 0
 
-    portfolio_values = [p["portfolio_value_usd"] for p in portfolio_history]
-    
+    portfolio_values = daily_values
     summary = {
         "appreciation_usd": appreciation_usd,
         "appreciation_percent": appreciation_percent,
         "profit_loss_usd": profit_loss_usd,
         "profit_loss_percent": profit_loss_percent,
-        
+
         "total_invested_usd": total_invested,
         "final_value_usd": final_value_usd,
-        
+
         "final_btc_balance": final_btc_balance,
         "average_buy_price_usd": total_invested / final_btc_balance if final_btc_balance > 0 else 0,
         "current_btc_price_usd": btc_price_usd,
         "btc_price_start": btc_price_start,
         "btc_price_end": btc_price_end,
         "btc_price_change_percent": btc_price_change_percent,
-        
+
         "max_value_usd": max(portfolio_values) if portfolio_values else 0,
         "min_value_usd": min(portfolio_values) if portfolio_values else 0,
         "average_value_usd": sum(portfolio_values) / len(portfolio_values) if portfolio_values else 0,
-        
+
         "contributions_during_period_usd": contributions_during_period
     }
 
     return {
-        "portfolio_history": portfolio_history, 
-        "summary": summary, 
+        "portfolio_history": portfolio_history,
+        "summary": summary,
         "transactions": transactions_by_day
     }
+
+def build_portfolio_performance(
+    transactions: list,
+    prices_usd: list,
+    start_date: datetime,
+    end_date: datetime,
+    opening_btc_balance: float = 0.0,
+    opening_invested_usd: float = 0.0
+) -> dict:
+    """
+    Builds the daily portfolio history and the performance summary for a timespan.
+    `transactions` must be sorted by `transaction_date` and end at `end_date`; the
+    opening balance and invested amount cover everything before the first of them.
+    Runs in O(days + transactions): balances come from a cumulative sum of signed
+    amounts and each day is joined to its price with a binary search.
+    """
+    timeline = _prepare_transactions(transactions, opening_btc_balance, opening_invested_usd)
+    return _window_performance(timeline, *_prepare_prices(prices_usd), start_date, end_date)
+
+async def _timespan_start_date(wallet_id: str, timespan: str, end_date: datetime) -> datetime:
+    """Returns the first instant covered by a timespan ending at `end_date`."""
+    if timespan == "ALL":
+        transaction_collection = db.db["transactions"]
+        first_transaction = await transaction_collection.find({"wallet_id": wallet_id}).sort("transaction_date", 1).limit(1).to_list(length=1)
+        if not first_transaction:
+            raise ValueError("No transactions found for this wallet.")
+        first_transaction_date = first_transaction[0]["transaction_date"]
+        return first_transaction_date.replace(hour=0, minute=0, second=0, microsecond=0)
+    if timespan not in TIMESPAN_DAYS:
+        raise ValueError("Invalid timespan.")
+    return end_date - timedelta(days=TIMESPAN_DAYS[timespan])
+
+async def calculate_portfolio_performance_multi(
+    wallet_id: str,
+    timespans: list,
+    prices_usd: Optional[list] = None,
+    end_date: Optional[datetime] = None
+) -> dict:
+    """
+    Calculates portfolio history and performance summary for several timespans of a wallet
+    in one pass: a single price series and a single transaction scan cover the widest
+    timespan, and every timespan is then cut from the same prepared timeline.
+    Callers processing many wallets can pass a shared `prices_usd` series (and the
+    `end_date` it was fetched for) as long as it covers the widest timespan.
+    Returns a dict keyed by timespan.
+    """
+    end_date = end_date or datetime.utcnow()
+    start_dates = {timespan: await _timespan_start_date(wallet_id, timespan, end_date) for timespan in timespans}
+    earliest_start = min(start_dates.values())
+
+    if prices_usd is None:
+        prices_usd = await get_price_series(earliest_start, end_date)
+    if not prices_usd:
+        raise HTTPException(status_code=503, detail="Failed to fetch complete price data.")
+
+    # Everything before the first day comes from the ledger; only the timespan itself is read.
+    start_day = earliest_start.replace(hour=0, minute=0, second=0, microsecond=0)
+    opening_btc_balance, opening_invested_usd = await get_opening_position(wallet_id, start_day)
+
+    transaction_collection = db.db["transactions"]
+    transactions = await transaction_collection.find({
+        "wallet_id": wallet_id,
+        "transaction_date": {"$gte": start_day, "$lte": end_date}
+    }).sort("transaction_date", 1).to_list(length=None)
+
+    timeline = _prepare_transactions(transactions, opening_btc_balance, opening_invested_usd)
+    price_days, price_values = _prepare_prices(prices_usd)
+    return {
+        timespan: _window_performance(timeline, price_days, price_values, start_date, end_date)
+        for timespan, start_date in start_dates.items()
+    }
+
+async def calculate_portfolio_performance(wallet_id: str, timespan: str):
+    """
+    Calculates portfolio history and performance summary for a specific wallet and timespan.
+    """
+    results = await calculate_portfolio_performance_multi(wallet_id, [timespan])
+    return results[timespan]
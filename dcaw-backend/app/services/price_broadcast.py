@@ -0,0 +1,67 @@
+import asyncio
+import json
+from typing import Optional
+from app.core.config import settings
+
+class PriceBroadcastHub:
+    """
+    Fans out price ticks to every connected stream client.
+    Each tick is serialized once and put on a small per-client queue. A client
+    whose queue is full is too slow to keep up: it is dropped (its queue gets a
+    final None) instead of having ticks buffered for it.
+    """
+
+    def __init__(self, queue_size: int):
+        self.queue_size = queue_size
+        self._subscribers = set()
+        self._latest = None
+        self.published = 0
+        self.dropped = 0
+
+    def subscribe(self) -> asyncio.Queue:
+        """Registers a client. Its queue starts with the latest tick, when there is one."""
+        queue = asyncio.Queue(maxsize=self.queue_size)
+        if self._latest is not None:
+            queue.put_nowait(self._latest)
+        self._subscribers.add(queue)
+        return queue
+
+    def unsubscribe(self, queue: asyncio.Queue):
+        self._subscribers.discard(queue)
+
+    def publish(self, price_data: dict):
+        """Sends a tick to every client, dropping the ones that have fallen behind."""
+        message = json.dumps(price_data)
+        self._latest = message
+        self.published += 1
+        for queue in list(self._subscribers):
+            try:
+                queue.put_nowait(message)
+            except asyncio.QueueFull:
+                self._drop(queue)
+
+    def _drop(self, queue: asyncio.Queue):
+        self._subscribers.discard(queue)
+        while not queue.empty():
+            queue.get_nowait()
+        queue.put_nowait(None)
+        self.dropped += 1
+
+    def stats(self) -> dict:
+        return {
+            "subscribers": len(self._subscribers),
+            "published": self.published,
+            "dropped": self.dropped,
+        }
+
+price_hub = PriceBroadcastHub(settings.PRICE_STREAM_QUEUE_SIZE)
+
+async def next_message(queue: asyncio.Queue, timeout: float) -> Optional[str]:
+    """
+    Waits for the next tick of a subscription. Returns "" when nothing arrived
+    within `timeout` (time for a keep-alive) and None when the client was dropped.
+    """
+    try:
+        return await asyncio.wait_for(queue.get(), timeout)
+    except asyncio.TimeoutError:
+        return ""
@@ -0,0 +1,45 @@
+import asyncio
+import time
+from typing import Optional
+from app.core.config import settings
+from app.services.coingecko import fetch_btc_prices
+
+class LatestPriceCache:
+    """
+    Keeps the latest price tick in memory. Fresh ticks come from the price
+    fetching scheduler; when the tick is older than `max_age_seconds`, concurrent
+    readers share a single upstream fetch instead of each calling CoinGecko.
+    """
+
+    def __init__(self, max_age_seconds: int):
+        self.max_age_seconds = max_age_seconds
+        self._data = None
+        self._updated_at = None
+        self._refresh_task = None
+
+    def update(self, price_data: dict):
+        self._data = price_data
+        self._updated_at = time.monotonic()
+
+    def is_fresh(self) -> bool:
+        return self._data is not None and time.monotonic() - self._updated_at < self.max_age_seconds
+
+    async def get(self) -> Optional[dict]:
+        """Returns the latest prices, refreshing them from CoinGecko at most once when stale."""
+        if self.is_fresh():
+            return self._data
+        if self._refresh_task is None:
+            self._refresh_task = asyncio.create_task(self._refresh())
+        # shield: a cancelled request must not cancel the fetch other requests are waiting on
+        return await asyncio.shield(self._refresh_task)
+
+    async def _refresh(self) -> Optional[dict]:
+        try:
+            price_data = await fetch_btc_prices()
+            if price_data:
+                self.update(price_data)
+            return price_data
+        finally:
+            self._refresh_task = None
+
+latest_price_cache = LatestPriceCache(settings.LATEST_PRICE_MAX_AGE_SECONDS)
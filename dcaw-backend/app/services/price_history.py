@@ -0,0 +1,196 @@
+import logging
+from datetime import datetime, timedelta, timezone
+from fastapi import HTTPException
+from pymongo import ASCENDING, UpdateOne
+from app.core.config import settings
+from app.db.connection import db
+from app.services.coingecko import fetch_coingecko_market_chart, fetch_coingecko_market_chart_range
+
+logging.basicConfig(level=logging.INFO)
+logger = logging.getLogger(__name__)
+
+PRICE_HISTORY_COLLECTION = "btc_price_history"
+# CoinGecko has no BTC prices before this day, so older days are never requested upstream.
+PRICE_HISTORY_START = datetime(2013, 4, 28)
+# Days an upstream fetch could not fill, with the time they may be requested again
+PRICE_HISTORY_MISSES_COLLECTION = "btc_price_history_misses"
+
+def _day_start(value: datetime) -> datetime:
+    """Returns the naive UTC midnight of the day containing `value`."""
+    if value.tzinfo is not None:
+        value = value.astimezone(timezone.utc).replace(tzinfo=None)
+    return value.replace(hour=0, minute=0, second=0, microsecond=0)
+
+def _daily_closes(prices: list) -> dict:
+    """Reduces a CoinGecko [timestamp_ms, price] series to the last price of each UTC day."""
+    closes = {}
+    for timestamp_ms, price in prices:
+        day = _day_start(datetime.fromtimestamp(timestamp_ms / 1000, tz=timezone.utc))
+        closes[day] = price
+    return closes
+
+async def _store_daily_closes(closes: dict):
+    """Upserts one document per day into the price history collection."""
+    if not closes:
+        return
+    now = datetime.utcnow()
+    await db.db[PRICE_HISTORY_COLLECTION].bulk_write([
+        UpdateOne({"date": day}, {"$set": {"price_usd": price, "updated_at": now}}, upsert=True)
+        for day, price in closes.items()
+    ], ordered=False)
+
+async def ensure_price_history_indexes():
+    """Creates the unique daily index used by the range queries; expired misses are purged by Mongo."""
+    await db.db[PRICE_HISTORY_COLLECTION].create_index([("date", ASCENDING)], unique=True)
+    await db.db[PRICE_HISTORY_MISSES_COLLECTION].create_index([("expires_at", ASCENDING)], expireAfterSeconds=0)
+
+def _oldest_fetchable_day() -> datetime:
+    """The oldest day CoinGecko can serve: its BTC history start, or the plan's window."""
+    if not settings.COINGECKO_HISTORY_MAX_DAYS:
+        return PRICE_HISTORY_START
+    return max(PRICE_HISTORY_START, _day_start(datetime.utcnow()) - timedelta(days=settings.COINGECKO_HISTORY_MAX_DAYS))
+
+async def _fetchable_missing_days(days: list) -> list:
+    """
+    Keeps the missing `days` worth asking CoinGecko for: inside the window it serves
+    and not recently attempted without success. Returns them sorted.
+    """
+    oldest = _oldest_fetchable_day()
+    today = _day_start(datetime.utcnow())
+    days = [day for day in days if oldest <= day <= today]
+    if not days:
+        return []
+    cursor = db.db[PRICE_HISTORY_MISSES_COLLECTION].find(
+        {"_id": {"$in": days}, "expires_at": {"$gt": datetime.utcnow()}}, {"_id": 1}
+    )
+    recently_missed = {doc["_id"] async for doc in cursor}
+    return sorted(day for day in days if day not in recently_missed)
+
+async def _record_misses(days: list):
+    """Remembers days an upstream fetch did not fill, so requests stop refetching them until the retry time."""
+    if not days:
+        return
+    now = datetime.utcnow()
+    expires_at = now + timedelta(seconds=settings.PRICE_HISTORY_RETRY_SECONDS)
+    await db.db[PRICE_HISTORY_MISSES_COLLECTION].bulk_write([
+        UpdateOne({"_id": day}, {"$set": {"attempted_at": now, "expires_at": expires_at}}, upsert=True)
+        for day in days
+    ], ordered=False)
+
+async def record_daily_price(price_usd: float, timestamp: datetime):
+    """Stores `price_usd` as the latest known (closing) price of the day containing `timestamp`."""
+    await _store_daily_closes({_day_start(timestamp): price_usd})
+
+async def sync_price_history():
+    """
+    Backfills the full daily price history on first run and afterwards only
+    fetches the days missing since the last stored day.
+    """
+    try:
+        await ensure_price_history_indexes()
+        collection = db.db[PRICE_HISTORY_COLLECTION]
+        latest = await collection.find_one({}, sort=[("date", -1)])
+        today = _day_start(datetime.utcnow())
+
+        if latest is None:
+            logger.info("Price history is empty. Backfilling full daily BTC history from CoinGecko...")
+            prices = await fetch_coingecko_market_chart("max", "usd")
+        elif latest["date"] < today:
+            days = (today - latest["date"]).days + 1
+            logger.info(f"Extending price history with the last {days} days...")
+            prices = await fetch_coingecko_market_chart(days, "usd")
+        else:
+            return
+
+        closes = _daily_closes(prices)
+        await _store_daily_closes(closes)
+        logger.info(f"Price history synced: {len(closes)} days stored.")
+    except Exception as e:
+        logger.error(f"Failed to sync price history: {e}")
+
+async def get_price_series_version() -> str:
+    """
+    Returns a token that changes whenever the stored series changes at its tip
+    (a new day is added or today's close is updated) and at every UTC midnight.
+    """
+    today = f"{datetime.utcnow():%Y-%m-%d}"
+    latest = await db.db[PRICE_HISTORY_COLLECTION].find_one({}, {"date": 1, "updated_at": 1}, sort=[("date", -1)])
+    if not latest:
+        return f"{today}:empty"
+    return f"{today}:{latest['date']:%Y-%m-%d}@{latest.get('updated_at', latest['date']).isoformat()}"
+
+async def get_price_series(start_date: datetime, end_date: datetime) -> list:
+    """
+    Returns the daily BTC/USD series between two dates as [timestamp_ms, price] pairs,
+    one per UTC day. Reads the local store with a single range query and only calls
+    CoinGecko when some days of the range are missing. Days CoinGecko cannot serve
+    (older than its window, or gaps in its data) are not requested again until
+    PRICE_HISTORY_RETRY_SECONDS after a failed attempt.
+    """
+    start_day = _day_start(start_date)
+    end_day = _day_start(end_date)
+
+    cursor = db.db[PRICE_HISTORY_COLLECTION].find(
+        {"date": {"$gte": start_day, "$lte": end_day}},
+        {"_id": 0, "date": 1, "price_usd": 1}
+    ).sort("date", 1)
+    prices = {doc["date"]: doc["price_usd"] for doc in await cursor.to_list(length=None)}
+
+    missing = await _fetchable_missing_days([
+        day for day in (start_day + timedelta(days=i) for i in range((end_day - start_day).days + 1))
+        if day not in prices
+    ])
+    if missing:
+        days = (_day_start(datetime.utcnow()) - missing[0]).days + 1
+        try:
+            closes = _daily_closes(await fetch_coingecko_market_chart(days, "usd"))
+        except HTTPException:
+            if not prices:
+                raise
+            logger.error(f"Could not fill missing price days from {missing[0]:%Y-%m-%d}; using stored prices only.")
+            closes = {}
+        await _store_daily_closes(closes)
+        await _record_misses([day for day in missing if day not in closes])
+        for day, price in closes.items():
+            if start_day <= day <= end_day:
+                prices.setdefault(day, price)
+
+    return [
+        [int(day.replace(tzinfo=timezone.utc).timestamp() * 1000), prices[day]]
+        for day in sorted(prices)
+    ]
+
+async def resolve_historical_prices(timestamps: list) -> list:
+    """
+    Resolves the BTC/USD price for a batch of transaction timestamps in one call.
+    Timestamps are deduplicated by UTC day and read from the daily price store with
+    a single query; days missing from the store are fetched with one CoinGecko range
+    request and persisted. Returns the prices in the order of `timestamps`, with 0.0
+    for days that have no price, so a missing price never breaks a calculation.
+    """
+    days = {_day_start(ts) for ts in timestamps}
+    if not days:
+        return []
+
+    cursor = db.db[PRICE_HISTORY_COLLECTION].find(
+        {"date": {"$in": list(days)}},
+        {"_id": 0, "date": 1, "price_usd": 1}
+    )
+    prices = {doc["date"]: doc["price_usd"] for doc in await cursor.to_list(length=None)}
+
+    missing = await _fetchable_missing_days([day for day in days if day not in prices])
+    if missing:
+        try:
+            closes = _daily_closes(await fetch_coingecko_market_chart_range(
+                missing[0], min(missing[-1] + timedelta(days=1, seconds=-1), datetime.utcnow()), "usd"
+            ))
+        except HTTPException as e:
+            logger.error(f"Could not fetch historical prices for {len(missing)} days: {e.detail}")
+            closes = {}
+        await _store_daily_closes(closes)
+        await _record_misses([day for day in missing if day not in closes])
+        for day in missing:
+            if day in closes:
+                prices[day] = closes[day]
+
+    return [prices.get(_day_start(ts), 0.0) for ts in timestamps]
@@ -0,0 +1,164 @@
+import logging
+from datetime import datetime, timedelta, timezone
+from typing import Optional
+from pymongo import ASCENDING
+from app.db.connection import db
+from app.services.price_history import PRICE_HISTORY_COLLECTION, record_daily_price
+
+logging.basicConfig(level=logging.INFO)
+logger = logging.getLogger(__name__)
+
+# Storage tiers, finest first. Every tier is rolled up from the one before it and
+# expires after its retention; the daily tier is the persistent price history.
+PRICE_TIERS = [
+    {"name": "1m", "collection": "btc_price_1m", "seconds": 60, "retention": timedelta(days=1), "granularity": "minutes"},
+    {"name": "10m", "collection": "btc_price_10m", "seconds": 600, "retention": timedelta(days=30), "granularity": "minutes"},
+    {"name": "1h", "collection": "btc_price_1h", "seconds": 3600, "retention": timedelta(days=365), "granularity": "hours"},
+    {"name": "1d", "collection": PRICE_HISTORY_COLLECTION, "seconds": 86400, "retention": None, "granularity": None},
+]
+MAX_CHART_POINTS = 500
+EPOCH = datetime(1970, 1, 1)
+
+# Last bucket rolled up into each tier by this process, to avoid re-checking on every tick.
+_rolled_up = {}
+
+def _to_naive_utc(value: datetime) -> datetime:
+    if value.tzinfo is not None:
+        value = value.astimezone(timezone.utc).replace(tzinfo=None)
+    return value
+
+def _bucket_start(value: datetime, seconds: int) -> datetime:
+    """Floors a naive UTC datetime to the start of its `seconds`-wide bucket."""
+    return EPOCH + timedelta(seconds=int((value - EPOCH).total_seconds()) // seconds * seconds)
+
+async def initialize_price_tiers():
+    """Creates the time-series collections of the intraday tiers with their expiry."""
+    existing = await db.db.list_collection_names()
+    for tier in PRICE_TIERS:
+        if tier["retention"] is None or tier["collection"] in existing:
+            continue
+        await db.db.create_collection(
+            tier["collection"],
+            timeseries={"timeField": "timestamp", "metaField": "meta", "granularity": tier["granularity"]},
+            expireAfterSeconds=int(tier["retention"].total_seconds()),
+        )
+        await db.db[tier["collection"]].create_index([("timestamp", ASCENDING)])
+        print(f"Created time-series collection '{tier['collection']}'.")
+
+async def _rollup(source: dict, target: dict, bucket: datetime) -> Optional[dict]:
+    """Aggregates one `target` bucket from the `source` tier. Returns the stored document."""
+    target_collection = db.db[target["collection"]]
+    if await target_collection.find_one({"timestamp": bucket}, {"_id": 1}):
+        return None
+
+    pipeline = [
+        {"$match": {"timestamp": {"$gte": bucket, "$lt": bucket + timedelta(seconds=target["seconds"])}}},
+        {"$sort": {"timestamp": 1}},
+        {"$group": {
+            "_id": None,
+            "open": {"$first": {"$ifNull": ["$open", "$btc_usd_price"]}},
+            "close": {"$last": "$btc_usd_price"},
+            "high": {"$max": {"$ifNull": ["$high", "$btc_usd_price"]}},
+            "low": {"$min": {"$ifNull": ["$low", "$btc_usd_price"]}},
+            "btc_brl_price": {"$last": "$btc_brl_price"},
+            "samples": {"$sum": {"$ifNull": ["$samples", 1]}},
+        }},
+    ]
+    groups = await db.db[source["collection"]].aggregate(pipeline).to_list(length=1)
+    if not groups or groups[0]["close"] is None:
+        return None
+
+    group = groups[0]
+    document = {
+        "timestamp": bucket,
+        "meta": {"source": "rollup"},
+        "btc_usd_price": group["close"],
+        "btc_brl_price": group["btc_brl_price"],
+        "open": group["open"],
+        "high": group["high"],
+        "low": group["low"],
+        "samples": group["samples"],
+    }
+    await target_collection.insert_one(document)
+    return document
+
+async def record_price_tick(price_data: dict):
+    """
+    Stores a price tick in the 1-minute tier and rolls up every coarser bucket
+    that the tick has closed. Each completed 10-minute bucket also updates the
+    day's close in the daily tier.
+    """
+    timestamp = _to_naive_utc(datetime.fromisoformat(price_data["last_updated"]))
+    await db.db[PRICE_TIERS[0]["collection"]].insert_one({
+        "timestamp": timestamp,
+        "meta": {"source": "coingecko"},
+        "btc_usd_price": price_data["btc_usd_price"],
+        "btc_brl_price": price_data["btc_brl_price"],
+    })
+
+    for source, target in zip(PRICE_TIERS[:-2], PRICE_TIERS[1:-1]):
+        bucket = _bucket_start(timestamp, target["seconds"]) - timedelta(seconds=target["seconds"])
+        if _rolled_up.get(target["name"]) == bucket:
+            continue
+        document = await _rollup(source, target, bucket)
+        _rolled_up[target["name"]] = bucket
+        if document and target["name"] == "10m":
+            await record_daily_price(document["btc_usd_price"], bucket)
+
+async def get_latest_price_tick() -> Optional[dict]:
+    """Returns the most recent stored tick in the shape of `fetch_btc_prices`, or None."""
+    tick = await db.db[PRICE_TIERS[0]["collection"]].find_one({}, sort=[("timestamp", -1)])
+    if not tick:
+        return None
+    btc_usd = tick["btc_usd_price"]
+    btc_brl = tick["btc_brl_price"]
+    return {
+        "btc_usd_price": btc_usd,
+        "btc_brl_price": btc_brl,
+        "usd_brl_calculated": round(btc_brl / btc_usd, 4) if btc_usd else 0,
+        "last_updated": tick["timestamp"].replace(tzinfo=timezone.utc).isoformat()
+    }
+
+def select_price_tier(start: datetime, end: datetime, resolution_seconds: Optional[int] = None) -> dict:
+    """
+    Picks the coarsest tier that still meets the requested resolution (seconds between
+    points) and keeps data back to `start`. Without a resolution, the one that keeps
+    the range under MAX_CHART_POINTS points is used.
+    """
+    if resolution_seconds is None:
+        resolution_seconds = (end - start).total_seconds() / MAX_CHART_POINTS
+    now = datetime.utcnow()
+    available = [t for t in PRICE_TIERS if t["retention"] is None or start >= now - t["retention"]]
+    meeting = [t for t in available if t["seconds"] <= resolution_seconds]
+    return meeting[-1] if meeting else available[0]
+
+async def get_price_range(start: datetime, end: Optional[datetime] = None, resolution_seconds: Optional[int] = None) -> dict:
+    """
+    Returns the BTC price points between `start` and `end` (default: now) from the
+    tier chosen by `select_price_tier`. Raises ValueError for an empty range.
+    """
+    start = _to_naive_utc(start)
+    end = _to_naive_utc(end) if end else datetime.utcnow()
+    if start >= end:
+        raise ValueError("'start' must be before 'end'.")
+    tier = select_price_tier(start, end, resolution_seconds)
+    collection = db.db[tier["collection"]]
+
+    if tier["retention"] is None:
+        cursor = collection.find(
+            {"date": {"$gte": _bucket_start(start, tier["seconds"]), "$lte": end}},
+            {"_id": 0, "date": 1, "price_usd": 1}
+        ).sort("date", 1)
+        points = [{"timestamp": doc["date"], "btc_usd_price": doc["price_usd"]} async for doc in cursor]
+    else:
+        cursor = collection.find(
+            {"timestamp": {"$gte": start, "$lte": end}},
+            {"_id": 0, "timestamp": 1, "btc_usd_price": 1, "btc_brl_price": 1}
+        ).sort("timestamp", 1)
+        points = await cursor.to_list(length=None)
+
+    return {
+        "tier": tier["name"],
+        "resolution_seconds": tier["seconds"],
+        "points": points,
+    }
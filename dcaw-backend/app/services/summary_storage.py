@@ -1,11 +1,16 @@
 import logging
 from datetime import datetime, timezone
+from pymongo import ASCENDING, UpdateOne
 from app.db.connection import db
 
 # Configuração do logger
 logging.basicConfig(level=logging.INFO)
 logger = logging.getLogger(__name__)
 
+async def ensure_summary_indexes():
+    """Cria o índice usado para verificar e gravar summaries por carteira, timespan e data."""
+    await db.db["daily_summaries"].create_index([("wallet_id", ASCENDING), ("timespan", ASCENDING), ("date", ASCENDING)])
+
 async def check_summary_exists(wallet_id: str, timespan: str, date_str: str) -> bool:
     """Verifica se um summary para uma carteira, timespan e data específicos já existe."""
     daily_summaries_collection = db.db["daily_summaries"]
@@ -40,3 +45,23 @@ async def save_daily_summary(wallet_id: str, timespan: str, summary_data: dict):
 
     except Exception as e:
         logger.error(f"Failed to save daily summary for wallet {wallet_id} ({timespan}): {e}")
+
+async def save_daily_summaries(documents: list) -> int:
+    """
+    Salva vários summaries em um único bulk write. Cada documento precisa de
+    wallet_id, timespan, date e summary; os que já existem para a data são ignorados.
+    Retorna quantos summaries foram inseridos.
+    """
+    if not documents:
+        return 0
+    now = datetime.now(timezone.utc)
+    operations = [
+        UpdateOne(
+            {"wallet_id": doc["wallet_id"], "timespan": doc["timespan"], "date": doc["date"]},
+            {"$setOnInsert": {**doc, "created_at": now}},
+            upsert=True
+        )
+        for doc in documents
+    ]
+    result = await db.db["daily_summaries"].bulk_write(operations, ordered=False)
+    return result.upserted_count
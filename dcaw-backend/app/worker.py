@@ -0,0 +1,71 @@
+"""
+Background worker: runs the price fetcher, the DCA scheduler, the daily summary job and
+the import jobs outside the API processes, so heavy jobs never share an event loop with
+user requests.
+
+Usage: python -m app.worker (with RUN_BACKGROUND_JOBS=false on the API processes).
+Several workers can run at once; each job still runs in one process at a time.
+"""
+import asyncio
+from dotenv import load_dotenv
+from app.db.connection import connect_db, close_db, get_database_client
+from app.core.http import init_http_client, close_http_client
+from app.price_fetcher import price_fetching_scheduler, price_follower
+from app.scheduler import init_scheduler
+from app.services.dca_service import ensure_dca_schedule, run_dca_scheduler, wait_for_next_dca_execution
+from app.services.blockchain_sync import ensure_transaction_indexes, migrate_embedded_synced_transactions
+from app.services.csv_importer import backfill_import_fingerprints, ensure_import_indexes
+from app.services.import_jobs import ensure_import_job_indexes, run_import_workers
+from app.services.leases import ensure_lease_indexes, run_with_lease
+from app.services.ledger import ensure_ledger_indexes
+from app.services.summary_storage import ensure_summary_indexes
+
+async def start_dca_scheduler():
+    """Starts the DCA background scheduler."""
+    db_client = await get_database_client()
+    await ensure_dca_schedule()
+    while True:
+        next_execution_at = await run_dca_scheduler(db_client)
+        # Sleeps until the next configuration is due (or DCA settings change)
+        await wait_for_next_dca_execution(next_execution_at)
+
+def start_background_jobs(follow_prices: bool = False) -> list:
+    """
+    Starts every background job and returns their tasks. With several workers/replicas
+    each job runs in the process holding its lease, while import jobs are claimed one by
+    one by the import workers of every process. `follow_prices` makes the processes that
+    do not fetch prices feed their price cache and live stream from the database.
+    """
+    init_scheduler()  # Initialize the new summary scheduler
+    return [
+        asyncio.create_task(run_with_lease("dca-scheduler", start_dca_scheduler)),
+        asyncio.create_task(run_with_lease(
+            "price-fetcher", price_fetching_scheduler, standby=price_follower if follow_prices else None
+        )),
+        asyncio.create_task(run_import_workers()),
+    ]
+
+async def main():
+    load_dotenv()
+    await connect_db()
+    await init_http_client()
+    try:
+        await ensure_ledger_indexes()
+        await ensure_transaction_indexes()
+        await migrate_embedded_synced_transactions()
+        await ensure_import_indexes()
+        await backfill_import_fingerprints()
+        await ensure_import_job_indexes()
+        await ensure_summary_indexes()
+        await ensure_lease_indexes()
+        print("DCA Wallet background worker started.")
+        await asyncio.gather(*start_background_jobs())
+    finally:
+        await close_http_client()
+        await close_db()
+
+if __name__ == "__main__":
+    try:
+        asyncio.run(main())
+    except KeyboardInterrupt:
+        print("DCA Wallet background worker stopped.")
@@ -0,0 +1,33 @@
+import pytest
+from pymongo import DeleteOne, InsertOne, UpdateOne
+from pymongo.results import BulkWriteResult
+from app.db.connection import db
+
+async def _bulk_write(collection, requests, ordered=True, **kwargs):
+    """Runs a bulk write one request at a time; mongomock's own bulk_write predates pymongo 4.9."""
+    inserted = matched = modified = upserted = 0
+    for request in requests:
+        if isinstance(request, InsertOne):
+            await collection.insert_one(request._doc)
+            inserted += 1
+        elif isinstance(request, UpdateOne):
+            result = await collection.update_one(request._filter, request._doc, upsert=request._upsert)
+            matched += result.matched_count
+            modified += result.modified_count
+            upserted += result.upserted_id is not None
+        elif isinstance(request, DeleteOne):
+            await collection.delete_one(request._filter)
+        else:
+            raise NotImplementedError(type(request).__name__)
+    return BulkWriteResult({
+        "nInserted": inserted, "nMatched": matched, "nModified": modified,
+        "nUpserted": upserted, "nRemoved": 0, "upserted": [],
+    }, True)
+
+@pytest.fixture
+def mongo(monkeypatch):
+    """Points `db.db` at an empty in-memory database for the duration of a test."""
+    mongomock_motor = pytest.importorskip("mongomock_motor")
+    monkeypatch.setattr(mongomock_motor.AsyncMongoMockCollection, "bulk_write", _bulk_write)
+    monkeypatch.setattr(db, "db", mongomock_motor.AsyncMongoMockClient()["test"])
+    return db.db
@@ -0,0 +1,29 @@
+import asyncio
+from app.models.transaction import TransactionCreate
+from app.services.csv_importer import CoinMarketCapCSVImporter, backfill_import_fingerprints
+
+HEADER = ",".join(CoinMarketCapCSVImporter.REQUIRED_HEADERS)
+BUY = "2024-03-01 10:00:00,BTC,buy,60000,0.01,600,0.5,USD,"
+OTHER = "2024-03-01 10:00:00,BTC,buy,61000,0.01,610,0.5,USD,"
+SELL = "2024-02-01 09:30:00,BTC,sell,50000,0.02,1000,--,--,rebalance"
+CSV = "\n".join([HEADER, BUY, OTHER, BUY, SELL, BUY]) + "\n"
+
+def test_identical_rows_get_distinct_fingerprints_anywhere_in_the_file():
+    rows = CoinMarketCapCSVImporter.parse_csv(CSV)
+    fingerprints = [row["fingerprint"] for row in rows]
+    assert len(set(fingerprints)) == len(rows)
+    # A re-upload numbers the same rows the same way
+    assert fingerprints == [row["fingerprint"] for row in CoinMarketCapCSVImporter.parse_csv(CSV)]
+
+def test_backfill_matches_the_fingerprints_of_a_new_upload(mongo):
+    async def scenario():
+        rows = CoinMarketCapCSVImporter.parse_csv(CSV)
+        # Rows imported before fingerprints existed
+        await mongo.transactions.insert_many([TransactionCreate(**row, wallet_id="w").dict() for row in rows])
+
+        await backfill_import_fingerprints()
+
+        stored = await mongo.transactions.distinct("fingerprint", {"wallet_id": "w"})
+        assert sorted(stored) == sorted(row["fingerprint"] for row in rows)
+
+    asyncio.run(scenario())
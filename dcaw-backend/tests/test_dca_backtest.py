@@ -0,0 +1,47 @@
+from datetime import datetime, timedelta, timezone
+import pytest
+from app.services.dca_backtest import run_backtest
+
+def daily_prices(start: datetime, prices: list) -> list:
+    """A [timestamp_ms, price] series with one point per day from `start`."""
+    return [
+        [int((start + timedelta(days=i)).replace(tzinfo=timezone.utc).timestamp() * 1000), price]
+        for i, price in enumerate(prices)
+    ]
+
+def test_monthly_purchase_waits_for_first_in_band_day_of_the_month():
+    # January: out of band on the 1st and 2nd, in band from the 3rd. February: in band on the 1st.
+    prices = [150.0, 120.0, 80.0, 90.0] + [200.0] * 27 + [50.0, 60.0]
+    result, = run_backtest(daily_prices(datetime(2024, 1, 1), prices), [{
+        "dca_frequency": "monthly",
+        "dca_amount": 100.0,
+        "dca_price_range_min": None,
+        "dca_price_range_max": 100.0,
+    }])
+    assert result["purchases"] == 2
+    assert result["invested_usd"] == 200.0
+    assert result["btc_accumulated"] == pytest.approx(100.0 / 80.0 + 100.0 / 50.0)
+
+def test_monthly_purchase_is_skipped_when_no_day_of_the_month_is_in_band():
+    prices = [150.0] * 31 + [150.0, 90.0]
+    result, = run_backtest(daily_prices(datetime(2024, 1, 1), prices), [{
+        "dca_frequency": "monthly",
+        "dca_amount": 100.0,
+        "dca_price_range_max": 100.0,
+    }])
+    assert result["purchases"] == 1
+    assert result["btc_accumulated"] == pytest.approx(100.0 / 90.0)
+
+def test_daily_and_unbounded_configurations():
+    prices = [100.0, 0.0, 200.0, 50.0]
+    daily, bounded, monthly = run_backtest(daily_prices(datetime(2024, 1, 30), prices), [
+        {"dca_frequency": "daily", "dca_amount": 10.0},
+        {"dca_frequency": "daily", "dca_amount": 10.0, "dca_price_range_min": 60.0, "dca_price_range_max": 150.0},
+        {"dca_frequency": "monthly", "dca_amount": 10.0},
+    ])
+    # Days without a price never buy
+    assert daily["purchases"] == 3
+    assert bounded["purchases"] == 1
+    # 30 Jan and 1 Feb open a month each
+    assert monthly["purchases"] == 2
+    assert monthly["btc_accumulated"] == pytest.approx(10.0 / 100.0 + 10.0 / 200.0)
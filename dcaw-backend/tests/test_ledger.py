@@ -0,0 +1,55 @@
+import asyncio
+from datetime import datetime, timedelta, timezone
+import pytest
+from app.services.ledger import apply_transactions_to_ledger, get_opening_position
+
+def transaction(wallet_id: str, transaction_type: str, amount_btc: float, price: float, date: datetime) -> dict:
+    return {
+        "wallet_id": wallet_id,
+        "transaction_type": transaction_type,
+        "amount_btc": amount_btc,
+        "price_per_btc_usd": price,
+        "currency": "USD",
+        "transaction_date": date,
+    }
+
+def test_first_write_to_a_wallet_with_history_keeps_the_history(mongo):
+    async def scenario():
+        # Transactions stored before the ledger existed
+        history = [
+            transaction("w", "manual_buy", 1.0, 10_000.0, datetime(2024, 1, 1, 12)),
+            transaction("w", "manual_sell", 0.25, 20_000.0, datetime(2024, 2, 1, 12)),
+        ]
+        await mongo.transactions.insert_many([dict(t) for t in history])
+
+        new = transaction("w", "dca_buy", 0.5, 30_000.0, datetime(2024, 3, 1, 12))
+        await mongo.transactions.insert_one(dict(new))
+        await apply_transactions_to_ledger("w", [new])
+
+        assert await get_opening_position("w", datetime(2024, 2, 15)) == pytest.approx((0.75, 5_000.0))
+        assert await get_opening_position("w", datetime(2024, 3, 2)) == pytest.approx((1.25, 20_000.0))
+
+    asyncio.run(scenario())
+
+def test_concurrent_writes_and_mixed_timezones(mongo):
+    async def scenario():
+        start = datetime(2024, 5, 1)
+        transactions = [
+            transaction("w", "manual_buy", 0.1, 1_000.0 * (i + 1), start + timedelta(hours=7 * i))
+            for i in range(30)
+        ]
+        for t in transactions[::3]:
+            t["transaction_date"] = t["transaction_date"].replace(tzinfo=timezone.utc)
+
+        async def write(chunk: list):
+            await mongo.transactions.insert_many([dict(t) for t in chunk])
+            await apply_transactions_to_ledger("w", chunk)
+
+        await write(transactions[:5])
+        await asyncio.gather(*(write(transactions[i:i + 5]) for i in range(5, 30, 5)))
+
+        btc_balance, invested_usd = await get_opening_position("w", start + timedelta(days=30))
+        assert btc_balance == pytest.approx(3.0)
+        assert invested_usd == pytest.approx(sum(0.1 * 1_000.0 * (i + 1) for i in range(30)))
+
+    asyncio.run(scenario())
@@ -0,0 +1,173 @@
+import random
+from datetime import datetime, timedelta, timezone
+import pytest
+from app.services.portfolio_calculator import build_portfolio_performance
+
+TRANSACTION_TYPES = ["manual_buy", "manual_sell", "dca_buy", "blockchain_in", "blockchain_out", "cmc_buy", "cmc_sell"]
+
+def reference_portfolio_performance(all_transactions: list, prices_usd: list, start_date: datetime, end_date: datetime) -> dict:
+    """
+    The day-by-day loop `calculate_portfolio_performance` used before the vectorized engine,
+    minus the database and CoinGecko reads. Price timestamps are read as UTC.
+    """
+    portfolio_history = []
+    daily_btc_balance = 0
+    total_invested_usd = 0
+
+    initial_transactions = [t for t in all_transactions if t["transaction_date"] < start_date]
+    for trans in initial_transactions:
+        if "buy" in trans["transaction_type"] or "in" in trans["transaction_type"]:
+            daily_btc_balance += trans["amount_btc"]
+            total_invested_usd += trans["amount_btc"] * trans["price_per_btc_usd"]
+        elif "sell" in trans["transaction_type"] or "out" in trans["transaction_type"]:
+            daily_btc_balance -= trans["amount_btc"]
+            total_invested_usd -= trans["amount_btc"] * trans["price_per_btc_usd"]
+
+    price_map = {datetime.fromtimestamp(p[0] / 1000, tz=timezone.utc).strftime('%Y-%m-%d'): p[1] for p in prices_usd}
+
+    transactions_in_timespan = [t for t in all_transactions if t["transaction_date"] >= start_date]
+    transactions_by_day = {}
+
+    contributions_during_period = 0
+
+    for t in transactions_in_timespan:
+        day_str = t["transaction_date"].strftime('%Y-%m-%d')
+        if day_str not in transactions_by_day:
+            transactions_by_day[day_str] = []
+
+        direction = "buy" if "buy" in t["transaction_type"] or "in" in t["transaction_type"] else "sell"
+
+        transaction_value = t["amount_btc"] * t["price_per_btc_usd"]
+        if direction == "buy":
+            contributions_during_period += transaction_value
+            total_invested_usd += transaction_value
+        else:
+            contributions_during_period -= transaction_value
+            total_invested_usd -= transaction_value
+
+        transactions_by_day[day_str].append({
+            "transaction_type": t["transaction_type"],
+            "direction": direction,
+            "amount_btc": t["amount_btc"],
+            "price_per_btc_usd": t["price_per_btc_usd"],
+            "currency": t["currency"],
+            "transaction_date": t["transaction_date"].isoformat()
+        })
+
+    current_day = start_date
+    while current_day <= end_date:
+        day_str = current_day.strftime('%Y-%m-%d')
+
+        day_transactions_for_balance = [t for t in transactions_in_timespan if t["transaction_date"].strftime('%Y-%m-%d') == day_str]
+        for trans in day_transactions_for_balance:
+            if "buy" in trans["transaction_type"] or "in" in trans["transaction_type"]:
+                daily_btc_balance += trans["amount_btc"]
+            elif "sell" in trans["transaction_type"] or "out" in trans["transaction_type"]:
+                daily_btc_balance -= trans["amount_btc"]
+
+        btc_price_usd = price_map.get(day_str, 0)
+        portfolio_value_usd = daily_btc_balance * btc_price_usd
+
+        portfolio_history.append({
+            "date": day_str,
+            "btc_price_usd": btc_price_usd,
+            "btc_balance": daily_btc_balance,
+            "portfolio_value_usd": portfolio_value_usd,
+            "transactions": transactions_by_day.get(day_str, [])
+        })
+        current_day += timedelta(days=1)
+
+    if not portfolio_history:
+        return {"portfolio_history": [], "summary": {}}
+
+    final_btc_balance = daily_btc_balance
+    final_value_usd = final_btc_balance * btc_price_usd
+    total_invested = total_invested_usd
+
+    profit_loss_usd = final_value_usd - total_invested
+    profit_loss_percent = (profit_loss_usd / total_invested * 100) if total_invested != 0 else 0
+
+    btc_price_start = prices_usd[0][1] if prices_usd else 0
+    btc_price_end = prices_usd[-1][1] if prices_usd else 0
+    btc_price_change_percent = ((btc_price_end - btc_price_start) / btc_price_start * 100) if btc_price_start != 0 else 0
+
+    portfolio_values = [p["portfolio_value_usd"] for p in portfolio_history]
+
+    summary = {
+        "appreciation_usd": profit_loss_usd,
+        "appreciation_percent": profit_loss_percent,
+        "profit_loss_usd": profit_loss_usd,
+        "profit_loss_percent": profit_loss_percent,
+
+        "total_invested_usd": total_invested,
+        "final_value_usd": final_value_usd,
+
+        "final_btc_balance": final_btc_balance,
+        "average_buy_price_usd": total_invested / final_btc_balance if final_btc_balance > 0 else 0,
+        "current_btc_price_usd": btc_price_usd,
+        "btc_price_start": btc_price_start,
+        "btc_price_end": btc_price_end,
+        "btc_price_change_percent": btc_price_change_percent,
+
+        "max_value_usd": max(portfolio_values) if portfolio_values else 0,
+        "min_value_usd": min(portfolio_values) if portfolio_values else 0,
+        "average_value_usd": sum(portfolio_values) / len(portfolio_values) if portfolio_values else 0,
+
+        "contributions_during_period_usd": contributions_during_period
+    }
+
+    return {
+        "portfolio_history": portfolio_history,
+        "summary": summary,
+        "transactions": transactions_by_day
+    }
+
+def random_wallet(rng: random.Random, end_date: datetime, span_days: int) -> list:
+    """Random transactions of every type, sorted by date, spread over `span_days` before `end_date`."""
+    transactions = [{
+        "transaction_type": rng.choice(TRANSACTION_TYPES),
+        "amount_btc": rng.uniform(0.0001, 1),
+        "price_per_btc_usd": rng.uniform(1_000, 100_000),
+        "currency": "USD",
+        "transaction_date": end_date - timedelta(seconds=rng.randint(0, span_days * 86400))
+    } for _ in range(rng.randint(1, 200))]
+    return sorted(transactions, key=lambda t: t["transaction_date"])
+
+def random_prices(rng: random.Random, start_date: datetime, end_date: datetime) -> list:
+    """An irregular price series for the days of the timespan, with gaps and several points on some days."""
+    first_day = start_date.replace(hour=0, minute=0, second=0, microsecond=0)
+    timestamp = first_day.replace(tzinfo=timezone.utc).timestamp()
+    prices = []
+    while timestamp <= end_date.replace(tzinfo=timezone.utc).timestamp():
+        if rng.random() > 0.1:
+            prices.append([int(timestamp * 1000), rng.uniform(1_000, 100_000)])
+        timestamp += rng.choice([1, 5, 24, 30]) * 3600
+    return prices
+
+@pytest.mark.parametrize("seed", range(40))
+@pytest.mark.parametrize("timespan_days", [7, 30, 90, 365, None])
+def test_matches_reference_loop(seed: int, timespan_days):
+    rng = random.Random(seed)
+    end_date = datetime(2024, 6, 15, 13, 45, 12)
+    transactions = random_wallet(rng, end_date, rng.choice([3, 40, 400, 1500]))
+    if timespan_days is None:
+        # "ALL" starts at midnight of the first transaction
+        start_date = transactions[0]["transaction_date"].replace(hour=0, minute=0, second=0, microsecond=0)
+    else:
+        start_date = end_date - timedelta(days=timespan_days)
+    prices_usd = random_prices(rng, start_date, end_date)
+
+    expected = reference_portfolio_performance(transactions, prices_usd, start_date, end_date)
+    assert build_portfolio_performance(transactions, prices_usd, start_date, end_date) == expected
+
+    # The routes read the position before the timespan from the ledger instead of the transactions.
+    earlier = [t for t in transactions if t["transaction_date"] < start_date]
+    opening_btc_balance = opening_invested_usd = 0
+    for t in earlier:
+        sign = 1 if "buy" in t["transaction_type"] or "in" in t["transaction_type"] else -1
+        opening_btc_balance += sign * t["amount_btc"]
+        opening_invested_usd += sign * t["amount_btc"] * t["price_per_btc_usd"]
+    in_window = transactions[len(earlier):]
+    assert build_portfolio_performance(
+        in_window, prices_usd, start_date, end_date, opening_btc_balance, opening_invested_usd
+    ) == expected
@@ -0,0 +1,31 @@
+import asyncio
+from datetime import datetime, timedelta, timezone
+from app.services import price_history
+from app.services.price_history import get_price_series
+
+def test_days_upstream_cannot_fill_are_not_refetched_on_every_request(mongo, monkeypatch):
+    today = datetime.utcnow().replace(hour=0, minute=0, second=0, microsecond=0)
+    gap = today - timedelta(days=3)
+    calls = []
+
+    async def market_chart(days, currency):
+        calls.append(days)
+        # CoinGecko has a hole on `gap`
+        return [
+            [int((today - timedelta(days=i)).replace(tzinfo=timezone.utc).timestamp() * 1000), 100.0 + i]
+            for i in range(int(days)) if today - timedelta(days=i) != gap
+        ]
+
+    monkeypatch.setattr(price_history, "fetch_coingecko_market_chart", market_chart)
+
+    async def scenario():
+        first = await get_price_series(today - timedelta(days=5), today)
+        second = await get_price_series(today - timedelta(days=5), today)
+        # Older than the window the API serves: never requested
+        old = await get_price_series(today - timedelta(days=800), today - timedelta(days=790))
+        return first, second, old
+
+    first, second, old = asyncio.run(scenario())
+    assert calls == [6]
+    assert len(first) == 5 and first == second
+    assert old == []